@@ -8,6 +8,7 @@ import psycopg2
 import time
 import httpx
 import zipfile
+import zlib
 from datetime import datetime, timezone
 from boto3.dynamodb.conditions import Key
 
@@ -16,15 +17,22 @@ S3_BUCKET = os.environ.get("CHATLOGS_BUCKET")
 DB_SECRET_NAME = os.environ.get("SM_DB_CREDENTIALS")
 RDS_PROXY_ENDPOINT = os.environ.get("RDS_PROXY_ENDPOINT")
 TABLE_NAME = os.environ.get("TABLE_NAME")
+# Per-message history table; TABLE_NAME holds sessions that started before it
+MESSAGE_TABLE_NAME = os.environ.get("MESSAGE_TABLE_NAME")
+# Messages read per DynamoDB query page while exporting a session
+HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", "500"))
+# Prefix of a compressed message payload, as written by the text generation function
+COMPRESSION_MARKER = b"ZLIB1:"
 APPSYNC_API_URL = os.environ.get("APPSYNC_API_URL")
 API_KEY = os.environ.get("API_KEY")
 
-if not TABLE_NAME:
-    raise ValueError("TABLE_NAME environment variable is required but not set.")
+if not MESSAGE_TABLE_NAME:
+    raise ValueError("MESSAGE_TABLE_NAME environment variable is required but not set.")
 
 # Initialize AWS Clients
 dynamodb = boto3.resource("dynamodb")
-table = dynamodb.Table(TABLE_NAME)
+message_table = dynamodb.Table(MESSAGE_TABLE_NAME)
+table = dynamodb.Table(TABLE_NAME) if TABLE_NAME else None
 s3_client = boto3.client("s3")
 secrets_manager_client = boto3.client("secretsmanager")
 
@@ -193,40 +201,86 @@ def safe_parse_timestamp(timestamp):
         except ValueError:
             return None  # If it still fails, return None
 
-def fetch_chat_messages(session_id, table):
+def decode_message(value):
+    """
+    Return the LangChain message dict stored in a message item's 'Message' attribute,
+    which is either a JSON string or a zlib stream behind COMPRESSION_MARKER, and
+    the sizes in bytes of the stored attribute and of the message JSON.
+    """
+    if isinstance(value, str):
+        size = len(value.encode("utf-8"))
+        return json.loads(value), size, size
+    data = bytes(value.value)
+    if not data.startswith(COMPRESSION_MARKER):
+        raise ValueError("Unknown history payload encoding")
+    payload = zlib.decompress(data[len(COMPRESSION_MARKER):])
+    return json.loads(payload.decode("utf-8")), len(data), len(payload)
+
+def iter_history(session_id, sizes=None):
+    """
+    Yield the messages of a session, oldest first, as LangChain message dicts.
+
+    Messages are stored one item per message and read HISTORY_PAGE_SIZE at a time,
+    so a long session is never held as one DynamoDB response. A session with no
+    message items is read from the single-item table instead. If a `sizes` dict is
+    given, the stored and uncompressed bytes read are added to its "stored" and
+    "raw" counts.
+    """
+    query = {
+        "KeyConditionExpression": Key("SessionId").eq(session_id),
+        "Limit": HISTORY_PAGE_SIZE,
+    }
+    found = False
+    while True:
+        response = message_table.query(**query)
+        for item in response.get("Items", []):
+            found = True
+            message, stored_bytes, raw_bytes = decode_message(item["Message"])
+            if sizes is not None:
+                sizes["stored"] = sizes.get("stored", 0) + stored_bytes
+                sizes["raw"] = sizes.get("raw", 0) + raw_bytes
+            yield message
+        if "LastEvaluatedKey" not in response:
+            break
+        query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    if not found and table is not None:
+        try:
+            item = table.get_item(Key={"SessionId": session_id}).get("Item")
+        except table.meta.client.exceptions.ResourceNotFoundException:
+            return
+        if item:
+            yield from item.get("History", [])
+
+def fetch_chat_messages(session_id, sizes=None):
     """Fetch user & AI messages from DynamoDB for a given session_id."""
     try:
         logger.info(f"Fetching messages for session {session_id}")
 
-        response = table.query(KeyConditionExpression=Key("SessionId").eq(session_id))
-
         formatted_messages = []
         
-        for item in response["Items"]:
-            history = item.get("History", [])
+        for entry in iter_history(session_id, sizes):
+            message_type = entry.get("type", "unknown")  # 'human' or 'ai'
+            content = entry.get("data", {}).get("content", "").strip()
+            
+            if not content:
+                continue  # Skip empty messages
+
+            if message_type == "human":
+                content = clean_human_content(content)
             
-            for entry in history:
-                message_type = entry.get("type", "unknown")  # 'human' or 'ai'
-                content = entry.get("data", {}).get("content", "").strip()
-                
-                if not content:
-                    continue  # Skip empty messages
-
-                if message_type == "human":
-                    content = clean_human_content(content)
-                
-                main_content, questions = extract_content_and_questions(content)
-
-                formatted_message = {
-                    "SessionId": session_id,
-                    "MessageType": "ai" if message_type == "ai" else "user",
-                    "Message": main_content,
-                    "Options": questions,
-                    "Timestamp": None,  # Will be updated later
-                    "UserRole": ""  # Placeholder, will be updated later
-                }
-
-                formatted_messages.append(formatted_message)
+            main_content, questions = extract_content_and_questions(content)
+
+            formatted_message = {
+                "SessionId": session_id,
+                "MessageType": "ai" if message_type == "ai" else "user",
+                "Message": main_content,
+                "Options": questions,
+                "Timestamp": None,  # Will be updated later
+                "UserRole": ""  # Placeholder, will be updated later
+            }
+
+            formatted_messages.append(formatted_message)
 
         return formatted_messages
 
@@ -455,8 +509,10 @@ def handler(event, context):
             session_ids = fetch_all_session_ids()
 
             chat_data = []
+            # Stored and uncompressed bytes of the history read, to report the compression ratio
+            history_sizes = {}
             for session_id in session_ids:
-                chat_messages = fetch_chat_messages(session_id, table)
+                chat_messages = fetch_chat_messages(session_id, history_sizes)
                 session_timestamps = user_timestamps.get(session_id, {})
                 for message in chat_messages:
                     if message["MessageType"] == "user":
@@ -466,6 +522,12 @@ def handler(event, context):
                     # For AI messages, do not override the timestamp here (it will be fixed later)
                     chat_data.append(message)
             
+            if history_sizes.get("stored"):
+                logger.info(
+                    f"Read {history_sizes['stored']} bytes of stored history for {history_sizes['raw']} bytes "
+                    f"of messages (compression ratio {history_sizes['raw'] / history_sizes['stored']:.2f})."
+                )
+
             # NEW: Update AI messages with the last user timestamp so they are grouped in the proper month.
             chat_data = fill_ai_message_timestamps(chat_data)
             
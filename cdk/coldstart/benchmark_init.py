@@ -0,0 +1,105 @@
+"""
+Benchmark how long each handler takes to import in a fresh interpreter, which
+is the part of a Lambda cold start (the INIT phase) that the code controls.
+
+Every run starts a new Python process and times `import main` from the
+handler's source directory, so nothing is shared between runs. With --ref, the
+same handlers are exported from that git revision and measured alongside the
+working tree for a before/after comparison.
+
+Usage:
+    python benchmark_init.py --runs 15
+    python benchmark_init.py text_generation --ref HEAD~1
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import tarfile
+import tempfile
+
+from handlers import CDK_DIR, HANDLERS, resolve, run_in_handler
+
+TIMED_IMPORT = (
+    "import time; start = time.perf_counter(); import main; "
+    "print(f'{(time.perf_counter() - start) * 1000:.3f}')"
+)
+
+
+def measure(src_dir, runs):
+    """
+    Import a handler's main module in `runs` fresh interpreters.
+
+    Returns:
+        list: The import times in milliseconds, or None if the import failed.
+    """
+    timings = []
+    for _ in range(runs):
+        result = run_in_handler(src_dir, TIMED_IMPORT)
+        if result.returncode != 0:
+            print(result.stderr.strip())
+            return None
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return timings
+
+
+def summarize(timings):
+    """
+    Return (median, p90, min) in milliseconds.
+    """
+    ordered = sorted(timings)
+    p90 = ordered[min(len(ordered) - 1, int(round(0.9 * (len(ordered) - 1))))]
+    return statistics.median(ordered), p90, ordered[0]
+
+
+def export_revision(ref, names, destination):
+    """
+    Extract the handlers' source directories at a git revision into `destination`.
+    """
+    repo_root = subprocess.run(
+        ["git", "rev-parse", "--show-toplevel"], cwd=CDK_DIR, capture_output=True, text=True, check=True
+    ).stdout.strip()
+    prefix = os.path.relpath(CDK_DIR, repo_root)
+    paths = [f"{prefix}/{HANDLERS[name]}" for name in names]
+    archive = os.path.join(destination, "source.tar")
+    subprocess.run(["git", "archive", "--format=tar", "-o", archive, ref, *paths], cwd=repo_root, check=True)
+    with tarfile.open(archive) as tar:
+        tar.extractall(destination)
+    return {name: os.path.join(destination, prefix, HANDLERS[name]) for name in names}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("handlers", nargs="*", help="Handlers to benchmark (default: all)")
+    parser.add_argument("--runs", type=int, default=10, help="Fresh interpreters per handler")
+    parser.add_argument("--ref", help="Git revision to compare the working tree against")
+    args = parser.parse_args()
+
+    selected = resolve(args.handlers)
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline = export_revision(args.ref, [name for name, _ in selected], tmp) if args.ref else {}
+
+        header = f"{'handler':<30}{'median ms':>11}{'p90 ms':>9}{'min ms':>9}"
+        if args.ref:
+            header += f"{'ref median':>12}{'change':>9}"
+        print(header)
+
+        for name, src_dir in selected:
+            timings = measure(src_dir, args.runs)
+            if timings is None:
+                print(f"{name:<30}{'import failed':>29}")
+                continue
+            median, p90, fastest = summarize(timings)
+            row = f"{name:<30}{median:>11.0f}{p90:>9.0f}{fastest:>9.0f}"
+            if args.ref:
+                before = measure(baseline[name], args.runs)
+                if before is None:
+                    row += f"{'failed':>12}"
+                else:
+                    before_median = summarize(before)[0]
+                    row += f"{before_median:>12.0f}{(median - before_median) / before_median:>+9.0%}"
+            print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+The container-image Lambda handlers measured by the cold-start scripts, and
+how to import one of them in a fresh interpreter outside Lambda.
+"""
+import os
+import sys
+import subprocess
+
+CDK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Handler name -> source directory, relative to cdk/
+HANDLERS = {
+    "text_generation": "text_generation/src",
+    "comparison_text_generation": "comparison_text_generation/src",
+    "data_ingestion": "data_ingestion/src",
+    "comparison_data_ingestion": "comparison_data_ingestion/src",
+    "chatHistory": "chatHistory/src",
+}
+
+# Placeholder values for every variable a handler reads at import time. Nothing
+# contacts AWS while a module is imported, so they only need to be present.
+PLACEHOLDER_ENVIRONMENT = {
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "AWS_ACCESS_KEY_ID": "placeholder",
+    "AWS_SECRET_ACCESS_KEY": "placeholder",
+    "REGION": "us-east-1",
+    "SM_DB_CREDENTIALS": "placeholder",
+    "SM_DB_COMP_CREDENTIALS": "placeholder",
+    "RDS_PROXY_ENDPOINT": "localhost",
+    "RDS_PROXY_COMP_ENDPOINT": "localhost",
+    "BEDROCK_LLM_PARAM": "/placeholder/BedrockLLMId",
+    "EMBEDDING_MODEL_PARAM": "/placeholder/EmbeddingModelId",
+    "TABLE_NAME_PARAM": "/placeholder/TableName",
+    "TABLE_NAME": "placeholder",
+    "COMP_TEXT_GEN_QUEUE_URL": "https://sqs.us-east-1.amazonaws.com/123456789012/placeholder.fifo",
+    "APPSYNC_API_URL": "https://placeholder.appsync-api.us-east-1.amazonaws.com/graphql",
+    "APPSYNC_API_ID": "placeholder",
+    "API_KEY": "API_KEY",
+    "BUCKET": "placeholder",
+    "EMBEDDING_BUCKET_NAME": "placeholder",
+    "CHATLOGS_BUCKET": "placeholder",
+    "EVENT_NOTIFICATION_LAMBDA_NAME": "placeholder",
+}
+
+
+def run_in_handler(src_dir, code, python_args=()):
+    """
+    Run `code` in a fresh interpreter from a handler's source directory, as the
+    Lambda runtime would import it, and return the completed process.
+    """
+    environment = dict(os.environ)
+    for name, value in PLACEHOLDER_ENVIRONMENT.items():
+        environment.setdefault(name, value)
+    environment["PYTHONPATH"] = src_dir
+    environment["PYTHONDONTWRITEBYTECODE"] = "1"
+    return subprocess.run(
+        [sys.executable, *python_args, "-c", code],
+        cwd=src_dir,
+        env=environment,
+        capture_output=True,
+        text=True,
+    )
+
+
+def resolve(names):
+    """
+    Return (name, absolute source directory) for the named handlers, or all of them.
+    """
+    selected = names or list(HANDLERS)
+    unknown = [name for name in selected if name not in HANDLERS]
+    if unknown:
+        raise SystemExit(f"Unknown handler(s): {', '.join(unknown)}. Choose from: {', '.join(HANDLERS)}")
+    return [(name, os.path.join(CDK_DIR, HANDLERS[name])) for name in selected]
@@ -0,0 +1,66 @@
+"""
+Show which modules a handler's import costs, using `python -X importtime`.
+
+For every handler, prints the top-level packages that take the most time to
+import (summed over all of their submodules) and the slowest individual
+modules, both in milliseconds.
+
+Usage:
+    python profile_imports.py                      # every handler
+    python profile_imports.py text_generation --top 15
+"""
+import argparse
+from collections import defaultdict
+
+from handlers import resolve, run_in_handler
+
+
+def parse_importtime(stderr):
+    """
+    Parse `-X importtime` output into (module, self_us, cumulative_us, depth) rows.
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def profile(name, src_dir, top):
+    result = run_in_handler(src_dir, "import main", python_args=("-X", "importtime"))
+    rows = parse_importtime(result.stderr)
+    if result.returncode != 0:
+        # importtime output goes to stderr too; show only the traceback
+        error = "\n".join(line for line in result.stderr.splitlines() if not line.startswith("import time:"))
+        print(f"\n{name}: import failed\n{error}")
+        return
+
+    by_package = defaultdict(int)
+    for module, self_us, _, _ in rows:
+        by_package[module.split(".")[0]] += self_us
+    total_us = sum(by_package.values())
+
+    print(f"\n{name}: {total_us / 1000:.0f} ms to import main ({len(rows)} modules)")
+    print(f"  {'package':<32}{'ms':>9}{'share':>8}")
+    for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {package:<32}{self_us / 1000:>9.1f}{self_us / total_us:>8.0%}")
+
+    print(f"  {'slowest modules (self)':<32}{'ms':>9}")
+    for module, self_us, _, _ in sorted(rows, key=lambda row: -row[1])[:top]:
+        print(f"  {module[:32]:<32}{self_us / 1000:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("handlers", nargs="*", help="Handlers to profile (default: all)")
+    parser.add_argument("--top", type=int, default=10, help="Rows to show per table")
+    args = parser.parse_args()
+    for name, src_dir in resolve(args.handlers):
+        profile(name, src_dir, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,21 @@
+import os
 import logging
-import boto3
+from datetime import datetime, timezone
 from typing import Dict, Optional, Tuple
 import psycopg2
 from langchain_aws import BedrockEmbeddings
 from langchain_postgres import PGVector
 from processing.documents import process_documents
-
-# Create an S3 client using the boto3 library
-s3 = boto3.client('s3')
+from helpers.session_index import SessionIndexWriter
 
 # Setup logging at the INFO level for this module
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# "pgvector" stores session chunks in the comparison database, "memory" writes them
+# to S3 as a NumPy blob that the text generation Lambda searches in-process
+COMPARISON_INDEX_BACKEND = os.environ.get("COMPARISON_INDEX_BACKEND", "pgvector")
+
 def get_vectorstore(
     collection_name: str, 
     embeddings: BedrockEmbeddings, 
@@ -57,11 +60,13 @@ def get_vectorstore(
         # Log the initialization process
         logger.info("Initializing the VectorStore")
 
-        # Create the PGVector instance with the given parameters
+        # Create the PGVector instance with the given parameters. The creation time
+        # lets the comparison sweeper delete collections orphaned by failed evaluations.
         vectorstore = PGVector(
             embeddings=embeddings,
             collection_name=collection_name,
             connection=connection_string,
+            collection_metadata={"created_at": datetime.now(timezone.utc).isoformat()},
             use_jsonb=True
         )
         print(f"vectorstore in get_vectorstore")
@@ -81,8 +86,9 @@ def store_category_data(
     embeddings: BedrockEmbeddings
 ) -> str:
     """
-    Retrieve a PGVector store, then process and store documents from a given S3 bucket 
-    and category directory into the vector store.
+    Retrieve a PGVector store (or, when COMPARISON_INDEX_BACKEND is "memory", an 
+    S3-backed session index writer), then process and store documents from a given 
+    S3 bucket and category directory into it.
 
     Args:
         bucket (str): The name of the S3 bucket containing the documents.
@@ -99,6 +105,17 @@ def store_category_data(
               guardrail conflicts. 
             - Otherwise, an error message string if restricted content is detected.
     """
+    if COMPARISON_INDEX_BACKEND == "memory":
+        # Session data is short-lived, so skip the database entirely
+        return process_documents(
+            bucket=bucket,
+            category_id=category_id,
+            vectorstore=SessionIndexWriter(
+                session_id=vectorstore_config_dict['collection_name'],
+                embeddings=embeddings
+            )
+        )
+
     # Obtain the vectorstore instance and connection string using the config dictionary
     vectorstore, connection_string = get_vectorstore(
         collection_name=vectorstore_config_dict['collection_name'],
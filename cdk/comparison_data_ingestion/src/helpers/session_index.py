@@ -0,0 +1,104 @@
+import os
+import json
+import uuid
+import logging
+from io import BytesIO
+from typing import List
+
+import numpy as np
+from langchain_core.documents import Document
+
+from helpers.aws_clients import get_client
+
+# Setup logging at the INFO level for this module
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EMBEDDING_BUCKET_NAME = os.environ["EMBEDDING_BUCKET_NAME"]
+
+
+def get_session_index_prefix(session_id: str) -> str:
+    """
+    Build the S3 prefix under which the index parts of a comparison session are stored.
+
+    Args:
+        session_id (str): The comparison session ID.
+
+    Returns:
+        str: The S3 key prefix shared by all of the session's index blobs.
+    """
+    return f"comparison_index/{session_id}/"
+
+
+def get_session_index_key(session_id: str, part: str) -> str:
+    """
+    Build the S3 key of one part of a comparison session's in-memory index.
+
+    Args:
+        session_id (str): The comparison session ID.
+        part (str): The part name, unique per ingestion invocation.
+
+    Returns:
+        str: The S3 object key of the index blob.
+    """
+    return f"{get_session_index_prefix(session_id)}{part}.npz"
+
+
+class SessionIndexWriter:
+    """
+    Stand-in for PGVector that stores a comparison session's chunks as compressed
+    NumPy blobs in S3 instead of writing them to the comparison database.
+
+    Each writer owns one part of the session's index, so an ingestion invocation
+    never overwrites chunks stored by an earlier one for the same session; the
+    text generation Lambda loads every part under the session's prefix. A part
+    holds the L2-normalized embeddings (float16), the chunk texts and the
+    JSON-encoded chunk metadata, which is everything the text generation Lambda
+    needs to run a brute-force cosine search in memory.
+    """
+
+    def __init__(self, session_id: str, embeddings, bucket: str = EMBEDDING_BUCKET_NAME):
+        """
+        Args:
+            session_id (str): The comparison session ID, used to name the blobs.
+            embeddings (BedrockEmbeddings): The embeddings provider instance.
+            bucket (str, optional): The S3 bucket the blob is written to.
+                Defaults to the EMBEDDING_BUCKET_NAME environment variable.
+        """
+        self.session_id = session_id
+        self.embeddings = embeddings
+        self.bucket = bucket
+        self.key = get_session_index_key(session_id, uuid.uuid4().hex)
+        self.texts: List[str] = []
+        self.metadatas: List[dict] = []
+        self.vectors: List[np.ndarray] = []
+
+    def add_documents(self, documents: List[Document]) -> None:
+        """
+        Embed the given documents and (re)write this writer's part of the session index to S3.
+
+        Args:
+            documents (List[Document]): The chunks to embed and store.
+        """
+        if not documents:
+            return
+
+        texts = [doc.page_content for doc in documents]
+        vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors = vectors / norms
+
+        self.texts.extend(texts)
+        self.metadatas.extend(doc.metadata for doc in documents)
+        self.vectors.append(vectors)
+
+        buffer = BytesIO()
+        np.savez_compressed(
+            buffer,
+            embeddings=np.vstack(self.vectors).astype(np.float16),
+            texts=np.array(self.texts, dtype=str),
+            metadata=np.array([json.dumps(metadata) for metadata in self.metadatas], dtype=str)
+        )
+        get_client("s3").put_object(Bucket=self.bucket, Key=self.key, Body=buffer.getvalue())
+        logger.info(f"Wrote {len(self.texts)} chunks ({buffer.tell()} bytes) to s3://{self.bucket}/{self.key}.")
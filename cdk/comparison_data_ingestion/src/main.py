@@ -1,13 +1,14 @@
 import os
 import json
-import boto3
 import psycopg2
 from datetime import datetime, timezone
 import logging
 import httpx
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 # import requests
 
+from helpers.aws_clients import get_client
 from helpers.vectorstore import update_vectorstore
 from langchain_aws import BedrockEmbeddings
 
@@ -15,7 +16,6 @@ from langchain_aws import BedrockEmbeddings
 # Set up basic logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger()
-LAMBDA_CLIENT = boto3.client("lambda")
 # amazonq-ignore-next-line
 EVENT_NOTIFICATION_LAMBDA_NAME = os.environ["EVENT_NOTIFICATION_LAMBDA_NAME"]
 DB_SECRET_NAME = os.environ["SM_DB_CREDENTIALS"]
@@ -27,10 +27,9 @@ EMBEDDING_BUCKET_NAME = os.environ["EMBEDDING_BUCKET_NAME"]
 APPSYNC_API_URL = os.environ["APPSYNC_API_URL"]
 # APPSYNC_API_ID = os.environ["APPSYNC_API_ID"]
 EMBEDDING_MODEL_PARAM = os.environ["EMBEDDING_MODEL_PARAM"]
-# AWS Clients
-secrets_manager_client = boto3.client("secretsmanager")
-ssm_client = boto3.client("ssm")
-bedrock_runtime = boto3.client("bedrock-runtime", region_name=REGION)
+# Maximum number of sessions from one SQS batch that are ingested in parallel
+MAX_CONCURRENT_SESSIONS = int(os.environ.get("MAX_CONCURRENT_SESSIONS", "5"))
+# AWS clients are created on first use by get_client and shared across modules
 
 # Cached resources
 connection = None
@@ -88,7 +87,7 @@ def get_parameter():
     global EMBEDDING_MODEL_ID
     if EMBEDDING_MODEL_ID is None:
         try:
-            response = ssm_client.get_parameter(Name=EMBEDDING_MODEL_PARAM, WithDecryption=True)
+            response = get_client("ssm").get_parameter(Name=EMBEDDING_MODEL_PARAM, WithDecryption=True)
             EMBEDDING_MODEL_ID = response["Parameter"]["Value"]
         except Exception as e:
             logger.error(f"Error fetching parameter {EMBEDDING_MODEL_PARAM}: {e}")
@@ -101,7 +100,7 @@ def get_secret():
     global db_secret
     if db_secret is None:
         try:
-            response = secrets_manager_client.get_secret_value(SecretId=DB_SECRET_NAME)["SecretString"]
+            response = get_client("secretsmanager").get_secret_value(SecretId=DB_SECRET_NAME)["SecretString"]
             db_secret = json.loads(response)
         except Exception as e:
             logger.error(f"Error fetching secret: {e}")
@@ -113,7 +112,7 @@ def update_vectorstore_from_s3(bucket, session_id):
     
     embeddings = BedrockEmbeddings(
         model_id=get_parameter(), 
-        client=bedrock_runtime,
+        client=get_client("bedrock-runtime", region_name=REGION),
         region_name=REGION
     )
     
@@ -146,23 +145,48 @@ def update_vectorstore_from_s3(bucket, session_id):
         logger.error(f"Error updating vectorstore for session {session_id}: {e}")
         raise
 
+def process_session(bucket_name, session_id, document_keys):
+    """
+    Ingest every uploaded document of one comparison session, then remove the
+    uploads from S3. Raises if the vectorstore could not be updated, so the
+    caller can report the session's messages as failed.
+    """
+    update_vectorstore_from_s3(bucket_name, session_id)
+    logger.info(f"Vectorstore updated successfully for course {session_id}.")
+
+    # If update_vectorstore_from_s3() was executed successfully, the following code snippet removes the documents from the s3 bucket
+    for document_key in document_keys:
+        try:
+            get_client("s3").delete_object(Bucket=bucket_name, Key=document_key)
+            logger.info(f"Successfully deleted {document_key} from {bucket_name} after vectorstore update.")
+        except Exception as e:
+            logger.error(f"Error deleting {document_key} from {bucket_name}: {e}")
+
 def handler(event, context):
     time.sleep(1)
     records = event.get('Records', [])
     if not records:
-        return {
-            "statusCode": 400,
-            "body": json.dumps("No valid S3 event found.")
-        }
+        logger.warning("No records in the SQS event.")
+        return {"batchItemFailures": []}
         
     bucket_name = DSA_COMPARISON_BUCKET
 
+    # Group the batch by session: update_vectorstore_from_s3() ingests everything
+    # under the session prefix, so each session only needs to be processed once.
+    session_records = {}
+    batch_item_failures = []
     for record in records:
         # Extract the message body from the SQS event
-        message_body = json.loads(record['body'])
-        session_id = message_body.get('sessionId')
-        filename = message_body.get('fileName')
-        file_type = message_body.get('fileExtension')
+        try:
+            message_body = json.loads(record['body'])
+            session_id = message_body.get('sessionId')
+            filename = message_body.get('fileName')
+            file_type = message_body.get('fileExtension')
+        except (ValueError, AttributeError) as e:
+            # Only this message is redelivered, not the rest of the batch
+            logger.error(f"Malformed message {record['messageId']}: {e}")
+            batch_item_failures.append({"itemIdentifier": record['messageId']})
+            continue
 
         if not session_id or not filename or not file_type:
             logger.error("Missing required parameters in the message.")
@@ -170,33 +194,30 @@ def handler(event, context):
 
         # Assuming the file path is of the format: {session_id}/{filename}
         document_key = f"{session_id}/{filename}.{file_type}"
-        
-        try:
-                update_vectorstore_from_s3(bucket_name, session_id)
-                logger.info(f"Vectorstore updated successfully for course {session_id}.")
-        except Exception as e:
-                logger.error(f"Error updating vectorstore for course {session_id}: {e}")
-                return {
-                    "statusCode": 500,
-                    "body": json.dumps(f"Document inserted, but error updating vectorstore: {e}")
-                }
-        # If update_vectorstore_from_s3() was executed successfully, the following code snippet removes this document from the s3 bucket
-        s3_client = boto3.client('s3')
-        try:
-            s3_client.delete_object(Bucket=bucket_name, Key=document_key)
-            logger.info(f"Successfully deleted {document_key} from {bucket_name} after vectorstore update.")
-        except Exception as e:
-            logger.error(f"Error deleting {document_key} from {bucket_name}: {e}")
-
-        return {
-                "statusCode": 200,
-                "body": json.dumps({
-                    "message": "New file inserted into database. Vectorstore updated and document deleted from S3 successfully.",
-                    "location": f"s3://{bucket_name}/{document_key}"
-                })
+        session_records.setdefault(session_id, []).append((record['messageId'], document_key))
+
+    if session_records:
+        with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_SESSIONS, len(session_records))) as executor:
+            futures = {
+                executor.submit(
+                    process_session,
+                    bucket_name,
+                    session_id,
+                    [document_key for _, document_key in session_entries]
+                ): session_id
+                for session_id, session_entries in session_records.items()
             }
-
-    return {
-        "statusCode": 400,
-        "body": json.dumps("No new document upload or deletion event found.")
-    }
+            for future in as_completed(futures):
+                session_id = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"Error updating vectorstore for course {session_id}: {e}")
+                    # Only this session's messages are redelivered
+                    batch_item_failures.extend(
+                        {"itemIdentifier": message_id}
+                        for message_id, _ in session_records[session_id]
+                    )
+
+    logger.info(f"Processed {len(session_records)} sessions, {len(batch_item_failures)} messages failed.")
+    return {"batchItemFailures": batch_item_failures}
@@ -1,22 +1,108 @@
-import logging, uuid, time
-from typing import List
-import boto3, pymupdf
+import os, re, math, bisect, logging, uuid, time, threading
+from typing import List, Tuple
+import pymupdf
 from langchain_postgres import PGVector
 from langchain_core.documents import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from helpers.aws_clients import get_client
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize the clients
-s3 = boto3.client('s3')
-bedrock_client = boto3.client(service_name='bedrock')
-bedrock_runtime_client = boto3.client(service_name='bedrock-runtime')
+# Token budget for each chunk sent to the embedding model. Tokens are estimated
+# from the character count, which is close enough for Titan embeddings and avoids
+# shipping a tokenizer with the container.
+CHUNK_SIZE_TOKENS = int(os.environ.get("CHUNK_SIZE_TOKENS", "512"))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", "64"))
+CHARS_PER_TOKEN = 4
+
+# Local pre-screen patterns. Only unambiguous email addresses and North American
+# phone numbers written with "-", "." or an "(xxx)" area code count as clear PII
+# hits. Space-separated digit groups are as likely to be a row of a numeric table,
+# so they, and everything else, are left to the guardrail.
+PII_PATTERN = re.compile(
+    r"[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}"
+    r"|(?<![\d.-])(?:\+?1[\s.-]?)?"
+    r"(?:\(\d{3}\)\s?\d{3}[.-]|\d{3}-\d{3}-|\d{3}\.\d{3}\.)\d{4}(?![\d.-])"
+)
+PAGE_SEPARATOR = "\x00"
+PII_ERROR_MESSAGE = "Sorry, I cannot process your document(s) because they contain sensitive (personally identifiable) information. Kindly remove the relevant content and try again."
+
+# Guardrail ID and version, cached per container. The lock keeps concurrently
+# processed sessions from creating the same guardrail twice.
+guardrail_cache = {}
+guardrail_lock = threading.Lock()
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens in a piece of text.
+
+    Args:
+        text (str): The text to measure.
+
+    Returns:
+        int: The approximate token count (roughly four characters per token).
+    """
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def split_documents(
+    docs: List[Document],
+    chunk_size_tokens: int = CHUNK_SIZE_TOKENS,
+    chunk_overlap_tokens: int = CHUNK_OVERLAP_TOKENS
+) -> List[Document]:
+    """
+    Split page-level documents into token-bounded chunks.
+
+    Each chunk inherits the metadata of the page it came from (including the page
+    number) and gets a "chunk" index within that page, so retrieval results can
+    still be traced back to the original page.
+
+    Args:
+        docs (List[Document]): The page-level documents to split.
+        chunk_size_tokens (int): The maximum number of tokens per chunk.
+        chunk_overlap_tokens (int): The number of tokens shared between consecutive chunks.
+
+    Returns:
+        List[Document]: The token-bounded chunks, in page order.
+    """
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size_tokens,
+        chunk_overlap=chunk_overlap_tokens,
+        length_function=estimate_tokens
+    )
+
+    chunks = []
+    for doc in docs:
+        for chunk_idx, chunk_text in enumerate(text_splitter.split_text(doc.page_content)):
+            chunks.append(Document(
+                page_content=chunk_text,
+                metadata={**doc.metadata, "chunk": chunk_idx}
+            ))
+    return chunks
 
 def setup_guardrail(guardrail_name: str) -> tuple[str, str]:
     """
     Ensure a guardrail with a given name is created and published if it doesn't exist.
-    Returns a tuple (guardrail_id, guardrail_version) for the guardrail.
+    Returns a tuple (guardrail_id, guardrail_version) for the guardrail, cached for 
+    the lifetime of the container.
+    
+    Args:
+        guardrail_name (str): The name of the guardrail to create or retrieve.
+    
+    Returns:
+        A tuple (guardrail_id (str), guardrail_version (str)).
+    """
+    with guardrail_lock:
+        if guardrail_name not in guardrail_cache:
+            guardrail_cache[guardrail_name] = find_or_create_guardrail(guardrail_name)
+        return guardrail_cache[guardrail_name]
+
+def find_or_create_guardrail(guardrail_name: str) -> tuple[str, str]:
+    """
+    Look up a guardrail by name through the Bedrock API, creating and publishing it 
+    if it doesn't exist.
     
     Args:
         guardrail_name (str): The name of the guardrail to create or retrieve.
@@ -29,7 +115,7 @@ def setup_guardrail(guardrail_name: str) -> tuple[str, str]:
     guardrail_version = None
 
     # Check if a guardrail with the given name already exists
-    paginator = bedrock_client.get_paginator('list_guardrails')
+    paginator = get_client("bedrock").get_paginator('list_guardrails')
     for page in paginator.paginate():
         for guardrail in page.get('guardrails', []):
             if guardrail['name'] == guardrail_name:
@@ -42,7 +128,7 @@ def setup_guardrail(guardrail_name: str) -> tuple[str, str]:
     # If the guardrail does not exist, create and publish a new one
     if not guardrail_name_exists:
         logger.info(f"Creating new guardrail\nName: {guardrail_name}")
-        response = bedrock_client.create_guardrail(
+        response = get_client("bedrock").create_guardrail(
             name=guardrail_name,
             description='Block financial advice, offensive content, and PII',
             topicPolicyConfig={
@@ -87,7 +173,7 @@ def setup_guardrail(guardrail_name: str) -> tuple[str, str]:
         logger.info(f"ID: {guardrail_id}")
         
         # Publish the initial version of the guardrail
-        version_response = bedrock_client.create_guardrail_version(
+        version_response = get_client("bedrock").create_guardrail_version(
             guardrailIdentifier=guardrail_id,
             description='Published version',
             clientRequestToken=str(uuid.uuid4())
@@ -98,6 +184,82 @@ def setup_guardrail(guardrail_name: str) -> tuple[str, str]:
     
     return guardrail_id, guardrail_version
 
+def prescreen_pages(page_texts: List[str]) -> Tuple[List[bool], List[bool]]:
+    """
+    Run a cheap local screen over all pages before any guardrail call.
+
+    All pages are joined into one string and scanned once with the compiled PII 
+    pattern, and each match is mapped back to its page by offset. A clear hit 
+    rejects the upload without any guardrail call. Otherwise every page with 
+    text is checked by the Bedrock guardrail, which stays authoritative: pages 
+    of digits alone can still hold account numbers or unformatted phone numbers. 
+    Only pages that are empty after stripping whitespace are skipped.
+
+    Args:
+        page_texts (List[str]): The extracted text of each page.
+
+    Returns:
+        Tuple[List[bool], List[bool]]: For each page, whether it contains a clear 
+        PII hit (email address or phone number), and whether it still needs a 
+        guardrail call.
+    """
+    pii_hits = [False] * len(page_texts)
+
+    # Record where each page starts in the joined text
+    page_starts = []
+    offset = 0
+    for page_text in page_texts:
+        page_starts.append(offset)
+        offset += len(page_text) + len(PAGE_SEPARATOR)
+
+    for match in PII_PATTERN.finditer(PAGE_SEPARATOR.join(page_texts)):
+        pii_hits[bisect.bisect_right(page_starts, match.start()) - 1] = True
+
+    needs_guardrail = [bool(page_text.strip()) for page_text in page_texts]
+    return pii_hits, needs_guardrail
+
+def get_guardrail_error_message(response: dict) -> str:
+    """
+    Build the user-facing message for a guardrail intervention.
+
+    Args:
+        response (dict): The `apply_guardrail` response with action 'GUARDRAIL_INTERVENED'.
+
+    Returns:
+        str: The message explaining which kind of restricted content was found.
+    """
+    # Inspect each assessment for violations in order of priority
+    for assessment in response.get('assessments', []):
+        # Topics policy checks (Financial Advice, Offensive Content)
+        if 'topicPolicy' in assessment:
+            for topic in assessment['topicPolicy'].get('topics', []):
+                if topic.get('name') == 'FinancialAdvice' and topic.get('action') == 'BLOCKED':
+                    return "Sorry, I cannot process your document(s) because they contain financial content. Kindly remove the relevant content and try again."
+
+                elif topic.get('name') == 'OffensiveContent' and topic.get('action') == 'BLOCKED':
+                    return "Sorry, I cannot process your document(s) because they contain offensive content. Kindly remove the relevant content and try again."
+
+        # Sensitive information policy (PII) checks
+        if 'sensitiveInformationPolicy' in assessment:
+            for pii in assessment['sensitiveInformationPolicy'].get('piiEntities', []):
+                if pii.get('action') in ['BLOCKED']: # ['BLOCKED', 'ANONYMIZED']:
+                    return PII_ERROR_MESSAGE
+
+    # If we still have no specific message but there's an intervention
+    return "Sorry, I cannot process your document(s) because they contain restricted content. Kindly remove the relevant content and try again."
+
+def delete_documents(bucket: str, document_keys: List[str]) -> None:
+    """
+    Delete the uploaded documents of a session from S3.
+
+    Args:
+        bucket (str): The name of the S3 bucket containing the documents.
+        document_keys (List[str]): The keys of the documents to delete.
+    """
+    for key in document_keys:
+        get_client("s3").delete_object(Bucket=bucket, Key=key)
+        logger.info(f"Deleted {key} from S3.")
+
 def process_documents(
     bucket: str,
     category_id: str, 
@@ -108,12 +270,14 @@ def process_documents(
     
     1. Retrieve or create guardrails needed for content filtering.
     2. List documents in the specified S3 path.
-    3. Download and process each document (PDF), page by page.
-    4. Apply the configured guardrail checks via the Bedrock Runtime.
+    3. Download each document (PDF) and extract its text, page by page.
+    4. Pre-screen all pages locally; clear PII hits abort the upload without any 
+       Bedrock call. Apply the configured guardrail checks via the Bedrock Runtime 
+       to every page that has text content.
        - If any restricted content is found, all documents are deleted from S3, 
          and processing is aborted with an error message.
-    5. Otherwise, successful documents are added to the vectorstore, 
-       and the originals are removed from S3.
+    5. Otherwise, the pages are split into token-bounded chunks, added to the 
+       vectorstore, and the originals are removed from S3.
 
     Args:
         bucket (str): The name of the S3 bucket containing documents to process.
@@ -134,7 +298,7 @@ def process_documents(
 
     # Collect all document keys under the specified prefix
     document_keys = []
-    paginator = s3.get_paginator('list_objects_v2')
+    paginator = get_client("s3").get_paginator('list_objects_v2')
     page_iterator = paginator.paginate(Bucket=bucket, Prefix=f"{category_id}/")
     try:
         for page in page_iterator:
@@ -149,15 +313,13 @@ def process_documents(
         logger.error(f"Error listing documents: {e}")
         raise
 
-    all_docs = []
-    error_message = None
-
-    # Process each document individually
+    # Extract the text of every page up front, so all pages can be pre-screened together
+    pages = []
     for document_key in document_keys:
         logger.info(f"Processing document: {document_key}")
         try:
             # Get the document directly from S3 as bytes
-            response = s3.get_object(Bucket=bucket, Key=document_key)
+            response = get_client("s3").get_object(Bucket=bucket, Key=document_key)
             file_data = response['Body'].read()
             
             # Open the document using pymupdf
@@ -168,79 +330,8 @@ def process_documents(
             # Extract text from each page
             for page_idx, page in enumerate(doc_pdf, start=1):
                 page_text = page.get_text().strip()
-                if not page_text:
-                    continue
-
-                # Apply the guardrail to the extracted text
-                try:
-                    response = bedrock_runtime_client.apply_guardrail(
-                        guardrailIdentifier=guardrail_id,
-                        guardrailVersion=guardrail_version,
-                        source="INPUT",
-                        content=[{"text": {
-                            "text": page_text,
-                            "qualifiers": ["guard_content"]}
-                        }]
-                    )
-                    
-                    # Check if guardrail intervention occurred
-                    if response.get('action') == 'GUARDRAIL_INTERVENED':
-                        error_message = None
-                        # Inspect each assessment for violations in order of priority
-                        for assessment in response.get('assessments', []):
-                            # Topics policy checks (Financial Advice, Offensive Content)
-                            if 'topicPolicy' in assessment:
-                                for topic in assessment['topicPolicy'].get('topics', []):
-                                    if topic.get('name') == 'FinancialAdvice' and topic.get('action') == 'BLOCKED':
-                                        error_message = "Sorry, I cannot process your document(s) because they contain financial content. Kindly remove the relevant content and try again."
-                                        break
-
-                                    elif topic.get('name') == 'OffensiveContent' and topic.get('action') == 'BLOCKED':
-                                        error_message = "Sorry, I cannot process your document(s) because they contain offensive content. Kindly remove the relevant content and try again."
-                                        break
-                                if error_message:
-                                    break
-
-                            # Sensitive information policy (PII) checks
-                            if not error_message and 'sensitiveInformationPolicy' in assessment:
-                                for pii in assessment['sensitiveInformationPolicy'].get('piiEntities', []):
-                                    if pii.get('action') in ['BLOCKED']: # ['BLOCKED', 'ANONYMIZED']:
-                                        error_message = "Sorry, I cannot process your document(s) because they contain sensitive (personally identifiable) information. Kindly remove the relevant content and try again."
-                                        break
-                                if error_message:
-                                    break
-
-                        # If we still have no specific message but there's an intervention
-                        if not error_message:
-                            error_message = "Sorry, I cannot process your document(s) because they contain restricted content. Kindly remove the relevant content and try again."
-
-                        # Cleanup before aborting
-                        doc_pdf.close()
-
-                        # Delete all documents from S3 since the user must re-upload 
-                        # for a new attempt
-                        for key in document_keys:
-                            s3.delete_object(Bucket=bucket, Key=key)
-                            logger.info(f"Deleted {key} from S3.")
-
-                        # Return the error message triggered by guardrails
-                        return error_message
-
-                except Exception as e:
-                    logger.error(f"Error applying guardrail: {e}")
-                    raise
-
-                # If guardrail did not trigger a block, 
-                # create a Document object for further processing
-                all_docs.append(Document(
-                    page_content=page_text,
-                    metadata={
-                        "id": doc_id,
-                        "filename": document_key,
-                        "page": page_idx,
-                        "category_id": category_id,
-                    }
-                ))
+                if page_text:
+                    pages.append((document_key, doc_id, page_idx, page_text))
             
             doc_pdf.close()
             
@@ -248,15 +339,69 @@ def process_documents(
             logger.error(f"Error processing document {document_key}: {e}")
             raise
 
-    # If no guardrail errors occurred, add all documents to the vector store
+    # Fail fast on clear PII hits before paying for any guardrail call
+    pii_hits, needs_guardrail = prescreen_pages([page_text for _, _, _, page_text in pages])
+    if any(pii_hits):
+        logger.info(
+            f"Pre-screen found PII on {sum(pii_hits)} page(s); "
+            f"avoided {sum(needs_guardrail)} Bedrock guardrail calls."
+        )
+        delete_documents(bucket, document_keys)
+        return PII_ERROR_MESSAGE
+
+    logger.info(
+        f"Pre-screen found no clear PII; {sum(needs_guardrail)} of {len(pages)} page(s) "
+        f"go to the Bedrock guardrail."
+    )
+
+    all_docs = []
+    for (document_key, doc_id, page_idx, page_text), check_page in zip(pages, needs_guardrail):
+        if check_page:
+            # Apply the guardrail to the extracted text
+            try:
+                response = get_client("bedrock-runtime").apply_guardrail(
+                    guardrailIdentifier=guardrail_id,
+                    guardrailVersion=guardrail_version,
+                    source="INPUT",
+                    content=[{"text": {
+                        "text": page_text,
+                        "qualifiers": ["guard_content"]}
+                    }]
+                )
+            except Exception as e:
+                logger.error(f"Error applying guardrail: {e}")
+                raise
+
+            # Check if guardrail intervention occurred
+            if response.get('action') == 'GUARDRAIL_INTERVENED':
+                # Delete all documents from S3 since the user must re-upload 
+                # for a new attempt
+                delete_documents(bucket, document_keys)
+
+                # Return the error message triggered by guardrails
+                return get_guardrail_error_message(response)
+
+        # If guardrail did not trigger a block, 
+        # create a Document object for further processing
+        all_docs.append(Document(
+            page_content=page_text,
+            metadata={
+                "id": doc_id,
+                "filename": document_key,
+                "page": page_idx,
+                "category_id": category_id,
+            }
+        ))
+
+    # If no guardrail errors occurred, split the pages into token-bounded chunks
+    # and add them to the vector store
     if all_docs:
-        vectorstore.add_documents(all_docs)
-        logger.info(f"Added {len(all_docs)} documents to vectorstore.")
+        chunks = split_documents(all_docs)
+        vectorstore.add_documents(chunks)
+        logger.info(f"Added {len(chunks)} chunks from {len(all_docs)} pages to vectorstore.")
 
     # Regardless of success or error, delete the original S3 objects if we've reached this point
-    for key in document_keys:
-        s3.delete_object(Bucket=bucket, Key=key)
-        logger.info(f"Deleted {key} from S3.")
+    delete_documents(bucket, document_keys)
     
     # Return success if the process completed without guardrail intervention
     return "SUCCESS"
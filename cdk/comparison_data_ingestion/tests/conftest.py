@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Import the handler's modules the way the Lambda runtime does, from src/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
@@ -0,0 +1,43 @@
+import pytest
+
+for module in ("boto3", "pymupdf", "langchain", "langchain_postgres"):
+    pytest.importorskip(module)
+
+from processing.documents import prescreen_pages
+
+
+def test_formatted_contact_details_are_clear_hits():
+    pages = [
+        "Contact jane.doe@example.com for details.",
+        "Call 604-555-1234 after 5pm.",
+        "Office: (604) 555-1234",
+        "Fax 604.555.1234",
+    ]
+    pii_hits, _ = prescreen_pages(pages)
+    assert pii_hits == [True, True, True, True]
+
+
+def test_numeric_table_page_goes_to_guardrail():
+    page = "Budget 2024\nTuition 250 300 1200\nDevices 604 555 1234\nTotal 1154 1155 2434"
+    pii_hits, needs_guardrail = prescreen_pages([page])
+    assert pii_hits == [False]
+    assert needs_guardrail == [True]
+
+
+def test_letterless_page_goes_to_guardrail():
+    # Digits alone can still be an account number or an unformatted phone number
+    page = "6045551234\n0012 3456 7890\n123 456 789"
+    pii_hits, needs_guardrail = prescreen_pages([page])
+    assert pii_hits == [False]
+    assert needs_guardrail == [True]
+
+
+def test_only_blank_pages_skip_guardrail():
+    pii_hits, needs_guardrail = prescreen_pages(["Some text", "   \n\t", "", "42"])
+    assert pii_hits == [False, False, False, False]
+    assert needs_guardrail == [True, False, False, True]
+
+
+def test_hit_is_mapped_to_its_page():
+    pii_hits, _ = prescreen_pages(["First page", "Second page", "Write to a@b.ca"])
+    assert pii_hits == [False, False, True]
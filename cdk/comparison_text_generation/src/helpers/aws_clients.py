@@ -0,0 +1,36 @@
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import boto3
+
+# Clients shared by every module of the function, keyed by (service, region)
+clients: Dict[Tuple[str, Optional[str]], Any] = {}
+# boto3's default session is not safe for creating clients from several threads at once
+lock = threading.Lock()
+
+
+def get_client(service_name: str, region_name: Optional[str] = None) -> Any:
+    """
+    Return the container's boto3 client for a service, creating it on first use.
+
+    Creating a client loads its service model, which is a noticeable part of a
+    cold start, so each client is created once per container and only by the
+    first request path that needs it.
+
+    Args:
+        service_name (str): The AWS service, e.g. "ssm".
+        region_name (str, optional): The region; the default region if not given.
+
+    Returns:
+        The boto3 client.
+    """
+    key = (service_name, region_name)
+    client = clients.get(key)
+    if client is None:
+        with lock:
+            client = clients.get(key)
+            if client is None:
+                client = boto3.client(service_name, region_name=region_name)
+                clients[key] = client
+    return client
+
@@ -1,20 +1,20 @@
-import boto3
 import re
 import json
 import logging
 from datetime import datetime
-from typing import Dict, Any, Generator, List, Optional
+from typing import TYPE_CHECKING, Dict, Any, Generator, List, Optional
 
 # LangChain/AWS-related imports
-from langchain_aws import ChatBedrockConverse
-from langchain_core.prompts import PromptTemplate, ChatPromptTemplate, MessagesPlaceholder
-from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain.chains import create_retrieval_chain
-from langchain_core.runnables import RunnablePassthrough
-from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_community.chat_message_histories import DynamoDBChatMessageHistory
-from langchain_core.pydantic_v1 import BaseModel, Field
+from langchain_core.runnables import RunnablePassthrough, RunnableLambda
+
+from helpers.context import compress_context
+
+if TYPE_CHECKING:
+    # langchain_aws is imported on first use, so it is not loaded during INIT
+    from langchain_aws import ChatBedrockConverse
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger()
 def get_bedrock_llm(
@@ -22,7 +22,7 @@ def get_bedrock_llm(
     temperature: Optional[float] = 0,
     max_tokens: Optional[int] = None,
     top_p : Optional[float] = None
-) -> ChatBedrockConverse:
+) -> "ChatBedrockConverse":
     """
     Retrieve a Bedrock LLM instance configured with the given model ID and temperature.
 
@@ -43,6 +43,7 @@ def get_bedrock_llm(
         max_tokens, 
         top_p
     )
+    from langchain_aws import ChatBedrockConverse
 
     return ChatBedrockConverse(
         model=bedrock_llm_id,
@@ -123,7 +124,8 @@ def format_docs(docs: List[Any]) -> str:
 def get_response_evaluation(
     llm,
     retriever,
-    guidelines_file
+    guidelines_file,
+    context_max_tokens: int = 2000
 ) -> Generator[dict, None, None]:
     """
     Evaluates documents against multiple guidelines using the provided LLM and retriever.
@@ -140,6 +142,9 @@ def get_response_evaluation(
         retriever: A retriever instance providing the relevant documents/context.
         guidelines_file (str | dict): A JSON string or dictionary containing 
             guideline categories and guidelines.
+        context_max_tokens (int, optional): Token budget for the retrieved 
+            context, which is deduplicated and trimmed to the sentences most 
+            relevant to each guideline by `compress_context` (default is 2000).
 
     Yields:
         dict: A dictionary containing the evaluation results for each guideline. This includes:
@@ -190,7 +195,12 @@ def get_response_evaluation(
     # Create a simple chain that retrieves documents and inserts them into the prompt
     rag_chain = (
         {
-            "context": retriever | format_docs,
+            "context": RunnableLambda(
+                lambda guideline: compress_context(
+                    guideline, retriever.invoke(guideline), max_tokens=context_max_tokens
+                )[0]
+            )
+            | format_docs,
             "guidelines": RunnablePassthrough(),
         }
         | prompt
@@ -0,0 +1,181 @@
+import re
+import zlib
+import logging
+from typing import Dict, List, Set, Tuple
+
+from langchain_core.documents import Document
+
+# Setup logging at the INFO level for this module
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Rough characters-per-token ratio used to budget context without a tokenizer.
+# The chat image imports this and the following from helpers/rerank.py; the
+# values here must match it (see cdk/text_generation/tests/test_context.py).
+CHARS_PER_TOKEN = 4
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for",
+    "from", "how", "i", "in", "is", "it", "me", "of", "on", "or", "that", "the",
+    "this", "to", "user", "was", "what", "when", "where", "which", "who", "why",
+    "will", "with", "you", "your",
+}
+# Words per shingle when comparing chunks for near-duplicates
+SHINGLE_SIZE = 5
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+|\n{2,}")
+PARAGRAPH_BREAK_PATTERN = re.compile(r"\n\s*\n")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of LLM tokens in a piece of text.
+    """
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def get_shingles(text: str) -> Set[int]:
+    """
+    Return hashes of the overlapping SHINGLE_SIZE-word windows of a text.
+    """
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {zlib.crc32(" ".join(words).encode("utf-8"))} if words else set()
+    return {
+        zlib.crc32(" ".join(words[i:i + SHINGLE_SIZE]).encode("utf-8"))
+        for i in range(len(words) - SHINGLE_SIZE + 1)
+    }
+
+
+def split_sentence_spans(text: str) -> List[Tuple[int, int]]:
+    """
+    Return the (start, end) offsets of the non-empty sentences of a text, with
+    surrounding whitespace excluded.
+    """
+    bounds = []
+    start = 0
+    for match in SENTENCE_PATTERN.finditer(text):
+        bounds.append((start, match.start()))
+        start = match.end()
+    bounds.append((start, len(text)))
+
+    spans = []
+    for start, end in bounds:
+        sentence = text[start:end]
+        if sentence.strip():
+            leading = len(sentence) - len(sentence.lstrip())
+            trailing = len(sentence) - len(sentence.rstrip())
+            spans.append((start + leading, end - trailing))
+    return spans
+
+
+def trim_to_relevant_sentences(text: str, query_terms: Set[str], max_sentences: int) -> str:
+    """
+    Keep the `max_sentences` sentences of a chunk that share the most words with
+    the query, in their original order.
+
+    Adjacent kept sentences keep the text's own separator between them. Where
+    sentences were dropped in between, they are separated by a paragraph break
+    if the dropped text contained one, a line break if it contained one, and a
+    space otherwise, so paragraphs and list items stay apart.
+    """
+    spans = split_sentence_spans(text)
+    if len(spans) <= max_sentences:
+        return text.strip()
+
+    scores = [
+        len(query_terms & set(WORD_PATTERN.findall(text[start:end].lower())))
+        for start, end in spans
+    ]
+    # Highest overlap first; earlier sentences win ties
+    keep = sorted(sorted(range(len(spans)), key=lambda i: (-scores[i], i))[:max_sentences])
+
+    parts = []
+    for position, index in enumerate(keep):
+        start, end = spans[index]
+        if position:
+            previous = keep[position - 1]
+            gap = text[spans[previous][1]:start]
+            if index == previous + 1:
+                parts.append(gap)
+            elif PARAGRAPH_BREAK_PATTERN.search(gap):
+                parts.append("\n\n")
+            else:
+                parts.append("\n" if "\n" in gap else " ")
+        parts.append(text[start:end])
+    return "".join(parts)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Cut a text to about `max_tokens` tokens, at a sentence boundary if one exists.
+    """
+    limit = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    boundary = max(cut.rfind(". "), cut.rfind("! "), cut.rfind("? "))
+    return cut[:boundary + 1] if boundary > 0 else cut
+
+
+def compress_context(
+    query: str,
+    docs: List[Document],
+    max_tokens: int = 1500,
+    max_sentences: int = 6,
+    duplicate_threshold: float = 0.8
+) -> Tuple[List[Document], Dict[str, int]]:
+    """
+    Assemble retrieved chunks into a compact context for the prompt.
+
+    The stage:
+      1. Drops chunks whose word shingles are mostly contained in a chunk already
+         kept (overlapping pages, repeated boilerplate).
+      2. Trims each remaining chunk to the sentences most relevant to the query.
+      3. Adds chunks in retrieval order until `max_tokens` is reached, cutting
+         the last one to fit.
+
+    Args:
+        query (str): The question or guideline the context is for.
+        docs (List[Document]): Retrieved chunks, most relevant first.
+        max_tokens (int, optional): Hard token budget for the whole context (default is 1500).
+        max_sentences (int, optional): Sentences kept per chunk (default is 6).
+        duplicate_threshold (float, optional): Fraction of a chunk's shingles found
+            in a kept chunk above which it is dropped (default is 0.8).
+
+    Returns:
+        Tuple[List[Document], Dict[str, int]]: The compressed chunks, and counts
+        of "tokens_in", "tokens_out" and "duplicates_dropped".
+    """
+    query_terms = set(WORD_PATTERN.findall(query.lower())) - STOPWORDS
+    kept_shingles: List[Set[int]] = []
+    compressed: List[Document] = []
+    duplicates = 0
+    remaining_tokens = max_tokens
+
+    for doc in docs:
+        shingles = get_shingles(doc.page_content)
+        if shingles and any(
+            len(shingles & other) / len(shingles) >= duplicate_threshold
+            for other in kept_shingles
+        ):
+            duplicates += 1
+            continue
+        kept_shingles.append(shingles)
+
+        if remaining_tokens <= 0:
+            continue
+        text = trim_to_relevant_sentences(doc.page_content, query_terms, max_sentences)
+        text = truncate_to_tokens(text, remaining_tokens)
+        remaining_tokens -= estimate_tokens(text)
+        compressed.append(Document(page_content=text, metadata=dict(doc.metadata)))
+
+    stats = {
+        "tokens_in": sum(estimate_tokens(doc.page_content) for doc in docs),
+        "tokens_out": sum(estimate_tokens(doc.page_content) for doc in compressed),
+        "duplicates_dropped": duplicates,
+    }
+    logger.info(
+        "Context compressed from ~%d to ~%d tokens (%d of %d chunks kept, %d near-duplicates dropped).",
+        stats["tokens_in"], stats["tokens_out"], len(compressed), len(docs), duplicates
+    )
+    return compressed, stats
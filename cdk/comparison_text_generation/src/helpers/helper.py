@@ -1,9 +1,10 @@
 import logging
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
-import psycopg2
-from langchain_aws import BedrockEmbeddings
-from langchain_postgres import PGVector
+if TYPE_CHECKING:
+    # Imported on first use instead; the "memory" index backend never needs PGVector
+    from langchain_aws import BedrockEmbeddings
+    from langchain_postgres import PGVector
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -11,13 +12,13 @@ logger = logging.getLogger(__name__)
 
 def get_vectorstore(
     collection_name: str, 
-    embeddings: BedrockEmbeddings, 
+    embeddings: "BedrockEmbeddings", 
     dbname: str, 
     user: str, 
     password: str, 
     host: str, 
     port: int
-) -> Optional[PGVector]:
+) -> Optional["PGVector"]:
     """
     Initialize and return a PGVector instance.
     
@@ -39,6 +40,8 @@ def get_vectorstore(
         )
         
         logger.info("Initializing the VectorStore")
+        from langchain_postgres import PGVector
+
         vectorstore = PGVector(
             embeddings=embeddings,
             collection_name=collection_name,
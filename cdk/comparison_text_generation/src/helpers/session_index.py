@@ -0,0 +1,163 @@
+import os
+import json
+import logging
+from io import BytesIO
+from typing import Any, Dict, List
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from helpers.aws_clients import get_client
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EMBEDDING_BUCKET_NAME = os.environ.get("EMBEDDING_BUCKET_NAME")
+
+
+def get_session_index_prefix(session_id: str) -> str:
+    """
+    Build the S3 prefix under which the index parts of a comparison session are stored.
+
+    Args:
+        session_id (str): The comparison session ID.
+
+    Returns:
+        str: The S3 key prefix shared by all of the session's index blobs.
+    """
+    return f"comparison_index/{session_id}/"
+
+
+class SessionIndex:
+    """
+    In-process brute-force cosine index over the chunks of a single comparison session.
+
+    The index is loaded from the NumPy blobs written by the comparison ingestion
+    Lambda, one per ingestion invocation, so retrieval never leaves the Lambda. It
+    exposes the small part of the PGVector interface the handler relies on
+    (`as_retriever` and `delete_collection`).
+    """
+
+    def __init__(self, session_id: str, embeddings, bucket: str = EMBEDDING_BUCKET_NAME):
+        """
+        Args:
+            session_id (str): The comparison session ID.
+            embeddings (BedrockEmbeddings): The embeddings instance used to embed queries.
+            bucket (str, optional): The S3 bucket holding the blobs.
+                Defaults to the EMBEDDING_BUCKET_NAME environment variable.
+        """
+        self.session_id = session_id
+        self.embeddings = embeddings
+        self.bucket = bucket
+        self.prefix = get_session_index_prefix(session_id)
+        self.keys = self._list_parts()
+
+        vectors, self.texts, self.metadatas = [], [], []
+        s3 = get_client("s3")
+        for key in self.keys:
+            response = s3.get_object(Bucket=self.bucket, Key=key)
+            with np.load(BytesIO(response['Body'].read()), allow_pickle=False) as blob:
+                vectors.append(blob["embeddings"].astype(np.float32))
+                self.texts.extend(blob["texts"].tolist())
+                self.metadatas.extend(json.loads(metadata) for metadata in blob["metadata"].tolist())
+
+        if not vectors:
+            # Nothing was ingested for this session (e.g. the upload was blocked by guardrails)
+            logger.warning(f"No index found under s3://{self.bucket}/{self.prefix}.")
+            self.vectors = np.empty((0, 0), dtype=np.float32)
+            return
+
+        self.vectors = np.vstack(vectors)
+        logger.info(
+            f"Loaded {len(self.texts)} chunks from {len(self.keys)} part(s) for session {session_id} into memory."
+        )
+
+    def _list_parts(self) -> List[str]:
+        """
+        List the keys of every index part stored for the session.
+
+        Each ingestion invocation writes its own part, so a session whose documents
+        were ingested more than once has several.
+
+        Returns:
+            List[str]: The S3 keys of the session's index blobs.
+        """
+        keys = []
+        paginator = get_client("s3").get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            keys.extend(item["Key"] for item in page.get("Contents", []))
+        return keys
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+        """
+        Return the k chunks whose embeddings have the highest cosine similarity to the query.
+
+        Args:
+            query (str): The query text.
+            k (int): The number of chunks to return.
+
+        Returns:
+            List[Document]: The most similar chunks, best match first.
+        """
+        if not self.texts:
+            return []
+
+        query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        norm = np.linalg.norm(query_vector)
+        if norm:
+            query_vector = query_vector / norm
+
+        # Stored vectors are already normalized, so the dot product is the cosine similarity
+        scores = self.vectors @ query_vector
+        k = min(k, len(self.texts))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        return [
+            Document(page_content=self.texts[i], metadata=self.metadatas[i])
+            for i in top
+        ]
+
+    def as_retriever(self, search_kwargs: Dict[str, Any] = None) -> "SessionIndexRetriever":
+        """
+        Wrap the index in a LangChain retriever.
+
+        Args:
+            search_kwargs (Dict[str, Any], optional): Search parameters; only 'k' is used.
+
+        Returns:
+            SessionIndexRetriever: A retriever over this index.
+        """
+        search_kwargs = search_kwargs or {}
+        return SessionIndexRetriever(index=self, k=search_kwargs.get('k', 4))
+
+    def delete_collection(self) -> None:
+        """
+        Delete the session's blobs from S3 once the evaluation no longer needs them.
+        """
+        if not self.keys:
+            return
+        # delete_objects accepts up to 1000 keys per request
+        s3 = get_client("s3")
+        for start in range(0, len(self.keys), 1000):
+            s3.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": key} for key in self.keys[start:start + 1000]], "Quiet": True}
+            )
+        logger.info(f"Deleted {len(self.keys)} part(s) under s3://{self.bucket}/{self.prefix}.")
+
+
+class SessionIndexRetriever(BaseRetriever):
+    """
+    Retriever returning the top-k chunks of a `SessionIndex`.
+    """
+    index: Any
+    k: int = 4
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self.index.similarity_search(query, k=self.k)
@@ -1,8 +1,13 @@
+import os
 from typing import Dict
 
 from langchain_core.vectorstores import VectorStoreRetriever
 from helpers.helper import get_vectorstore
 
+# "pgvector" reads session chunks from the comparison database, "memory" loads the
+# NumPy blob written by comparison ingestion and searches it in-process
+COMPARISON_INDEX_BACKEND = os.environ.get("COMPARISON_INDEX_BACKEND", "pgvector")
+
 
 def get_vectorstore_retriever_ordinary(
     vectorstore_config_dict: Dict[str, str],
@@ -12,6 +17,9 @@ def get_vectorstore_retriever_ordinary(
     Retrieve the vectorstore and return an ordinary (non-history aware) retriever,
     along with the vectorstore itself.
 
+    When COMPARISON_INDEX_BACKEND is "memory", the "vectorstore" is an in-process
+    `SessionIndex`; its `delete_collection()` removes the session's blob from S3.
+
     Args:
         vectorstore_config_dict (Dict[str, str]): The configuration dictionary
             for the vectorstore, including parameters like collection name,
@@ -24,6 +32,16 @@ def get_vectorstore_retriever_ordinary(
             - An ordinary (non-history aware) retriever instance.
             - The vectorstore instance.
     """
+    if COMPARISON_INDEX_BACKEND == "memory":
+        # Imported here so that the pgvector backend never loads NumPy
+        from helpers.session_index import SessionIndex
+
+        session_index = SessionIndex(
+            session_id=vectorstore_config_dict['collection_name'],
+            embeddings=embeddings
+        )
+        return session_index.as_retriever(search_kwargs={'k': 5}), session_index
+
     vectorstore, _ = get_vectorstore(
         collection_name=vectorstore_config_dict['collection_name'],
         embeddings=embeddings,
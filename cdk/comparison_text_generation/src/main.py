@@ -1,13 +1,11 @@
 import os
 import json
-import boto3
 import logging
 import time
 import psycopg2
-import httpx
 import uuid, datetime
-from langchain_aws import BedrockEmbeddings
-from helpers.vectorstore import get_vectorstore_retriever_ordinary
+from helpers.aws_clients import get_client
+from helpers.vectorstore import get_vectorstore_retriever_ordinary, COMPARISON_INDEX_BACKEND
 from helpers.chat import get_bedrock_llm, get_response_evaluation
 
 # Set up basic logging
@@ -24,10 +22,9 @@ BEDROCK_LLM_PARAM = os.environ["BEDROCK_LLM_PARAM"]
 EMBEDDING_MODEL_PARAM = os.environ["EMBEDDING_MODEL_PARAM"]
 TABLE_NAME_PARAM = os.environ["TABLE_NAME_PARAM"]
 API_KEY = os.environ["API_KEY"]
-# AWS Clients
-secrets_manager_client = boto3.client("secretsmanager")
-ssm_client = boto3.client("ssm", region_name=REGION)
-bedrock_runtime = boto3.client("bedrock-runtime", region_name=REGION)
+# Token budget for the deduplicated, trimmed context of each guideline evaluation
+CONTEXT_MAX_TOKENS = int(os.environ.get("CONTEXT_MAX_TOKENS", "2000"))
+# AWS clients are created on first use by get_client and shared across helpers
 # Cached resources
 connection = None
 connection_comparison = None
@@ -65,6 +62,8 @@ def invoke_event_notification(session_id, message):
             }
         }
         time.sleep(1)
+        import httpx
+
         # Send the request to AppSync
         with httpx.Client() as client:
             response = client.post(APPSYNC_API_URL, headers=headers, json=payload)
@@ -85,7 +84,7 @@ def get_secret(secret_name, expect_json=True):
     global db_secret
     if db_secret is None:
         try:
-            response = secrets_manager_client.get_secret_value(SecretId=secret_name)["SecretString"]
+            response = get_client("secretsmanager").get_secret_value(SecretId=secret_name)["SecretString"]
             db_secret = json.loads(response) if expect_json else response
         except json.JSONDecodeError as e:
             logger.error(f"Failed to decode JSON for secret: {e}")
@@ -99,7 +98,7 @@ def get_secret_comparison(secret_name, expect_json=True):
     global db_secret_comparison
     if db_secret_comparison is None:
         try:
-            response = secrets_manager_client.get_secret_value(SecretId=secret_name)["SecretString"]
+            response = get_client("secretsmanager").get_secret_value(SecretId=secret_name)["SecretString"]
             db_secret_comparison = json.loads(response) if expect_json else response
         except json.JSONDecodeError as e:
             logger.error(f"Failed to decode JSON for secret : {e}")
@@ -115,7 +114,7 @@ def get_parameter(param_name, cached_var):
     """
     if cached_var is None:
         try:
-            response = ssm_client.get_parameter(Name=param_name, WithDecryption=True)
+            response = get_client("ssm", region_name=REGION).get_parameter(Name=param_name, WithDecryption=True)
             cached_var = response["Parameter"]["Value"]
         except Exception as e:
             logger.error(f"Error fetching parameter {param_name}: {e}")
@@ -129,9 +128,12 @@ def initialize_constants():
     EMBEDDING_MODEL_ID = get_parameter(EMBEDDING_MODEL_PARAM, EMBEDDING_MODEL_ID)
     TABLE_NAME = get_parameter(TABLE_NAME_PARAM, TABLE_NAME)
     if embeddings is None:
+        # Imported on first use, so langchain_aws is not loaded during INIT
+        from langchain_aws import BedrockEmbeddings
+
         embeddings = BedrockEmbeddings(
             model_id=EMBEDDING_MODEL_ID,
-            client=bedrock_runtime,
+            client=get_client("bedrock-runtime", region_name=REGION),
             region_name=REGION,
         )
     
@@ -183,6 +185,34 @@ def connect_to_comparison_db():
             raise
     return connection_comparison
 
+def mark_collection_used(collection_name):
+    """
+    Stamp the session's PGVector collection with the time it was last read, so the 
+    comparison sweeper measures its expiry from the last use rather than from its 
+    creation. A failure is logged and does not stop the evaluation.
+
+    Args:
+        collection_name (str): The name of the session's collection.
+    """
+    cur = None
+    try:
+        connection = connect_to_comparison_db()
+        cur = connection.cursor()
+        cur.execute("""
+            UPDATE langchain_pg_collection
+            SET cmetadata = (COALESCE(cmetadata::jsonb, '{}'::jsonb)
+                             || jsonb_build_object('last_used_at', now()))::json
+            WHERE name = %s;
+        """, (collection_name,))
+        connection.commit()
+    except Exception as e:
+        logger.error(f"Error marking collection {collection_name} as used: {e}")
+        if connection_comparison and not connection_comparison.closed:
+            connection_comparison.rollback()
+    finally:
+        if cur:
+            cur.close()
+
 def get_combined_guidelines(criteria_list):
     """
     Fetch and organize headers and bodies of all guidelines matching the given criteria names.
@@ -297,6 +327,8 @@ def handler(event, context):
                 vectorstore_config_dict=vectorstore_config_dict,
                 embeddings=embeddings
             )
+            if COMPARISON_INDEX_BACKEND == "pgvector":
+                mark_collection_used(session_id)
         except Exception as e:
             logger.error(f"Error creating ordinary retriever for user uploaded vectorstore: {e}")
             return {
@@ -321,7 +353,8 @@ def handler(event, context):
                 for individual_response in get_response_evaluation(
                     llm=llm,
                     retriever=ordinary_retriever,
-                    guidelines_file=guidelines
+                    guidelines_file=guidelines,
+                    context_max_tokens=CONTEXT_MAX_TOKENS
                 ):
                     # Extract the current header from the response (assuming it's stored in "header")
                     current_header = individual_response.get("header")
@@ -1,5 +1,4 @@
 import logging
-import boto3
 from typing import Dict, Optional, Tuple
 import psycopg2
 from langchain_aws import BedrockEmbeddings
@@ -8,8 +7,6 @@ from langchain.indexes import SQLRecordManager
 
 from processing.documents import process_documents
 
-s3 = boto3.client('s3')
-
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
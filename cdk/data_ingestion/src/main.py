@@ -1,10 +1,10 @@
 import os
 import json
-import boto3
 import psycopg2
 from datetime import datetime, timezone
 import logging
 
+from helpers.aws_clients import get_client
 from helpers.vectorstore import update_vectorstore
 from langchain_aws import BedrockEmbeddings
 
@@ -21,10 +21,7 @@ RDS_PROXY_ENDPOINT = os.environ["RDS_PROXY_ENDPOINT"]
 EMBEDDING_BUCKET_NAME = os.environ["EMBEDDING_BUCKET_NAME"]
 EMBEDDING_MODEL_PARAM = os.environ["EMBEDDING_MODEL_PARAM"]
 
-# AWS Clients
-secrets_manager_client = boto3.client("secretsmanager")
-ssm_client = boto3.client("ssm")
-bedrock_runtime = boto3.client("bedrock-runtime", region_name=REGION)
+# AWS clients are created on first use by get_client and shared across modules
 
 # Cached resources
 connection = None
@@ -39,7 +36,7 @@ def get_parameter():
     global EMBEDDING_MODEL_ID
     if EMBEDDING_MODEL_ID is None:
         try:
-            response = ssm_client.get_parameter(Name=EMBEDDING_MODEL_PARAM, WithDecryption=True)
+            response = get_client("ssm").get_parameter(Name=EMBEDDING_MODEL_PARAM, WithDecryption=True)
             EMBEDDING_MODEL_ID = response["Parameter"]["Value"]
         except Exception as e:
             logger.error(f"Error fetching parameter {EMBEDDING_MODEL_PARAM}: {e}")
@@ -53,7 +50,7 @@ def get_secret():
     global db_secret
     if db_secret is None:
         try:
-            response = secrets_manager_client.get_secret_value(SecretId=DB_SECRET_NAME)["SecretString"]
+            response = get_client("secretsmanager").get_secret_value(SecretId=DB_SECRET_NAME)["SecretString"]
             db_secret = json.loads(response)
         except Exception as e:
             logger.error(f"Error fetching secret: {e}")
@@ -170,7 +167,7 @@ def update_vectorstore_from_s3(bucket, category_id):
     
     embeddings = BedrockEmbeddings(
         model_id=get_parameter(), 
-        client=bedrock_runtime,
+        client=get_client("bedrock-runtime", region_name=REGION),
         region_name=REGION
     )
     
@@ -1,19 +1,19 @@
 import os, logging, uuid
 from io import BytesIO
 from typing import List
-import boto3, pymupdf
+import pymupdf
 from langchain_aws import BedrockEmbeddings
 from langchain_postgres import PGVector
 from langchain_core.documents import Document
 from langchain_experimental.text_splitter import SemanticChunker
 from langchain.indexes import SQLRecordManager, index
 
+from helpers.aws_clients import get_client
+
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize the S3 client
-s3 = boto3.client('s3')
 EMBEDDING_BUCKET_NAME = os.environ["EMBEDDING_BUCKET_NAME"]
 
 
@@ -50,7 +50,7 @@ def store_doc_texts(
         List[str]: A list of keys corresponding to the stored text files for each page.
     """
     # Get document bytes directly from S3
-    response = s3.get_object(Bucket=bucket, Key=f"{category_id}/{document_name}")
+    response = get_client("s3").get_object(Bucket=bucket, Key=f"{category_id}/{document_name}")
     file_data = response['Body'].read()
     
     # Process document in memory
@@ -63,7 +63,7 @@ def store_doc_texts(
         page_output_key = f'{category_id}/{document_name}_page_{page_num}.txt'
         
         with BytesIO(text) as page_output_buffer:
-            s3.upload_fileobj(page_output_buffer, output_bucket, page_output_key)
+            get_client("s3").upload_fileobj(page_output_buffer, output_bucket, page_output_key)
 
     return [f'{category_id}/{document_name}_page_{page_num}.txt' for page_num in range(1, len(doc) + 1)]
 
@@ -139,7 +139,7 @@ def store_doc_chunks(
     for documentname in documentnames:
         this_uuid = str(uuid.uuid4())  # Generating one UUID for all chunks from a specific page in the document
         output_buffer = BytesIO()
-        s3.download_fileobj(bucket, documentname, output_buffer)
+        get_client("s3").download_fileobj(bucket, documentname, output_buffer)
         output_buffer.seek(0)
         doc_texts = output_buffer.read().decode('utf-8')
         doc_chunks = text_splitter.create_documents([doc_texts])
@@ -156,7 +156,7 @@ def store_doc_chunks(
             else:
                 logger.warning(f"Empty chunk for {documentname}")
         
-        s3.delete_object(Bucket=bucket, Key=documentname)
+        get_client("s3").delete_object(Bucket=bucket, Key=documentname)
         
         this_doc_chunks.extend(doc_chunks)
        
@@ -185,7 +185,7 @@ def process_documents(
         record_manager (SQLRecordManager): Manager for maintaining records of documents in the vectorstore.
     """
     
-    paginator = s3.get_paginator('list_objects_v2')
+    paginator = get_client("s3").get_paginator('list_objects_v2')
     page_iterator = paginator.paginate(Bucket=bucket, Prefix=f"{category_id}/")
     all_doc_chunks = []
     
@@ -0,0 +1,201 @@
+import os
+import json
+import boto3
+import psycopg2
+from aws_lambda_powertools import Logger
+
+logger = Logger()
+
+DB_SECRET_NAME = os.environ["SM_DB_CREDENTIALS"]
+RDS_PROXY_ENDPOINT = os.environ["RDS_PROXY_ENDPOINT"]
+# Session collections unused for longer than this are considered orphaned. Keep it
+# well above the longest time a user may take between uploading and evaluating.
+COLLECTION_TTL_MINUTES = int(os.environ.get("COLLECTION_TTL_MINUTES", "1440"))
+# Number of collections deleted per transaction
+BATCH_SIZE = int(os.environ.get("BATCH_SIZE", "50"))
+
+# AWS Clients
+secrets_manager_client = boto3.client('secretsmanager')
+# Global variables for caching
+connection = None
+db_secret = None
+
+def get_secret():
+    global db_secret
+    if not db_secret:
+        response = secrets_manager_client.get_secret_value(SecretId=DB_SECRET_NAME)["SecretString"]
+        db_secret = json.loads(response)
+    return db_secret
+
+def connect_to_db():
+    global connection
+    if connection is None or connection.closed:
+        try:
+            secret = get_secret()
+            connection_params = {
+                'dbname': secret["dbname"],
+                'user': secret["username"],
+                'password': secret["password"],
+                'host': RDS_PROXY_ENDPOINT,
+                'port': secret["port"]
+            }
+            connection_string = " ".join([f"{key}={value}" for key, value in connection_params.items()])
+            connection = psycopg2.connect(connection_string)
+            logger.info("Connected to the database!")
+        except Exception as e:
+            logger.error(f"Failed to connect to database: {e}")
+            if connection:
+                connection.rollback()
+                connection.close()
+            raise
+    return connection
+
+def get_table_sizes(cur):
+    """
+    Return the total on-disk size (table, indexes and TOAST) of the PGVector tables.
+    """
+    cur.execute("""
+        SELECT pg_total_relation_size('langchain_pg_embedding'),
+               pg_total_relation_size('langchain_pg_collection');
+    """)
+    embedding_size, collection_size = cur.fetchone()
+    return embedding_size + collection_size
+
+def stamp_unmarked_collections(cur):
+    """
+    Give collections created before ingestion started recording `created_at`
+    a timestamp, so they expire one TTL after they are first seen unless the
+    comparison text generation function reads them in the meantime.
+    """
+    cur.execute("""
+        UPDATE langchain_pg_collection
+        SET cmetadata = (COALESCE(cmetadata::jsonb, '{}'::jsonb)
+                         || jsonb_build_object('created_at', now()))::json
+        WHERE cmetadata IS NULL OR cmetadata::jsonb ->> 'created_at' IS NULL;
+    """)
+    return cur.rowcount
+
+def delete_expired_collections(connection):
+    """
+    Delete session collections unused for longer than the TTL, BATCH_SIZE
+    collections per transaction.
+
+    A collection's last use is the `last_used_at` time stamped by the comparison
+    text generation function on every read, or its `created_at` time if it has
+    never been read.
+
+    Returns:
+        dict: The number of collections and embedding rows deleted, and the
+              estimated bytes of row data they occupied.
+    """
+    stats = {"collections_deleted": 0, "rows_deleted": 0, "row_bytes_deleted": 0}
+
+    while True:
+        cur = connection.cursor()
+        try:
+            cur.execute("""
+                SELECT uuid
+                FROM langchain_pg_collection
+                WHERE COALESCE(cmetadata::jsonb ->> 'last_used_at',
+                               cmetadata::jsonb ->> 'created_at')::timestamptz
+                      < now() - make_interval(mins => %s)
+                LIMIT %s;
+            """, (COLLECTION_TTL_MINUTES, BATCH_SIZE))
+            collection_ids = [str(row[0]) for row in cur.fetchall()]
+            if not collection_ids:
+                connection.commit()
+                break
+
+            cur.execute("""
+                SELECT COUNT(*), COALESCE(SUM(pg_column_size(e.*)), 0)
+                FROM langchain_pg_embedding e
+                WHERE collection_id = ANY(%s::uuid[]);
+            """, (collection_ids,))
+            row_count, row_bytes = cur.fetchone()
+
+            cur.execute(
+                "DELETE FROM langchain_pg_embedding WHERE collection_id = ANY(%s::uuid[]);",
+                (collection_ids,)
+            )
+            cur.execute(
+                "DELETE FROM langchain_pg_collection WHERE uuid = ANY(%s::uuid[]);",
+                (collection_ids,)
+            )
+            connection.commit()
+
+            stats["collections_deleted"] += len(collection_ids)
+            stats["rows_deleted"] += row_count
+            stats["row_bytes_deleted"] += int(row_bytes)
+            logger.info(f"Deleted {len(collection_ids)} collections and {row_count} embedding rows.")
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cur.close()
+
+        if len(collection_ids) < BATCH_SIZE:
+            break
+
+    return stats
+
+def vacuum_tables(connection):
+    """
+    Run VACUUM (ANALYZE) on the PGVector tables. VACUUM cannot run inside a
+    transaction block, so autocommit is enabled for the duration.
+    """
+    connection.autocommit = True
+    cur = connection.cursor()
+    try:
+        cur.execute("VACUUM (ANALYZE) langchain_pg_embedding;")
+        cur.execute("VACUUM (ANALYZE) langchain_pg_collection;")
+    finally:
+        cur.close()
+        connection.autocommit = False
+
+
+@logger.inject_lambda_context
+def lambda_handler(event, context):
+    try:
+        connection = connect_to_db()
+        cur = connection.cursor()
+        cur.execute("SELECT to_regclass('langchain_pg_collection') IS NOT NULL;")
+        tables_exist = cur.fetchone()[0]
+        if not tables_exist:
+            cur.close()
+            connection.commit()
+            logger.info("No PGVector tables found. Nothing to sweep.")
+            return {
+                "statusCode": 200,
+                "body": json.dumps({"collections_deleted": 0, "rows_deleted": 0})
+            }
+
+        stamped = stamp_unmarked_collections(cur)
+        size_before = get_table_sizes(cur)
+        connection.commit()
+        cur.close()
+
+        stats = delete_expired_collections(connection)
+        if stats["collections_deleted"]:
+            vacuum_tables(connection)
+
+        cur = connection.cursor()
+        size_after = get_table_sizes(cur)
+        connection.commit()
+        cur.close()
+
+        stats["collections_stamped"] = stamped
+        # Plain VACUUM makes the space reusable but rarely shrinks the files,
+        # so report both the freed row data and the change in on-disk size
+        stats["relation_bytes_reclaimed"] = size_before - size_after
+        logger.info("Comparison collection sweep complete.", extra=stats)
+
+        return {
+            "statusCode": 200,
+            "body": json.dumps(stats)
+        }
+    except Exception as e:
+        logger.error(f"Error sweeping comparison collections: {e}")
+        return {
+            "statusCode": 500,
+            "body": json.dumps("Error sweeping comparison collections")
+        }
@@ -0,0 +1,141 @@
+import os
+import json
+import boto3
+import psycopg2
+from psycopg2.extras import execute_values
+from aws_lambda_powertools import Logger
+
+logger = Logger()
+
+DB_SECRET_NAME = os.environ["SM_DB_CREDENTIALS"]
+RDS_PROXY_ENDPOINT = os.environ["RDS_PROXY_ENDPOINT"]
+
+INSERT_QUERY = """
+    INSERT INTO user_engagement_log (
+        log_id, session_id, document_id, engagement_type,
+        engagement_details, user_role, user_info, timestamp
+    ) VALUES %s
+    ON CONFLICT (log_id) DO NOTHING
+"""
+
+# AWS Clients
+secrets_manager_client = boto3.client('secretsmanager')
+# Global variables for caching
+connection = None
+db_secret = None
+
+def get_secret():
+    global db_secret
+    if not db_secret:
+        response = secrets_manager_client.get_secret_value(SecretId=DB_SECRET_NAME)["SecretString"]
+        db_secret = json.loads(response)
+    return db_secret
+
+def connect_to_db():
+    global connection
+    if connection is None or connection.closed:
+        try:
+            secret = get_secret()
+            connection_params = {
+                'dbname': secret["dbname"],
+                'user': secret["username"],
+                'password': secret["password"],
+                'host': RDS_PROXY_ENDPOINT,
+                'port': secret["port"]
+            }
+            connection_string = " ".join([f"{key}={value}" for key, value in connection_params.items()])
+            connection = psycopg2.connect(connection_string)
+            logger.info("Connected to the database!")
+        except Exception as e:
+            logger.error(f"Failed to connect to database: {e}")
+            if connection:
+                connection.rollback()
+                connection.close()
+            raise
+    return connection
+
+def to_row(record):
+    return (
+        record["log_id"],
+        record["session_id"],
+        record.get("document_id"),
+        record.get("engagement_type"),
+        record.get("engagement_details"),
+        record.get("user_role"),
+        record.get("user_info"),
+        record["timestamp"],
+    )
+
+def insert_rows_individually(connection, rows):
+    """
+    Insert rows one at a time, skipping rows the database rejects (for example a
+    session that was deleted before its log arrived), so one bad row cannot keep
+    the whole batch on the queue.
+
+    Returns:
+        int: The number of rows skipped.
+    """
+    skipped = 0
+    with connection.cursor() as cur:
+        for row in rows:
+            try:
+                cur.execute("SAVEPOINT engagement_row;")
+                execute_values(cur, INSERT_QUERY, [row])
+                cur.execute("RELEASE SAVEPOINT engagement_row;")
+            except psycopg2.DataError as e:
+                cur.execute("ROLLBACK TO SAVEPOINT engagement_row;")
+                logger.warning(f"Skipping invalid engagement record {row[0]}: {e}")
+                skipped += 1
+            except psycopg2.IntegrityError as e:
+                cur.execute("ROLLBACK TO SAVEPOINT engagement_row;")
+                logger.warning(f"Skipping engagement record {row[0]}: {e}")
+                skipped += 1
+    connection.commit()
+    return skipped
+
+def lambda_handler(event, context):
+    """
+    Bulk-insert the engagement records queued by the text generation function.
+
+    Each SQS message holds the records of one chat request. All messages in the
+    batch are written with a single multi-row INSERT and one commit; records that
+    were already written by an earlier delivery are ignored. A message that
+    cannot be parsed is reported in `batchItemFailures`, so only it is retried
+    (and eventually moved to the dead-letter queue) while the rest of the batch
+    is deleted.
+    """
+    rows = []
+    failures = []
+    records = event.get("Records", [])
+    for record in records:
+        try:
+            rows.extend([to_row(item) for item in json.loads(record["body"])])
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Skipping malformed engagement message {record.get('messageId')}: {e}")
+            failures.append({"itemIdentifier": record["messageId"]})
+
+    if not rows:
+        return {"batchItemFailures": failures}
+
+    connection = connect_to_db()
+    skipped = 0
+    try:
+        with connection.cursor() as cur:
+            execute_values(cur, INSERT_QUERY, rows, page_size=len(rows))
+        connection.commit()
+    except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+        connection.rollback()
+        logger.warning(f"Batch insert rejected, retrying row by row: {e}")
+        skipped = insert_rows_individually(connection, rows)
+    except Exception as e:
+        connection.rollback()
+        logger.error(f"Error inserting engagement records: {e}")
+        raise
+
+    logger.info({
+        "messages": len(records),
+        "malformed": len(failures),
+        "inserted": len(rows) - skipped,
+        "skipped": skipped,
+    })
+    return {"batchItemFailures": failures}
@@ -1,5 +1,6 @@
 import os
 import json
+import zlib
 import boto3
 import re
 from aws_lambda_powertools import Logger
@@ -8,29 +9,32 @@ from boto3.dynamodb.conditions import Key
 # Set up logging
 logger = Logger()
 
-# Fetch the DynamoDB table name from environment variables
+# Fetch the DynamoDB table names from environment variables: the per-message
+# history table, and the single-item table that holds sessions started before it
+MESSAGE_TABLE_NAME = os.environ.get("MESSAGE_TABLE_NAME")
 TABLE_NAME = os.environ.get("TABLE_NAME")
 dynamodb = boto3.resource("dynamodb")
-table = dynamodb.Table(TABLE_NAME)
+message_table = dynamodb.Table(MESSAGE_TABLE_NAME)
+table = dynamodb.Table(TABLE_NAME) if TABLE_NAME else None
 
-# Additional DynamoDB client for listing tables
+# Prefix of a compressed message payload, as written by the text generation function
+COMPRESSION_MARKER = b"ZLIB1:"
+
+# Additional DynamoDB client for checking the table
 dynamodb_client = boto3.client("dynamodb")
+# Whether the table has been found by this container
+table_verified = False
 
-def list_dynamodb_tables():
-    """List all DynamoDB tables in the account and return their names."""
-    paginator = dynamodb_client.get_paginator("list_tables")
-    page_iterator = paginator.paginate(Limit=10)
-    
-    table_names = []
-    for page in page_iterator:
-        table_names.extend(page.get("TableNames", []))
-    
-    if not table_names:
-        logger.info("No DynamoDB tables found in your account.")
-    else:
-        logger.info(f"Here are the DynamoDB tables in your account: {table_names}")
-    
-    return table_names
+def history_table_exists():
+    """Check once per container that the history table exists, using a single DescribeTable call."""
+    global table_verified
+    if not table_verified:
+        try:
+            dynamodb_client.describe_table(TableName=MESSAGE_TABLE_NAME)
+            table_verified = True
+        except dynamodb_client.exceptions.ResourceNotFoundException:
+            logger.info(f"DynamoDB table {MESSAGE_TABLE_NAME} not found.")
+    return table_verified
 
 def extract_content_and_questions(content):
     """
@@ -66,9 +70,45 @@ def clean_human_content(content):
     cleaned_lines = [line.strip() for line in lines if line.strip().lower() != "user"]
     return " ".join(cleaned_lines).strip()
 
+def decode_message(value):
+    """
+    Return the LangChain message dict stored in a message item's 'Message' attribute,
+    which is either a JSON string or a zlib stream behind COMPRESSION_MARKER.
+    """
+    if isinstance(value, str):
+        return json.loads(value)
+    data = bytes(value.value)
+    if not data.startswith(COMPRESSION_MARKER):
+        raise ValueError("Unknown history payload encoding")
+    return json.loads(zlib.decompress(data[len(COMPRESSION_MARKER):]).decode("utf-8"))
+
+def read_history(session_id):
+    """
+    Read all messages of a session, oldest first, as LangChain message dicts.
+
+    Messages are stored one item per message and read a page at a time. A session
+    with no message items is read from the single-item table instead.
+    """
+    history = []
+    query = {"KeyConditionExpression": Key("SessionId").eq(session_id)}
+    while True:
+        response = message_table.query(**query)
+        history.extend(decode_message(item["Message"]) for item in response.get("Items", []))
+        if "LastEvaluatedKey" not in response:
+            break
+        query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    if not history and table is not None:
+        try:
+            item = table.get_item(Key={"SessionId": session_id}).get("Item")
+            history = item.get("History", []) if item else []
+        except dynamodb_client.exceptions.ResourceNotFoundException:
+            logger.info(f"DynamoDB table {TABLE_NAME} not found.")
+    return history
+
 def get_messages(session_id):
-    # Check if the table exists by listing all tables
-    if TABLE_NAME not in list_dynamodb_tables():
+    # Check if the table exists
+    if not history_table_exists():
         return {
             "statusCode": 404,
             "headers": {
@@ -77,19 +117,16 @@ def get_messages(session_id):
                 "Access-Control-Allow-Origin": "*",
                 "Access-Control-Allow-Methods": "*",
             },
-            "body": json.dumps({"error": f"Table {TABLE_NAME} not found"})
+            "body": json.dumps({"error": f"Table {MESSAGE_TABLE_NAME} not found"})
         }
     
     try:
         logger.info(f"Fetching messages for session {session_id}")
         
-        # Query DynamoDB for all messages with the given session_id
-        response = table.query(
-            KeyConditionExpression=Key("SessionId").eq(session_id)
-        )
+        history = read_history(session_id)
         
-        # Check if items were returned
-        if 'Items' not in response or not response['Items']:
+        # Check if messages were returned
+        if not history:
             logger.warning(f"No messages found for session {session_id}")
             return {
                 "statusCode": 404,
@@ -104,26 +141,24 @@ def get_messages(session_id):
         
         # Parse the messages to match the required output format
         formatted_messages = []
-        for item in response['Items']:
-            history = item.get("History", [])
-            for entry in history:
-                message_type = entry.get("type", "unknown")
-                content_data = entry.get("data", {}).get("content", "")
-                
-                # Clean content for human messages to remove unwanted prefixes
-                if message_type == "human":
-                    content_data = clean_human_content(content_data)
-                
-                # Use the extract_content_and_questions function to split content and questions
-                main_content, questions = extract_content_and_questions(content_data)
-                
-                # Format each message with Type, Content, and Options
-                formatted_message = {
-                    "Type": message_type,
-                    "Content": main_content,
-                    "Options": questions
-                }
-                formatted_messages.append(formatted_message)
+        for entry in history:
+            message_type = entry.get("type", "unknown")
+            content_data = entry.get("data", {}).get("content", "")
+            
+            # Clean content for human messages to remove unwanted prefixes
+            if message_type == "human":
+                content_data = clean_human_content(content_data)
+            
+            # Use the extract_content_and_questions function to split content and questions
+            main_content, questions = extract_content_and_questions(content_data)
+            
+            # Format each message with Type, Content, and Options
+            formatted_message = {
+                "Type": message_type,
+                "Content": main_content,
+                "Options": questions
+            }
+            formatted_messages.append(formatted_message)
         
         logger.info(f"Messages fetched and formatted successfully for session {session_id}")
         
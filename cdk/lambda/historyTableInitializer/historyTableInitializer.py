@@ -0,0 +1,41 @@
+import os
+import boto3
+
+MESSAGE_TABLE_NAME = os.environ["MESSAGE_TABLE_NAME"]
+
+dynamodb_client = boto3.client("dynamodb")
+
+def create_message_table(table_name):
+    """
+    Create the DynamoDB table that stores chat session history if it does not already exist.
+    Each message is its own item, keyed by 'SessionId' and the numeric 'Seq' sort key,
+    and the table uses on-demand billing (PAY_PER_REQUEST).
+    """
+    try:
+        dynamodb_client.describe_table(TableName=table_name)
+        print(f"DynamoDB table '{table_name}' already exists. No action taken.")
+        return
+    except dynamodb_client.exceptions.ResourceNotFoundException:
+        pass
+
+    print(f"DynamoDB table '{table_name}' does not exist. Creating now.")
+    dynamodb_client.create_table(
+        TableName=table_name,
+        KeySchema=[
+            {"AttributeName": "SessionId", "KeyType": "HASH"},
+            {"AttributeName": "Seq", "KeyType": "RANGE"},
+        ],
+        AttributeDefinitions=[
+            {"AttributeName": "SessionId", "AttributeType": "S"},
+            {"AttributeName": "Seq", "AttributeType": "N"},
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    dynamodb_client.get_waiter("table_exists").wait(TableName=table_name)
+    print(f"DynamoDB table '{table_name}' created successfully.")
+
+def handler(event, context):
+    # Provision the chat history table at deploy time, so the chat Lambdas
+    # do not have to look for it on every request. The single-item table of
+    # earlier deployments is left in place and only read for older sessions.
+    create_message_table(MESSAGE_TABLE_NAME)
@@ -7,8 +7,12 @@ import * as iam from "aws-cdk-lib/aws-iam";
 import * as ssm from "aws-cdk-lib/aws-ssm";
 import { ISchema } from "aws-cdk-lib/aws-appsync";
 import * as sqs from "aws-cdk-lib/aws-sqs";
+import * as cloudwatch from "aws-cdk-lib/aws-cloudwatch";
+import * as events from "aws-cdk-lib/aws-events";
+import * as targets from "aws-cdk-lib/aws-events-targets";
 import { Construct } from "constructs";
 import { Duration } from "aws-cdk-lib";
+import { triggers } from "aws-cdk-lib";
 import * as wafv2 from "aws-cdk-lib/aws-wafv2";
 import {
   Architecture,
@@ -94,6 +98,43 @@ export class ApiGatewayStack extends cdk.Stack {
       visibilityTimeout: cdk.Duration.seconds(900),
     });
 
+    // Engagement batches the consumer keeps failing on, kept for inspection and redrive
+    const engagementLogDeadLetterQueue = new sqs.Queue(
+      this,
+      `${id}-EngagementLogDeadLetterQueue`,
+      {
+        queueName: `${id}-engagement-log-dlq`,
+        removalPolicy: cdk.RemovalPolicy.DESTROY,
+        retentionPeriod: cdk.Duration.days(14),
+      }
+    );
+
+    // Standard SQS queue batching user engagement records for bulk inserts
+    const engagementLogQueue = new sqs.Queue(this, `${id}-EngagementLogQueue`, {
+      queueName: `${id}-engagement-log-queue`,
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+      visibilityTimeout: cdk.Duration.seconds(360),
+      deadLetterQueue: {
+        queue: engagementLogDeadLetterQueue,
+        maxReceiveCount: 5,
+      },
+    });
+
+    // Any message in the dead-letter queue means engagement records are not being written
+    new cloudwatch.Alarm(this, `${id}-EngagementLogDeadLetterAlarm`, {
+      alarmName: `${id}-engagement-log-dlq-not-empty`,
+      alarmDescription:
+        "User engagement records failed to insert 5 times and were moved to the dead-letter queue.",
+      metric: engagementLogDeadLetterQueue.metricApproximateNumberOfMessagesVisible({
+        period: cdk.Duration.minutes(5),
+        statistic: cloudwatch.Stats.MAXIMUM,
+      }),
+      threshold: 1,
+      evaluationPeriods: 1,
+      comparisonOperator: cloudwatch.ComparisonOperator.GREATER_THAN_OR_EQUAL_TO_THRESHOLD,
+      treatMissingData: cloudwatch.TreatMissingData.NOT_BREACHING,
+    });
+
     const { jwt, postgres, psycopgLayer } = createLayers(this, id);
     this.layerList["psycopg2"] = psycopgLayer;
     this.layerList["postgres"] = postgres;
@@ -423,6 +464,8 @@ export class ApiGatewayStack extends cdk.Stack {
       environment: {
         SM_DB_CREDENTIALS: db.secretPathUser.secretName,
         TABLE_NAME: "DynamoDB-Conversation-Table",
+        MESSAGE_TABLE_NAME: "DynamoDB-Conversation-Messages",
+        HISTORY_PAGE_SIZE: "500",
         RDS_PROXY_ENDPOINT: db.rdsProxyEndpoint,
         CHATLOGS_BUCKET: csv_bucket.bucketName,
         APPSYNC_API_URL: this.downloadMessagesApi.graphqlUrl,
@@ -446,8 +489,9 @@ export class ApiGatewayStack extends cdk.Stack {
     csvQueue.grantConsumeMessages(chatHistory);
     chatHistory.addToRolePolicy(
       new iam.PolicyStatement({
-        actions: ["dynamodb:Query"],
+        actions: ["dynamodb:Query", "dynamodb:GetItem"],
         resources: [
+          `arn:aws:dynamodb:${this.region}:${this.account}:table/DynamoDB-Conversation-Messages`,
           `arn:aws:dynamodb:${this.region}:${this.account}:table/DynamoDB-Conversation-Table`,
         ],
       })
@@ -824,6 +868,15 @@ export class ApiGatewayStack extends cdk.Stack {
         stringValue: "meta.llama3-70b-instruct-v1:0",
       }
     );
+    const rewriteLLMParameter = new ssm.StringParameter(
+      this,
+      "RewriteLLMParameter",
+      {
+        parameterName: `/${id}/DSA/RewriteLLMId`,
+        description: "Parameter containing the Bedrock LLM ID used to rewrite follow-up questions",
+        stringValue: "meta.llama3-8b-instruct-v1:0",
+      }
+    );
     const embeddingModelParameter = new ssm.StringParameter(
       this,
       "EmbeddingModelParameter",
@@ -844,6 +897,31 @@ export class ApiGatewayStack extends cdk.Stack {
       }
     );
 
+    // Provision the chat history table during deployment instead of on the chat hot path
+    const historyTableInitializer = new triggers.TriggerFunction(
+      this,
+      `${id}-HistoryTableInitializer`,
+      {
+        functionName: `${id}-HistoryTableInitializer`,
+        runtime: lambda.Runtime.PYTHON_3_9,
+        handler: "historyTableInitializer.handler",
+        timeout: Duration.seconds(300),
+        memorySize: 128,
+        environment: {
+          MESSAGE_TABLE_NAME: "DynamoDB-Conversation-Messages",
+        },
+        code: lambda.Code.fromAsset("lambda/historyTableInitializer"),
+      }
+    );
+
+    historyTableInitializer.addToRolePolicy(
+      new iam.PolicyStatement({
+        effect: iam.Effect.ALLOW,
+        actions: ["dynamodb:CreateTable", "dynamodb:DescribeTable"],
+        resources: [`arn:aws:dynamodb:${this.region}:${this.account}:table/DynamoDB-Conversation-Messages`],
+      })
+    );
+
     const documentCompFunc = new lambda.DockerImageFunction(
       this,
       `${id}-documentCompFunction`,
@@ -864,11 +942,45 @@ export class ApiGatewayStack extends cdk.Stack {
           TABLE_NAME_PARAM: tableNameParameter.parameterName,
           COMP_TEXT_GEN_QUEUE_URL: compTextGenQueue.queueUrl,
           APPSYNC_API_URL: this.compTextGenApi.graphqlUrl,
-          API_KEY: "API_KEY"
+          API_KEY: "API_KEY",
+          EMBEDDING_BUCKET_NAME: embeddingStorageBucket.bucketName,
+          COMPARISON_INDEX_BACKEND: "pgvector",
+          CONTEXT_MAX_TOKENS: "2000",
         },
       }
     );
 
+    // Read and delete the in-memory comparison index blobs written by comparison ingestion
+    documentCompFunc.addToRolePolicy(
+      new iam.PolicyStatement({
+        effect: iam.Effect.ALLOW,
+        actions: ["s3:GetObject", "s3:DeleteObject"],
+        resources: [
+          `arn:aws:s3:::${embeddingStorageBucket.bucketName}/comparison_index/*`,
+        ],
+      })
+    );
+
+    // List the index parts of a session (one blob per ingestion invocation)
+    documentCompFunc.addToRolePolicy(
+      new iam.PolicyStatement({
+        effect: iam.Effect.ALLOW,
+        actions: ["s3:ListBucket"],
+        resources: [embeddingStorageBucket.bucketArn],
+        conditions: {
+          StringLike: { "s3:prefix": ["comparison_index/*"] },
+        },
+      })
+    );
+
+    // Index blobs are normally deleted after the evaluation; expire any left
+    // behind by sessions that never reached it
+    embeddingStorageBucket.addLifecycleRule({
+      id: "ExpireComparisonIndex",
+      prefix: "comparison_index/",
+      expiration: cdk.Duration.days(7),
+    });
+
     documentCompFunc.addToRolePolicy(
       new iam.PolicyStatement({
         effect: iam.Effect.ALLOW,
@@ -948,9 +1060,44 @@ export class ApiGatewayStack extends cdk.Stack {
           RDS_PROXY_ENDPOINT: db.rdsProxyEndpoint,
           REGION: this.region,
           BEDROCK_LLM_PARAM: bedrockLLMParameter.parameterName,
+          REWRITE_LLM_PARAM: rewriteLLMParameter.parameterName,
+          REWRITE_TIMEOUT_SECONDS: "3",
           EMBEDDING_MODEL_PARAM: embeddingModelParameter.parameterName,
           TABLE_NAME_PARAM: tableNameParameter.parameterName,
           COMP_TEXT_GEN_QUEUE_URL: compTextGenQueue.queueUrl,
+          ENGAGEMENT_LOG_QUEUE_URL: engagementLogQueue.queueUrl,
+          CORPUS_STATE_TTL_SECONDS: "30",
+          PROMPT_CACHE_TTL_SECONDS: "60",
+          HISTORY_TABLE_CHECK: "describe",
+          MESSAGE_TABLE_NAME: "DynamoDB-Conversation-Messages",
+          HISTORY_LEGACY_FALLBACK: "true",
+          HISTORY_READ_LIMIT: "40",
+          HISTORY_COMPRESSION_ENABLED: "true",
+          HISTORY_COMPRESS_MIN_BYTES: "512",
+          HISTORY_CACHE_ENABLED: "true",
+          HISTORY_CACHE_MAX_SESSIONS: "200",
+          HISTORY_CACHE_TTL_SECONDS: "900",
+          ANSWER_CACHE_ENABLED: "true",
+          ANSWER_CACHE_SIMILARITY: "0.95",
+          ANSWER_CACHE_MAX_ENTRIES: "50",
+          RETRIEVAL_CACHE_TTL_SECONDS: "300",
+          RETRIEVAL_CACHE_MAX_ENTRIES: "256",
+          RETRIEVAL_FETCH_K: "12",
+          RETRIEVAL_TOP_N: "3",
+          RERANK_DIVERSITY: "0.3",
+          CONTEXT_MAX_TOKENS: "1500",
+          HISTORY_WINDOW_TURNS: "4",
+          HISTORY_MAX_TOKENS: "1500",
+          HISTORY_SUMMARY_ENABLED: "true",
+          LLM_MAX_ATTEMPTS: "3",
+          LLM_RETRY_BACKOFF_SECONDS: "0.5",
+          RESPONSE_DEADLINE_MARGIN_SECONDS: "5",
+          LLM_HEDGING_ENABLED: "false",
+          LLM_HEDGE_AFTER_SECONDS: "10",
+          TRACE_METRICS_NAMESPACE: "DSA/TextGeneration",
+          TRACE_RESPONSE_HEADERS: "false",
+          APPSYNC_API_URL: this.compTextGenApi.graphqlUrl,
+          API_KEY: "API_KEY",
         },
       }
     );
@@ -1003,11 +1150,18 @@ export class ApiGatewayStack extends cdk.Stack {
 
     const bedrockPolicyStatement = new iam.PolicyStatement({
       effect: iam.Effect.ALLOW,
-      actions: ["bedrock:InvokeModel", "bedrock:InvokeEndpoint"],
+      actions: [
+        "bedrock:InvokeModel",
+        "bedrock:InvokeEndpoint",
+        "bedrock:InvokeModelWithResponseStream", // Streamed chat answers
+      ],
       resources: [
         "arn:aws:bedrock:" +
           this.region +
           "::foundation-model/meta.llama3-70b-instruct-v1:0",
+        "arn:aws:bedrock:" +
+          this.region +
+          "::foundation-model/meta.llama3-8b-instruct-v1:0",
         "arn:aws:bedrock:" +
           this.region +
           "::foundation-model/amazon.titan-embed-text-v2:0",
@@ -1054,12 +1208,13 @@ export class ApiGatewayStack extends cdk.Stack {
       new iam.PolicyStatement({
         effect: iam.Effect.ALLOW,
         actions: [
-          "dynamodb:ListTables",
           "dynamodb:CreateTable",
           "dynamodb:DescribeTable",
           "dynamodb:PutItem",
           "dynamodb:GetItem",
           "dynamodb:UpdateItem",
+          "dynamodb:Query",
+          "dynamodb:BatchWriteItem",
         ],
         resources: [`arn:aws:dynamodb:${this.region}:${this.account}:table/*`],
       })
@@ -1071,6 +1226,7 @@ export class ApiGatewayStack extends cdk.Stack {
         actions: ["ssm:GetParameter"],
         resources: [
           bedrockLLMParameter.parameterArn,
+          rewriteLLMParameter.parameterArn,
           embeddingModelParameter.parameterArn,
           tableNameParameter.parameterArn,
         ],
@@ -1181,6 +1337,7 @@ export class ApiGatewayStack extends cdk.Stack {
     // compTextGenQueue.grantSendMessages(compTextGenFunction);
     compTextGenQueue.grantConsumeMessages(documentCompFunc);
     compTextGenQueue.grantSendMessages(textGenFunc);
+    engagementLogQueue.grantSendMessages(textGenFunc);
     // Override the Logical ID of the Lambda Function to get ARN in OpenAPI
     const cfncompTextGenFunction = compTextGenFunction.node.defaultChild as lambda.CfnFunction;
     cfncompTextGenFunction.overrideLogicalId("compTextGenFunction");
@@ -1243,7 +1400,11 @@ export class ApiGatewayStack extends cdk.Stack {
           EVENT_NOTIFICATION_LAMBDA_NAME: notificationFunction.functionName,
           APPSYNC_API_URL: this.eventApi.graphqlUrl,
           APPSYNC_API_ID: this.eventApi.apiId,
-          API_KEY: "API_KEY"
+          API_KEY: "API_KEY",
+          CHUNK_SIZE_TOKENS: "512",
+          CHUNK_OVERLAP_TOKENS: "64",
+          COMPARISON_INDEX_BACKEND: "pgvector",
+          MAX_CONCURRENT_SESSIONS: "5",
         },
       }
     );
@@ -1298,6 +1459,7 @@ export class ApiGatewayStack extends cdk.Stack {
     comparisonDataIngestFunction.addEventSource(
       new lambdaEventSources.SqsEventSource(comparisonQueue, {
         batchSize: 5,
+        reportBatchItemFailures: true,
       })
     );
 
@@ -1359,6 +1521,95 @@ export class ApiGatewayStack extends cdk.Stack {
 
     notificationFunction.grantInvoke(comparisonDataIngestFunction);
 
+    /**
+     *
+     * Create Lambda function that deletes orphaned comparison session collections on a schedule
+     */
+    const comparisonSweeperFunction = new lambda.Function(
+      this,
+      `${id}-ComparisonSweeperFunc`,
+      {
+        runtime: lambda.Runtime.PYTHON_3_9,
+        code: lambda.Code.fromAsset("lambda/comparisonSweeper"),
+        handler: "comparisonSweeper.lambda_handler",
+        timeout: Duration.seconds(900),
+        memorySize: 256,
+        vpc: vpcStack.vpc,
+        environment: {
+          SM_DB_CREDENTIALS: db.comparisonSecretPathAdminName,
+          RDS_PROXY_ENDPOINT: db.comparisonRdsProxyEndpointAdmin,
+          COLLECTION_TTL_MINUTES: "1440",
+          BATCH_SIZE: "50",
+        },
+        functionName: `${id}-ComparisonSweeperFunc`,
+        layers: [psycopgLayer, powertoolsLayer],
+      }
+    );
+
+    comparisonSweeperFunction.addToRolePolicy(
+      new iam.PolicyStatement({
+        effect: iam.Effect.ALLOW,
+        actions: [
+          //Secrets Manager
+          "secretsmanager:GetSecretValue",
+        ],
+        resources: [
+          `arn:aws:secretsmanager:${this.region}:${this.account}:secret:*`,
+        ],
+      })
+    );
+
+    new events.Rule(this, `${id}-ComparisonSweeperSchedule`, {
+      schedule: events.Schedule.rate(Duration.hours(1)),
+      targets: [new targets.LambdaFunction(comparisonSweeperFunction)],
+    });
+
+    /**
+     *
+     * Create Lambda function that bulk-inserts queued user engagement records
+     */
+    const engagementLogConsumerFunction = new lambda.Function(
+      this,
+      `${id}-EngagementLogConsumerFunc`,
+      {
+        runtime: lambda.Runtime.PYTHON_3_9,
+        code: lambda.Code.fromAsset("lambda/engagementLogConsumer"),
+        handler: "engagementLogConsumer.lambda_handler",
+        timeout: Duration.seconds(60),
+        memorySize: 128,
+        vpc: vpcStack.vpc,
+        environment: {
+          SM_DB_CREDENTIALS: db.secretPathUser.secretName,
+          RDS_PROXY_ENDPOINT: db.rdsProxyEndpoint,
+        },
+        functionName: `${id}-EngagementLogConsumerFunc`,
+        layers: [psycopgLayer, powertoolsLayer],
+      }
+    );
+
+    engagementLogConsumerFunction.addToRolePolicy(
+      new iam.PolicyStatement({
+        effect: iam.Effect.ALLOW,
+        actions: [
+          //Secrets Manager
+          "secretsmanager:GetSecretValue",
+        ],
+        resources: [
+          `arn:aws:secretsmanager:${this.region}:${this.account}:secret:*`,
+        ],
+      })
+    );
+
+    // Collect up to 100 chat requests' records, or 30 seconds' worth, per insert
+    engagementLogConsumerFunction.addEventSource(
+      new lambdaEventSources.SqsEventSource(engagementLogQueue, {
+        batchSize: 100,
+        maxBatchingWindow: Duration.seconds(30),
+        // Only malformed messages are retried, not the whole batch
+        reportBatchItemFailures: true,
+      })
+    );
+
     // Create the Lambda function for generating presigned URLs
     const generatePreSignedURL = new lambda.Function(
       this,
@@ -1627,7 +1878,8 @@ export class ApiGatewayStack extends cdk.Stack {
         memorySize: 128,
         vpc: vpcStack.vpc, // Ensure it's in the correct VPC if needed
         environment: {
-          TABLE_NAME: "DynamoDB-Conversation-Table", // Use the correct DynamoDB table name
+          TABLE_NAME: "DynamoDB-Conversation-Table", // Single-item table of sessions started before per-message history
+          MESSAGE_TABLE_NAME: "DynamoDB-Conversation-Messages", // Per-message history table
           REGION: this.region,
         },
         functionName: `${id}-GetMessagesFunction`,
@@ -1641,10 +1893,11 @@ export class ApiGatewayStack extends cdk.Stack {
       new iam.PolicyStatement({
         effect: iam.Effect.ALLOW,
         actions: [
-          "dynamodb:ListTables", // Allow listing of all DynamoDB tables
+          "dynamodb:DescribeTable", // Allow checking that the history table exists
           "dynamodb:Query", // Allow querying on specific table
+          "dynamodb:GetItem", // Allow reading sessions from the single-item table
         ],
-        resources: ["*"], // Set to "*" as ListTables does not support table-specific ARNs
+        resources: ["*"],
       })
     );
 
@@ -1654,6 +1907,7 @@ export class ApiGatewayStack extends cdk.Stack {
         effect: iam.Effect.ALLOW,
         actions: ["dynamodb:Query"],
         resources: [
+          `arn:aws:dynamodb:${this.region}:${this.account}:table/DynamoDB-Conversation-Messages`,
           `arn:aws:dynamodb:${this.region}:${this.account}:table/DynamoDB-Conversation-Table`,
         ],
       })
@@ -1668,6 +1922,7 @@ export class ApiGatewayStack extends cdk.Stack {
       new iam.PolicyStatement({
         actions: ["dynamodb:Query"],
         resources: [
+          `arn:aws:dynamodb:${this.region}:${this.account}:table/DynamoDB-Conversation-Messages`,
           `arn:aws:dynamodb:${this.region}:${this.account}:table/DynamoDB-Conversation-Table`,
         ],
       })
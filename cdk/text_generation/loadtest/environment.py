@@ -0,0 +1,174 @@
+"""
+Local stand-in for the AWS environment of the text_generation function.
+
+Sets the Lambda's environment variables, creates the SSM parameters, secret
+and history tables inside moto (started by the caller), and prepares a local Postgres (with the pgvector
+extension) with the tables and a synthetic corpus the handler expects.
+"""
+import os
+import json
+import uuid
+import datetime
+
+import boto3
+import psycopg2
+
+REGION = "us-east-1"
+TABLE_NAME = "DynamoDB-Conversation-Table"
+MESSAGE_TABLE_NAME = "DynamoDB-Conversation-Messages"
+SECRET_NAME = "loadtest/dsa/credentials"
+BEDROCK_LLM_ID = "fake.answer-model"
+REWRITE_LLM_ID = "fake.rewrite-model"
+EMBEDDING_MODEL_ID = "fake.embedding-model"
+PARAMETERS = {
+    "BEDROCK_LLM_PARAM": ("/loadtest/DSA/BedrockLLMId", BEDROCK_LLM_ID),
+    "REWRITE_LLM_PARAM": ("/loadtest/DSA/RewriteLLMId", REWRITE_LLM_ID),
+    "EMBEDDING_MODEL_PARAM": ("/loadtest/DSA/EmbeddingModelId", EMBEDDING_MODEL_ID),
+    "TABLE_NAME_PARAM": ("/loadtest/DSA/TableName", TABLE_NAME),
+}
+ROLE_PROMPT = "You are helping {role} users understand the Digital Learning Strategy."
+CORPUS_TOPICS = [
+    "accessibility of online learning",
+    "open educational resources",
+    "digital literacy for educators",
+    "broadband access in rural communities",
+    "privacy and data protection",
+    "indigenous learners and digital learning",
+    "technology-enabled assessment",
+    "institutional collaboration and shared services",
+]
+
+
+def set_lambda_environment(pg: dict) -> None:
+    """
+    Set the environment variables the handler reads at import time.
+    """
+    os.environ.update({
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "AWS_SESSION_TOKEN": "testing",
+        "AWS_DEFAULT_REGION": REGION,
+        "REGION": REGION,
+        "SM_DB_CREDENTIALS": SECRET_NAME,
+        "RDS_PROXY_ENDPOINT": pg["host"],
+        "COMP_TEXT_GEN_QUEUE_URL": f"https://sqs.{REGION}.amazonaws.com/123456789012/loadtest-comp.fifo",
+        "MESSAGE_TABLE_NAME": MESSAGE_TABLE_NAME,
+        "HISTORY_TABLE_CHECK": "describe",
+    })
+    for env_name, (parameter_name, _) in PARAMETERS.items():
+        os.environ[env_name] = parameter_name
+    # Streaming notifications and the engagement queue are outside the harness
+    os.environ.pop("APPSYNC_API_URL", None)
+    os.environ.pop("ENGAGEMENT_LOG_QUEUE_URL", None)
+
+
+def provision_aws(pg: dict) -> None:
+    """
+    Create the SSM parameters, database secret and history tables inside moto.
+    """
+    ssm = boto3.client("ssm", region_name=REGION)
+    for parameter_name, value in PARAMETERS.values():
+        ssm.put_parameter(Name=parameter_name, Value=value, Type="String", Overwrite=True)
+
+    boto3.client("secretsmanager", region_name=REGION).create_secret(
+        Name=SECRET_NAME,
+        SecretString=json.dumps({
+            "dbname": pg["dbname"],
+            "username": pg["user"],
+            "password": pg["password"],
+            "port": pg["port"],
+        }),
+    )
+
+    dynamodb = boto3.client("dynamodb", region_name=REGION)
+    # The legacy single-item table, read for sessions with no per-message items
+    dynamodb.create_table(
+        TableName=TABLE_NAME,
+        KeySchema=[{"AttributeName": "SessionId", "KeyType": "HASH"}],
+        AttributeDefinitions=[{"AttributeName": "SessionId", "AttributeType": "S"}],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    dynamodb.create_table(
+        TableName=MESSAGE_TABLE_NAME,
+        KeySchema=[
+            {"AttributeName": "SessionId", "KeyType": "HASH"},
+            {"AttributeName": "Seq", "KeyType": "RANGE"},
+        ],
+        AttributeDefinitions=[
+            {"AttributeName": "SessionId", "AttributeType": "S"},
+            {"AttributeName": "Seq", "AttributeType": "N"},
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+
+
+def connect(pg: dict):
+    return psycopg2.connect(
+        dbname=pg["dbname"], user=pg["user"], password=pg["password"],
+        host=pg["host"], port=pg["port"]
+    )
+
+
+def prepare_database(pg: dict, session_ids, embeddings, documents: int) -> None:
+    """
+    Create the tables the handler reads and writes, register the trace's
+    sessions and load a synthetic corpus into the "all" collection.
+    """
+    connection = connect(pg)
+    with connection, connection.cursor() as cur:
+        cur.execute("""
+            CREATE EXTENSION IF NOT EXISTS vector;
+            CREATE TABLE IF NOT EXISTS "prompts" (
+                "public" text, "educator" text, "admin" text, "time_created" timestamp
+            );
+            CREATE TABLE IF NOT EXISTS "sessions" (
+                "session_id" uuid PRIMARY KEY, "time_created" timestamp
+            );
+            CREATE TABLE IF NOT EXISTS "user_engagement_log" (
+                "log_id" uuid PRIMARY KEY,
+                "session_id" uuid REFERENCES "sessions" ("session_id") ON DELETE CASCADE,
+                "document_id" uuid, "engagement_type" varchar, "engagement_details" text,
+                "user_role" varchar, "user_info" text, "timestamp" timestamp
+            );
+        """)
+        cur.execute("SELECT COUNT(*) FROM prompts;")
+        if cur.fetchone()[0] == 0:
+            cur.execute(
+                "INSERT INTO prompts (public, educator, admin, time_created) VALUES (%s, %s, %s, %s);",
+                (
+                    ROLE_PROMPT.format(role="public"),
+                    ROLE_PROMPT.format(role="educator"),
+                    ROLE_PROMPT.format(role="admin"),
+                    datetime.datetime.now(),
+                ),
+            )
+        cur.executemany(
+            "INSERT INTO sessions (session_id, time_created) VALUES (%s, now()) ON CONFLICT DO NOTHING;",
+            [(session_id,) for session_id in session_ids],
+        )
+    connection.close()
+
+    # Imported here so that --help works without the Lambda's dependencies
+    from langchain_core.documents import Document
+    from langchain_postgres import PGVector
+
+    vectorstore = PGVector(
+        embeddings=embeddings,
+        collection_name="all",
+        connection=f"postgresql+psycopg://{pg['user']}:{pg['password']}@{pg['host']}:{pg['port']}/{pg['dbname']}",
+        use_jsonb=True,
+    )
+    vectorstore.delete_collection()
+    vectorstore.create_collection()
+    vectorstore.add_documents([
+        Document(
+            page_content=(
+                f"Section {index} of the Digital Learning Strategy covers "
+                f"{CORPUS_TOPICS[index % len(CORPUS_TOPICS)]}. "
+                "Institutions are encouraged to share practices and plan together. "
+                "Learners benefit from consistent, accessible and flexible options. "
+            ) * 3,
+            metadata={"source": "s3://loadtest/strategy.pdf", "page": index},
+        )
+        for index in range(documents)
+    ], ids=[str(uuid.uuid4()) for _ in range(documents)])
@@ -0,0 +1,131 @@
+"""
+Stand-ins for Bedrock used by the load-test harness.
+
+The fakes reproduce the latency shape of the real services (time to first
+token, per-token generation time, embedding round trip) without calling AWS,
+and report how long each call took to the harness's stage recorder.
+"""
+import time
+import random
+import hashlib
+from typing import Any, Callable, Iterator, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+ANSWER_TEMPLATE = (
+    "-----Documents used to respond: {context}-----\n"
+    "The Digital Learning Strategy addresses this through coordinated support for "
+    "institutions, educators and learners. {filler}\n"
+    "You might have the following questions: How is this funded? "
+    "Who is responsible for implementation? Where can I find more resources?"
+)
+FILLER_SENTENCE = "It sets out guidance that institutions can adapt to their own context. "
+
+
+def jittered(seconds: float, jitter: float) -> float:
+    """
+    Return `seconds` varied by up to +/- `jitter` as a fraction, never negative.
+    """
+    return max(0.0, seconds * (1 + random.uniform(-jitter, jitter)))
+
+
+class FakeStreamingChatModel(BaseChatModel):
+    """
+    Chat model that answers with canned text at a configurable speed.
+
+    Invocation sleeps for `first_token_seconds` and then `seconds_per_token` for
+    each output token; streaming yields the tokens at the same pace.
+    """
+    label: str = "llm"
+    first_token_seconds: float = 0.6
+    seconds_per_token: float = 0.02
+    output_tokens: int = 250
+    jitter: float = 0.3
+    recorder: Optional[Callable[[str, float], None]] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming-chat"
+
+    def get_tokens(self, messages: List[BaseMessage]) -> List[str]:
+        if self.label == "llm_rewrite":
+            text = str(messages[-1].content).strip()
+        else:
+            filler_count = max(1, self.output_tokens // 12)
+            text = ANSWER_TEMPLATE.format(
+                context=str(messages[0].content)[-200:].replace("\n", " "),
+                filler=FILLER_SENTENCE * filler_count,
+            )
+        return [word + " " for word in text.split(" ")]
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        start = time.perf_counter()
+        time.sleep(jittered(self.first_token_seconds, self.jitter))
+        for token in self.get_tokens(messages):
+            time.sleep(jittered(self.seconds_per_token, self.jitter))
+            if run_manager:
+                run_manager.on_llm_new_token(token)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+        if self.recorder:
+            self.recorder(self.label, time.perf_counter() - start)
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        start = time.perf_counter()
+        tokens = self.get_tokens(messages)
+        time.sleep(jittered(self.first_token_seconds + self.seconds_per_token * len(tokens), self.jitter))
+        if self.recorder:
+            self.recorder(self.label, time.perf_counter() - start)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic embeddings derived from a hash of the text, with a simulated
+    round trip per call.
+    """
+
+    def __init__(
+        self,
+        dimensions: int = 1024,
+        latency_seconds: float = 0.05,
+        jitter: float = 0.3,
+        recorder: Optional[Callable[[str, float], None]] = None
+    ):
+        self.dimensions = dimensions
+        self.latency_seconds = latency_seconds
+        self.jitter = jitter
+        self.recorder = recorder
+
+    def vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+        generator = random.Random(seed)
+        values = [generator.gauss(0, 1) for _ in range(self.dimensions)]
+        norm = sum(value * value for value in values) ** 0.5
+        return [value / norm for value in values]
+
+    def embed_query(self, text: str) -> List[float]:
+        start = time.perf_counter()
+        time.sleep(jittered(self.latency_seconds, self.jitter))
+        vector = self.vector(text)
+        if self.recorder:
+            self.recorder("embedding", time.perf_counter() - start)
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.vector(text) for text in texts]
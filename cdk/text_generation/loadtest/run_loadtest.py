@@ -0,0 +1,337 @@
+"""
+Replay a conversation trace against the text_generation handler offline.
+
+Each worker process stands in for one warm Lambda container: it imports
+`main` once, with Bedrock replaced by fakes and AWS by moto, and replays its
+share of the trace's sessions one request at a time. Postgres is shared by
+all workers, as the RDS proxy is in production.
+
+Usage:
+    python run_loadtest.py --trace traces/sample_trace.jsonl --concurrency 4
+    python run_loadtest.py --synthetic-sessions 40 --turns 5 --concurrency 8 --output report.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import multiprocessing
+from collections import defaultdict
+
+HARNESS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(HARNESS_DIR), "src")
+
+# Turns used when no trace is given; follow-ups exercise the question rewrite path
+SYNTHETIC_OPENERS = [
+    "What does the Digital Learning Strategy say about accessibility?",
+    "How are open educational resources supported?",
+    "What guidance is there on privacy and data protection?",
+    "How will broadband access be improved for rural learners?",
+    "What does the strategy recommend for digital literacy of educators?",
+]
+SYNTHETIC_FOLLOW_UPS = [
+    "Can you tell me more about that?",
+    "Who is responsible for it?",
+    "How does it apply to indigenous learners?",
+    "What about technology-enabled assessment?",
+    "Why is that important?",
+]
+SYNTHETIC_ROLES = ["public", "educator", "admin"]
+STAGES_IN_REPORT_ORDER = [
+    "total", "prompt_fetch", "corpus_check", "answer_cache", "runtime_build",
+    "response", "retrieval", "embedding", "llm_rewrite", "llm_answer", "engagement_flush",
+]
+
+
+class FakeLambdaContext:
+    """
+    Minimal Lambda context, for the handler's response deadline.
+    """
+
+    def __init__(self, timeout_seconds: float):
+        self.deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self) -> int:
+        return int(max(0.0, self.deadline - time.monotonic()) * 1000)
+
+
+def load_trace(path):
+    """
+    Read a JSONL trace of {"session", "turn", "role", "message"} records and
+    group it into sessions of ordered turns.
+    """
+    sessions = defaultdict(list)
+    with open(path) as trace_file:
+        for line in trace_file:
+            if line.strip():
+                record = json.loads(line)
+                sessions[str(record["session"])].append(record)
+    return [
+        {
+            # The sessions table keys on UUIDs; recorded traces may not
+            "session_id": str(uuid.uuid5(uuid.NAMESPACE_URL, session)),
+            "turns": sorted(turns, key=lambda record: record["turn"]),
+        }
+        for session, turns in sessions.items()
+    ]
+
+
+def generate_trace(session_count, turns, seed):
+    """
+    Build a synthetic trace: each session opens with a greeting, asks a
+    standalone question, then mixes follow-ups and new topics.
+    """
+    generator = random.Random(seed)
+    sessions = []
+    for _ in range(session_count):
+        role = generator.choice(SYNTHETIC_ROLES)
+        messages = [""]
+        messages.append(generator.choice(SYNTHETIC_OPENERS))
+        while len(messages) < turns:
+            pool = SYNTHETIC_FOLLOW_UPS if generator.random() < 0.6 else SYNTHETIC_OPENERS
+            messages.append(generator.choice(pool))
+        sessions.append({
+            "session_id": str(uuid.UUID(int=generator.getrandbits(128), version=4)),
+            "turns": [
+                {"turn": index, "role": role, "message": message}
+                for index, message in enumerate(messages)
+            ],
+        })
+    return sessions
+
+
+def build_event(session_id, turn):
+    return {
+        "queryStringParameters": {"session_id": session_id, "user_info": "loadtest"},
+        "body": json.dumps({
+            "message_content": turn["message"],
+            "user_role": turn["role"],
+        }),
+    }
+
+
+def timed(recorder, stage, function):
+    """
+    Wrap a function so each call's duration is recorded under `stage`.
+    """
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            recorder(stage, time.perf_counter() - start)
+    return wrapper
+
+
+def run_worker(worker_args):
+    """
+    Import the handler inside a fresh moto environment and replay sessions.
+
+    Returns:
+        dict: "samples" as (stage, seconds) pairs, "requests" and "errors".
+    """
+    options, sessions = worker_args
+    sys.path.insert(0, SRC_DIR)
+    sys.path.insert(0, HARNESS_DIR)
+
+    import environment
+    from moto import mock_aws
+
+    environment.set_lambda_environment(options["pg"])
+    mock = mock_aws()
+    mock.start()
+    environment.provision_aws(options["pg"])
+
+    from fakes import FakeEmbeddings, FakeStreamingChatModel
+
+    samples = []
+
+    def recorder(stage, seconds):
+        samples.append((stage, seconds))
+
+    import main
+    from helpers.retrieval_cache import CachedVectorStoreRetriever
+
+    def get_fake_llm(llm_id, **kwargs):
+        if llm_id == environment.REWRITE_LLM_ID:
+            return FakeStreamingChatModel(
+                label="llm_rewrite",
+                first_token_seconds=options["rewrite_first_token_seconds"],
+                seconds_per_token=options["seconds_per_token"] / 2,
+                jitter=options["jitter"],
+                recorder=recorder,
+            )
+        return FakeStreamingChatModel(
+            label="llm_answer",
+            first_token_seconds=options["first_token_seconds"],
+            seconds_per_token=options["seconds_per_token"],
+            output_tokens=options["output_tokens"],
+            jitter=options["jitter"],
+            recorder=recorder,
+        )
+
+    main.get_bedrock_llm = get_fake_llm
+    # main imports BedrockEmbeddings from langchain_aws when it first needs them
+    import langchain_aws
+    langchain_aws.BedrockEmbeddings = lambda **kwargs: FakeEmbeddings(
+        latency_seconds=options["embedding_seconds"],
+        jitter=options["jitter"],
+        recorder=recorder,
+    )
+    for stage, name in [
+        ("prompt_fetch", "get_prompt_for_role"),
+        ("corpus_check", "check_embeddings"),
+        ("answer_cache", "get_answer_cache_scope"),
+        ("runtime_build", "get_rag_runtime"),
+        ("response", "get_response"),
+        ("engagement_flush", "flush_user_engagement"),
+    ]:
+        setattr(main, name, timed(recorder, stage, getattr(main, name)))
+    CachedVectorStoreRetriever._get_relevant_documents = timed(
+        recorder, "retrieval", CachedVectorStoreRetriever._get_relevant_documents
+    )
+
+    requests, errors = 0, 0
+    for session in sessions:
+        for turn in session["turns"]:
+            event = build_event(session["session_id"], turn)
+            start = time.perf_counter()
+            try:
+                response = main.handler(event, FakeLambdaContext(options["timeout_seconds"]))
+                if response.get("statusCode") != 200:
+                    errors += 1
+            except Exception as e:
+                print(f"Request failed: {e}", file=sys.stderr)
+                errors += 1
+            recorder("total", time.perf_counter() - start)
+            requests += 1
+            if options["think_seconds"]:
+                time.sleep(options["think_seconds"])
+
+    mock.stop()
+    return {"samples": samples, "requests": requests, "errors": errors}
+
+
+def percentile(ordered, fraction):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(samples):
+    by_stage = defaultdict(list)
+    for stage, seconds in samples:
+        by_stage[stage].append(seconds * 1000)
+    stages = sorted(by_stage, key=lambda stage: (
+        STAGES_IN_REPORT_ORDER.index(stage) if stage in STAGES_IN_REPORT_ORDER else len(STAGES_IN_REPORT_ORDER),
+        stage,
+    ))
+    summary = {}
+    for stage in stages:
+        ordered = sorted(by_stage[stage])
+        summary[stage] = {
+            "count": len(ordered),
+            "p50_ms": round(percentile(ordered, 0.50), 1),
+            "p90_ms": round(percentile(ordered, 0.90), 1),
+            "p99_ms": round(percentile(ordered, 0.99), 1),
+            "max_ms": round(ordered[-1], 1),
+        }
+    return summary
+
+
+def print_report(report):
+    print(
+        f"\n{report['requests']} requests ({report['errors']} errors) from "
+        f"{report['sessions']} sessions at concurrency {report['concurrency']} "
+        f"in {report['wall_seconds']:.1f}s: {report['throughput_rps']:.2f} req/s\n"
+    )
+    print(f"{'stage':<18}{'count':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage, stats in report["stages"].items():
+        print(
+            f"{stage:<18}{stats['count']:>8}{stats['p50_ms']:>10.1f}"
+            f"{stats['p90_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}"
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    trace = parser.add_mutually_exclusive_group()
+    trace.add_argument("--trace", help="JSONL trace of {session, turn, role, message} records")
+    trace.add_argument("--synthetic-sessions", type=int, default=20, help="Sessions to generate when no trace is given")
+    parser.add_argument("--turns", type=int, default=4, help="Turns per synthetic session, including the greeting")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--concurrency", type=int, default=4, help="Worker processes, one per simulated container")
+    parser.add_argument("--think-seconds", type=float, default=0.0, help="Pause between a session's turns")
+    parser.add_argument("--first-token-seconds", type=float, default=0.6)
+    parser.add_argument("--rewrite-first-token-seconds", type=float, default=0.25)
+    parser.add_argument("--seconds-per-token", type=float, default=0.02)
+    parser.add_argument("--output-tokens", type=int, default=250)
+    parser.add_argument("--embedding-seconds", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.3, help="Latency variation as a fraction")
+    parser.add_argument("--timeout-seconds", type=float, default=300, help="Simulated Lambda timeout")
+    parser.add_argument("--documents", type=int, default=40, help="Chunks loaded into the synthetic corpus")
+    parser.add_argument("--pg-host", default=os.environ.get("LOADTEST_PG_HOST", "localhost"))
+    parser.add_argument("--pg-port", default=os.environ.get("LOADTEST_PG_PORT", "5432"))
+    parser.add_argument("--pg-dbname", default=os.environ.get("LOADTEST_PG_DBNAME", "postgres"))
+    parser.add_argument("--pg-user", default=os.environ.get("LOADTEST_PG_USER", "postgres"))
+    parser.add_argument("--pg-password", default=os.environ.get("LOADTEST_PG_PASSWORD", "postgres"))
+    parser.add_argument("--output", help="Also write the report as JSON to this path")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    pg = {
+        "host": args.pg_host, "port": args.pg_port, "dbname": args.pg_dbname,
+        "user": args.pg_user, "password": args.pg_password,
+    }
+    sessions = load_trace(args.trace) if args.trace else generate_trace(args.synthetic_sessions, args.turns, args.seed)
+
+    sys.path.insert(0, HARNESS_DIR)
+    import environment
+    from fakes import FakeEmbeddings
+
+    environment.prepare_database(pg, [session["session_id"] for session in sessions], FakeEmbeddings(latency_seconds=0), args.documents)
+
+    options = {
+        "pg": pg,
+        "think_seconds": args.think_seconds,
+        "first_token_seconds": args.first_token_seconds,
+        "rewrite_first_token_seconds": args.rewrite_first_token_seconds,
+        "seconds_per_token": args.seconds_per_token,
+        "output_tokens": args.output_tokens,
+        "embedding_seconds": args.embedding_seconds,
+        "jitter": args.jitter,
+        "timeout_seconds": args.timeout_seconds,
+    }
+    concurrency = max(1, min(args.concurrency, len(sessions)))
+    shares = [(options, sessions[index::concurrency]) for index in range(concurrency)]
+
+    # Spawned workers import the handler from scratch, like separate containers
+    start = time.perf_counter()
+    with multiprocessing.get_context("spawn").Pool(concurrency) as pool:
+        results = pool.map(run_worker, shares)
+    wall_seconds = time.perf_counter() - start
+
+    requests = sum(result["requests"] for result in results)
+    report = {
+        "sessions": len(sessions),
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": sum(result["errors"] for result in results),
+        "wall_seconds": wall_seconds,
+        "throughput_rps": requests / wall_seconds if wall_seconds else 0.0,
+        "stages": summarize([sample for result in results for sample in result["samples"]]),
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
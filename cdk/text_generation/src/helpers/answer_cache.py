@@ -0,0 +1,159 @@
+import math
+import re
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Setup logging at the INFO level for this module
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+TRAILING_PUNCTUATION_PATTERN = re.compile(r"[\s?!.]+$")
+
+
+def normalize_question(question: str) -> str:
+    """
+    Normalize a question so that trivial differences in case, spacing and
+    trailing punctuation map to the same cache key.
+
+    Args:
+        question (str): The raw question text.
+
+    Returns:
+        str: The normalized question.
+    """
+    question = WHITESPACE_PATTERN.sub(" ", question.strip().lower())
+    return TRAILING_PUNCTUATION_PATTERN.sub("", question)
+
+
+def normalize_vector(vector: List[float]) -> List[float]:
+    """
+    Scale a vector to unit length so that cosine similarity is a dot product.
+    """
+    norm = math.sqrt(sum(value * value for value in vector))
+    if norm == 0:
+        return list(vector)
+    return [value / norm for value in vector]
+
+
+class AnswerCache:
+    """
+    Per-container cache of answers to first-turn questions.
+
+    Entries are grouped by scope, a (role, prompt version) pair, and each scope
+    remembers the corpus generation its answers were produced against. A lookup
+    with a different generation empties the scope, so answers never outlive the
+    documents or the role prompt they were generated from.
+
+    A lookup first tries an exact match on the normalized question and only
+    embeds the question if the scope holds answers that could match by similarity.
+    """
+
+    def __init__(self, similarity_threshold: float = 0.95, max_entries: int = 50):
+        """
+        Args:
+            similarity_threshold (float, optional): Minimum cosine similarity for a
+                cached answer to be served for a different wording (default is 0.95).
+            max_entries (int, optional): Answers kept per scope; the oldest answer
+                is evicted first (default is 50).
+        """
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.scopes: Dict[Tuple[str, str], dict] = {}
+
+    def get_scope(self, role: str, prompt_version: str, generation: int) -> dict:
+        """
+        Return the entries for a role and prompt version, emptying them if they
+        were produced against a different corpus generation.
+        """
+        key = (role, prompt_version)
+        scope = self.scopes.get(key)
+        if scope is None or scope["generation"] != generation:
+            if scope is not None:
+                logger.info("Corpus changed, dropping %d cached answers for role '%s'.", len(scope["entries"]), role)
+            scope = {"generation": generation, "entries": {}}
+            self.scopes[key] = scope
+        return scope
+
+    def lookup(
+        self,
+        role: str,
+        prompt_version: str,
+        generation: int,
+        question: str,
+        embed_query: Callable[[str], List[float]]
+    ) -> Tuple[Optional[dict], Optional[List[float]]]:
+        """
+        Find a cached answer for a question.
+
+        Args:
+            role (str): The user role.
+            prompt_version (str): Fingerprint of the role prompt.
+            generation (int): The current corpus generation.
+            question (str): The raw question text.
+            embed_query (Callable[[str], List[float]]): Embeds a question.
+
+        Returns:
+            Tuple[Optional[dict], Optional[List[float]]]: The cached response, or None
+            on a miss, and the normalized question embedding if one was computed
+            (so that `store` does not embed the question again).
+        """
+        scope = self.get_scope(role, prompt_version, generation)
+        normalized = normalize_question(question)
+
+        entry = scope["entries"].get(normalized)
+        if entry is not None:
+            logger.info("Answer cache hit (exact match).")
+            return entry["response"], entry["embedding"]
+
+        if not scope["entries"]:
+            return None, None
+
+        embedding = normalize_vector(embed_query(normalized))
+        best_entry, best_score = None, -1.0
+        for candidate in scope["entries"].values():
+            score = sum(a * b for a, b in zip(embedding, candidate["embedding"]))
+            if score > best_score:
+                best_entry, best_score = candidate, score
+
+        if best_score >= self.similarity_threshold:
+            logger.info("Answer cache hit (similarity %.4f).", best_score)
+            return best_entry["response"], embedding
+
+        logger.info("Answer cache miss (best similarity %.4f).", best_score)
+        return None, embedding
+
+    def store(
+        self,
+        role: str,
+        prompt_version: str,
+        generation: int,
+        question: str,
+        response: dict,
+        embed_query: Callable[[str], List[float]],
+        embedding: Optional[List[float]] = None
+    ) -> None:
+        """
+        Cache the response to a first-turn question.
+
+        Args:
+            role (str): The user role.
+            prompt_version (str): Fingerprint of the role prompt.
+            generation (int): The corpus generation the response was produced against.
+            question (str): The raw question text.
+            response (dict): The response to cache.
+            embed_query (Callable[[str], List[float]]): Embeds a question, used only
+                if `embedding` is not passed.
+            embedding (List[float], optional): The normalized question embedding
+                returned by `lookup`.
+        """
+        scope = self.get_scope(role, prompt_version, generation)
+        normalized = normalize_question(question)
+        if embedding is None:
+            embedding = normalize_vector(embed_query(normalized))
+
+        entries = scope["entries"]
+        entries.pop(normalized, None)
+        entries[normalized] = {"embedding": embedding, "response": response}
+        while len(entries) > self.max_entries:
+            entries.pop(next(iter(entries)))
@@ -1,78 +1,121 @@
 import logging
-import boto3
 import re
 import json
+import time
+import random
 from datetime import datetime
-from langchain_aws import ChatBedrockConverse
 from langchain_core.prompts import PromptTemplate, ChatPromptTemplate, MessagesPlaceholder
-from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_core.output_parsers import StrOutputParser
-from langchain.chains import create_retrieval_chain
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnablePassthrough, RunnableLambda
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_community.chat_message_histories import DynamoDBChatMessageHistory
-from langchain_core.pydantic_v1 import BaseModel, Field
-from typing import Dict, Any, Optional, Tuple
+from langchain_core.messages import HumanMessage, AIMessage
+
+from helpers.history import BoundedChatMessageHistory
+from helpers.message_history import DynamoDBMessageHistory
+from helpers.retrieval_cache import TTLCache
+from helpers.hedging import HedgedRunnable
+from helpers.context import compress_context
+from helpers.tracing import TRACE_STAGE_METADATA_KEY, get_trace_callbacks, span
+from typing import TYPE_CHECKING, Dict, Any, Optional, Tuple, Callable
+
+if TYPE_CHECKING:
+    # langchain_aws and langchain are imported on first use, 
+    # so requests that never reach the model (greeting, comparison) do not load them
+    from langchain_aws import ChatBedrockConverse
 
 # Setup logging at the INFO level for this module
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def create_dynamodb_history_table(table_name: str) -> None:
+def has_chat_history(table_name: str, session_id: str, legacy_table_name: Optional[str] = None) -> bool:
     """
-    Create a DynamoDB table to store session history if it does not already exist.
-    
-    The table is keyed by 'SessionId' and uses on-demand billing (PAY_PER_REQUEST).
-    If the table already exists, no action is taken.
+    Check whether a session already has messages in the history table.
+
+    At most one message item is read, so the stored history is not loaded.
+
+    Args:
+        table_name (str): The name of the per-message history table.
+        session_id (str): A unique identifier for the conversation session.
+        legacy_table_name (str, optional): The single-item history table checked 
+            for sessions with no per-message items.
+
+    Returns:
+        bool: True if the session has stored messages.
+    """
+    return DynamoDBMessageHistory(table_name, session_id, legacy_table_name).has_messages()
+
+
+def get_chat_history(
+    table_name: str,
+    session_id: str,
+    limit: int,
+    legacy_table_name: Optional[str] = None,
+    cache: Optional[TTLCache] = None
+) -> Tuple[list, int]:
+    """
+    Read the last `limit` stored messages of a session with one limited query.
+
+    Used to load the history ahead of the chain, concurrently with the other 
+    I/O of the request (see `set_prefetched_messages`).
+
+    Args:
+        table_name (str): The name of the per-message history table.
+        session_id (str): A unique identifier for the conversation session.
+        limit (int): The number of most recent messages to read.
+        legacy_table_name (str, optional): The single-item history table read 
+            for sessions with no per-message items.
+        cache (TTLCache, optional): The container's session history cache; a 
+            cached session is served after a key-only freshness check.
+
+    Returns:
+        tuple: The messages, oldest first, and the number of stored messages 
+        before them; ([], 0) for a new session.
+    """
+    return DynamoDBMessageHistory(
+        table_name, session_id, legacy_table_name, cache=cache
+    ).get_recent_messages(limit)
+
+
+def append_chat_history(
+    table_name: str,
+    session_id: str,
+    query: str,
+    answer: str,
+    legacy_table_name: Optional[str] = None,
+    compress_min_bytes: Optional[int] = None,
+    cache: Optional[TTLCache] = None
+) -> None:
+    """
+    Append a question and its answer to a session's history, as the 
+    conversational RAG chain would after generating the answer.
 
     Args:
-        table_name (str): The name of the DynamoDB table to create.
+        table_name (str): The name of the per-message history table.
+        session_id (str): A unique identifier for the conversation session.
+        query (str): The formatted user query.
+        answer (str): The complete answer text.
+        legacy_table_name (str, optional): The single-item history table a 
+            session may have to be copied from first.
+        compress_min_bytes (int, optional): Size from which messages are 
+            written compressed; None writes them uncompressed.
+        cache (TTLCache, optional): The container's session history cache, 
+            which the messages are written through to.
 
     Returns:
         None
     """
-    logger.info("Attempting to create/find DynamoDB table '%s' for history storage.", table_name)
-    
-    dynamodb_resource = boto3.resource("dynamodb")
-    dynamodb_client = boto3.client("dynamodb")
-    
-    existing_tables = []
-    exclusive_start_table_name = None
-    
-    # Paginate through all existing tables
-    while True:
-        if exclusive_start_table_name:
-            response = dynamodb_client.list_tables(ExclusiveStartTableName=exclusive_start_table_name)
-        else:
-            response = dynamodb_client.list_tables()
-        
-        existing_tables.extend(response.get('TableNames', []))
-        
-        if 'LastEvaluatedTableName' in response:
-            exclusive_start_table_name = response['LastEvaluatedTableName']
-        else:
-            break
-    
-    if table_name not in existing_tables:
-        logger.info("DynamoDB table '%s' does not exist. Creating now.", table_name)
-        table = dynamodb_resource.create_table(
-            TableName=table_name,
-            KeySchema=[{"AttributeName": "SessionId", "KeyType": "HASH"}],
-            AttributeDefinitions=[{"AttributeName": "SessionId", "AttributeType": "S"}],
-            BillingMode="PAY_PER_REQUEST",
-        )
-        
-        table.meta.client.get_waiter("table_exists").wait(TableName=table_name)
-        logger.info("DynamoDB table '%s' created successfully.", table_name)
-    else:
-        logger.info("DynamoDB table '%s' already exists. No action taken.", table_name)
+    logger.info("Appending cached answer to history for session_id '%s'.", session_id)
+    DynamoDBMessageHistory(table_name, session_id, legacy_table_name, compress_min_bytes, cache).add_messages(
+        [HumanMessage(content=query), AIMessage(content=answer)]
+    )
+
 
 def get_bedrock_llm(
     bedrock_llm_id: str,
     temperature: Optional[float] = 0,
     max_tokens: Optional[int] = None,
     top_p : Optional[float] = None
-) -> ChatBedrockConverse:
+) -> "ChatBedrockConverse":
     """
     Retrieve a Bedrock LLM instance configured with the given model ID and temperature.
 
@@ -94,6 +137,8 @@ def get_bedrock_llm(
         top_p
     )
     
+    from langchain_aws import ChatBedrockConverse
+
     return ChatBedrockConverse(
         model=bedrock_llm_id,
         temperature=temperature,
@@ -147,36 +192,71 @@ def get_initial_user_query() -> str:
     return json.dumps(query_structure, indent=4)
 
 
-def get_response(
-    query: str,
-    llm: ChatBedrockConverse,
+def compress_context_traced(query: str, docs: list, max_tokens: int) -> list:
+    """
+    Compress retrieved chunks with `compress_context`, timed as a trace stage.
+    """
+    with span("context_compress"):
+        return compress_context(query, docs, max_tokens=max_tokens)[0]
+
+
+def build_conversational_rag_chain(
+    llm: "ChatBedrockConverse",
     history_aware_retriever,
     table_name: str,
-    session_id: str,
-    user_prompt: str
-) -> dict:
+    summary_llm: Optional["ChatBedrockConverse"] = None,
+    history_window_turns: int = 4,
+    history_max_tokens: int = 1500,
+    history_read_limit: int = 40,
+    legacy_table_name: Optional[str] = None,
+    history_compress_min_bytes: Optional[int] = None,
+    history_cache: Optional[TTLCache] = None,
+    hedge_after_seconds: Optional[float] = None,
+    context_max_tokens: int = 1500
+) -> RunnableWithMessageHistory:
     """
-    Generate a response to a user query using an LLM and a history-aware retriever.test
+    Build the conversational RAG chain used to answer user queries.
 
     This function:
       1. Builds a system prompt that references the Digital Learning Strategy.
       2. Creates a RAG (Retrieval-Augmented Generation) chain to handle query 
          and context retrieval.
-      3. Uses a DynamoDB-backed message history for conversational context.
+      3. Uses a per-message DynamoDB history for conversational context. 
+         Only the last `history_window_turns` turns within `history_max_tokens` 
+         are sent to the model, preceded by a rolling summary of older turns 
+         when a `summary_llm` is given (see `BoundedChatMessageHistory`).
+
+    The chain does not depend on the session, which is only bound when the chain 
+    is invoked, so a single instance can be reused across requests.
 
     Args:
-        query (str): The user's query.
         llm (ChatBedrockConverse): The language model instance.
         history_aware_retriever: The retriever that supplies relevant context documents.
-        table_name (str): The name of the DynamoDB table for message history.
-        session_id (str): A unique identifier for the conversation session.
-        user_prompt (str): Additional instructions or context for the system prompt.
+        table_name (str): The name of the per-message history table.
+        summary_llm (ChatBedrockConverse, optional): The language model used to 
+            summarize turns that leave the history window.
+        history_window_turns (int, optional): Most recent turns sent verbatim.
+        history_max_tokens (int, optional): Token budget for the verbatim turns.
+        history_read_limit (int, optional): Most recent messages read per turn.
+        legacy_table_name (str, optional): The single-item history table read 
+            for sessions with no per-message items.
+        history_compress_min_bytes (int, optional): Size from which messages 
+            are written compressed; None writes them uncompressed.
+        history_cache (TTLCache, optional): The container's session history 
+            cache, read after a freshness check and written through.
+        hedge_after_seconds (float, optional): If set, non-streamed answers are 
+            hedged: a second request is started once the first has run for the 
+            p95 latency (this value until enough latencies are known) and the 
+            first answer to finish is used (see `HedgedRunnable`).
+        context_max_tokens (int, optional): Token budget for the retrieved 
+            context, which is deduplicated and trimmed by `compress_context`.
 
     Returns:
-        dict: A dictionary containing:
-            - "llm_output" (str): The generated response text.
-            - "options" (list[str]): A list of follow-up questions or prompts.
+        RunnableWithMessageHistory: The conversational RAG chain.
     """
+    from langchain.chains import create_retrieval_chain
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+
     logger.info("Building a system prompt for the user query and creating a RAG chain.")
     system_prompt = (
         ""
@@ -206,34 +286,139 @@ def get_response(
         ]
     )
 
-    question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
-    rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
+    # Tagged so that request tracing times the answer generation on its own
+    answer_llm = llm.with_config(metadata={TRACE_STAGE_METADATA_KEY: "generation"})
+    # Hedge at the model, below the history wrapper, so history is written once
+    if hedge_after_seconds is not None:
+        answer_llm = HedgedRunnable(answer_llm, hedge_after_seconds)
+    question_answer_chain = create_stuff_documents_chain(answer_llm, qa_prompt)
+    # Retrieve, then deduplicate and trim the chunks to the context budget
+    context_retriever = RunnablePassthrough.assign(docs=history_aware_retriever) | RunnableLambda(
+        lambda x: compress_context_traced(x["input"], x["docs"], context_max_tokens)
+    )
+    rag_chain = create_retrieval_chain(context_retriever, question_answer_chain)
     
     logger.info("Wrapping the chain in a RunnableWithMessageHistory for DynamoDB-based history.")
-    conversational_rag_chain = RunnableWithMessageHistory(
+    return RunnableWithMessageHistory(
         rag_chain,
-        lambda session_id: DynamoDBChatMessageHistory(
-            table_name=table_name, 
-            session_id=session_id
+        lambda session_id: BoundedChatMessageHistory(
+            DynamoDBMessageHistory(
+                table_name, session_id, legacy_table_name, history_compress_min_bytes, history_cache
+            ),
+            session_id=session_id,
+            summary_llm=summary_llm,
+            window_turns=history_window_turns,
+            max_tokens=history_max_tokens,
+            read_limit=history_read_limit
         ),
         input_messages_key="input",
         history_messages_key="chat_history",
         output_messages_key="answer",
     )
 
-    logger.info("Generating the LLM response until a non-empty result is obtained.")
-    response = ""
-    while not response:
-        response = generate_response(
-            conversational_rag_chain,
-            query,
-            session_id
+
+def get_response(
+    query: str,
+    llm: "ChatBedrockConverse",
+    history_aware_retriever,
+    table_name: str,
+    session_id: str,
+    user_prompt: str,
+    conversational_rag_chain: Optional[RunnableWithMessageHistory] = None,
+    on_chunk: Optional[Callable[[str], None]] = None,
+    max_attempts: int = 3,
+    backoff_seconds: float = 0.5,
+    deadline: Optional[float] = None
+) -> dict:
+    """
+    Generate a response to a user query using an LLM and a history-aware retriever.
+
+    If a prebuilt `conversational_rag_chain` is passed (see 
+    `build_conversational_rag_chain`), it is used as is and only the session and 
+    query are bound; otherwise a new chain is built from the other arguments.
+
+    If `on_chunk` is passed, the answer is streamed and partial text is handed to 
+    it as it arrives (see `stream_response`). The follow-up options are still 
+    parsed from the complete answer.
+
+    An empty or failed answer is retried up to `max_attempts` attempts in total, 
+    with jittered exponential backoff, but never past `deadline`. A streamed 
+    attempt that fails is retried without streaming.
+
+    Args:
+        query (str): The user's query.
+        llm (ChatBedrockConverse): The language model instance.
+        history_aware_retriever: The retriever that supplies relevant context documents.
+        table_name (str): The name of the per-message history table.
+        session_id (str): A unique identifier for the conversation session.
+        user_prompt (str): Additional instructions or context for the system prompt.
+        conversational_rag_chain (RunnableWithMessageHistory, optional): A chain 
+            reused from a previous request.
+        on_chunk (Callable[[str], None], optional): Receives partial answer text 
+            while the answer is streamed.
+        max_attempts (int, optional): Attempts before giving up (default is 3).
+        backoff_seconds (float, optional): Base delay between attempts; attempt n 
+            waits a random time up to backoff_seconds * 2**(n-1) (default is 0.5).
+        deadline (float, optional): time.monotonic() value after which no new 
+            attempt is started.
+
+    Returns:
+        dict: A dictionary containing:
+            - "llm_output" (str): The generated response text.
+            - "options" (list[str]): A list of follow-up questions or prompts.
+            - "answer" (str): The complete, unparsed answer text.
+
+    Raises:
+        RuntimeError: If no attempt produced an answer.
+    """
+    if conversational_rag_chain is None:
+        conversational_rag_chain = build_conversational_rag_chain(
+            llm=llm,
+            history_aware_retriever=history_aware_retriever,
+            table_name=table_name
         )
 
+    response = ""
+    last_error = None
+    for attempt in range(1, max_attempts + 1):
+        try:
+            if on_chunk is not None and attempt == 1:
+                response = stream_response(
+                    conversational_rag_chain,
+                    query,
+                    session_id,
+                    on_chunk
+                )
+            else:
+                response = generate_response(
+                    conversational_rag_chain,
+                    query,
+                    session_id
+                )
+        except Exception as e:
+            last_error = e
+            logger.error("LLM attempt %d of %d failed: %s", attempt, max_attempts, e)
+
+        if response:
+            break
+        if attempt == max_attempts:
+            break
+
+        delay = random.uniform(0, backoff_seconds * 2 ** (attempt - 1))
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            logger.warning("No time left before the deadline for another LLM attempt.")
+            break
+        logger.info("Empty or failed LLM response, retrying in %.2fs.", delay)
+        time.sleep(delay)
+
+    if not response:
+        raise RuntimeError(f"LLM produced no response after {attempt} attempt(s): {last_error}")
+
     response_data = get_llm_output(response)
     return {
         "llm_output": response_data.get("llm_output"),
-        "options": response_data.get("options")
+        "options": response_data.get("options"),
+        "answer": response
     }
 
 
@@ -255,10 +440,65 @@ def generate_response(conversational_rag_chain: object, query: str, session_id:
         {
             "input": query
         },
-        config={"configurable": {"session_id": session_id}},
+        config={"configurable": {"session_id": session_id}, "callbacks": get_trace_callbacks()},
     )["answer"]
 
 
+def stream_response(
+    conversational_rag_chain: object,
+    query: str,
+    session_id: str,
+    on_chunk: Callable[[str], None],
+    min_chunk_chars: int = 40,
+    max_chunk_delay: float = 0.25
+) -> str:
+    """
+    Stream a RAG chain's answer for a given query, passing partial text to a callback.
+
+    Tokens from the model are coalesced so that `on_chunk` is called at most once 
+    per `min_chunk_chars` characters, unless `max_chunk_delay` seconds have passed 
+    since the last call. The chat history is persisted by the chain once the 
+    stream completes, exactly as with `generate_response`.
+
+    Args:
+        conversational_rag_chain (object): The RAG chain that retrieves 
+            context documents and integrates them into responses.
+        query (str): The input query for which a response is needed.
+        session_id (str): A unique identifier for the conversation session.
+        on_chunk (Callable[[str], None]): Receives each coalesced piece of the answer.
+        min_chunk_chars (int, optional): Characters to buffer before calling `on_chunk`.
+        max_chunk_delay (float, optional): Longest time, in seconds, text is buffered.
+
+    Returns:
+        str: The complete answer text.
+    """
+    logger.info("Streaming the conversational RAG chain with session_id '%s'.", session_id)
+    answer_parts = []
+    buffer = ""
+    last_flush = time.monotonic()
+
+    for chunk in conversational_rag_chain.stream(
+        {
+            "input": query
+        },
+        config={"configurable": {"session_id": session_id}, "callbacks": get_trace_callbacks()},
+    ):
+        token = chunk.get("answer")
+        if not token:
+            continue
+        answer_parts.append(token)
+        buffer += token
+        if len(buffer) >= min_chunk_chars or time.monotonic() - last_flush >= max_chunk_delay:
+            on_chunk(buffer)
+            buffer = ""
+            last_flush = time.monotonic()
+
+    if buffer:
+        on_chunk(buffer)
+
+    return "".join(answer_parts)
+
+
 def get_llm_output(response: str) -> dict:
     """
     Split the LLM response text into main content and follow-up questions.
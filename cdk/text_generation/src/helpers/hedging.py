@@ -0,0 +1,127 @@
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from functools import partial
+from typing import Any, Iterator, Optional
+
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.config import ContextThreadPoolExecutor
+
+# Setup logging at the INFO level for this module
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Threads running primary and hedge requests; a hedge that loses keeps running
+# until Bedrock answers, so the pool is sized for a few overlapping requests
+hedge_executor = ContextThreadPoolExecutor(max_workers=4)
+
+
+class LatencyTracker:
+    """
+    Rolling window of request latencies used to estimate a high percentile.
+    """
+
+    def __init__(self, window: int = 100, min_samples: int = 20):
+        """
+        Args:
+            window (int, optional): Most recent latencies kept (default is 100).
+            min_samples (int, optional): Latencies needed before the observed
+                percentile replaces the configured fallback (default is 20).
+        """
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, fraction: float, fallback: float) -> float:
+        """
+        Return the given percentile of the recorded latencies, or `fallback`
+        while fewer than `min_samples` latencies have been recorded.
+        """
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return fallback
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class HedgedRunnable(Runnable):
+    """
+    Wrapper that hedges slow invocations of a runnable, normally a chat model.
+
+    `invoke` starts the request and, if it has not finished by the p95 of recent
+    latencies (`hedge_after_seconds` until enough latencies are known), starts an
+    identical second request and returns whichever finishes first. Only primary
+    requests are timed, including those a hedge beat. Streaming is passed straight
+    through without hedging, since tokens are already flowing to the user.
+    """
+
+    def __init__(
+        self,
+        runnable: Runnable,
+        hedge_after_seconds: float,
+        tracker: Optional[LatencyTracker] = None
+    ):
+        """
+        Args:
+            runnable (Runnable): The runnable to hedge.
+            hedge_after_seconds (float): Hedge delay used until the p95 latency
+                can be estimated.
+            tracker (LatencyTracker, optional): Latency window shared by the
+                wrapped runnable's invocations.
+        """
+        self.runnable = runnable
+        self.hedge_after_seconds = hedge_after_seconds
+        self.tracker = tracker or LatencyTracker()
+
+    @property
+    def InputType(self) -> Any:
+        return self.runnable.InputType
+
+    @property
+    def OutputType(self) -> Any:
+        return self.runnable.OutputType
+
+    def record_primary_latency(self, start: float, future: Future) -> None:
+        """
+        Record the primary request's latency once it finishes successfully.
+
+        This runs even when a hedge has already answered: the slow primary is the
+        tail the p95 has to reflect. Hedge latencies are never recorded, since
+        they start late and would pull the p95 below the true one.
+        """
+        if not future.cancelled() and future.exception() is None:
+            self.tracker.record(time.monotonic() - start)
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        hedge_after = self.tracker.percentile(0.95, self.hedge_after_seconds)
+        start = time.monotonic()
+        primary = hedge_executor.submit(self.runnable.invoke, input, config, **kwargs)
+        primary.add_done_callback(partial(self.record_primary_latency, start))
+        done, _ = wait([primary], timeout=hedge_after)
+        if done:
+            return primary.result()
+
+        logger.info(f"LLM request still running after {hedge_after:.2f}s, starting a hedged request.")
+        hedge = hedge_executor.submit(self.runnable.invoke, input, config, **kwargs)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    output = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                logger.info(f"{'Hedged' if future is hedge else 'Primary'} LLM request finished first.")
+                return output
+        raise error
+
+    def stream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[Any]:
+        yield from self.runnable.stream(input, config, **kwargs)
@@ -1,29 +1,35 @@
 import logging
-from typing import Optional, Tuple
+from typing import TYPE_CHECKING, Optional, Tuple
 
-import psycopg2
-from langchain_aws import BedrockEmbeddings
-from langchain_postgres import PGVector
+if TYPE_CHECKING:
+    # Imported on first use instead; langchain_postgres loads SQLAlchemy and psycopg
+    from langchain_aws import BedrockEmbeddings
+    from langchain_postgres import PGVector
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# PGVector instances (and their SQLAlchemy engines) cached per container,
+# keyed by collection name and connection string
+vectorstores = {}
+
 def get_vectorstore(
     collection_name: str, 
-    embeddings: BedrockEmbeddings, 
+    embeddings: "BedrockEmbeddings", 
     dbname: str, 
     user: str, 
     password: str, 
     host: str, 
     port: int
-) -> Optional[Tuple[PGVector, str]]:
+) -> Optional[Tuple["PGVector", str]]:
     """
     Initialize and return a PGVector vector store along with its connection string.
 
     This function constructs a PostgreSQL connection string using the provided database
     parameters, initializes a PGVector instance for managing vector embeddings, and returns
-    both the vectorstore instance and the connection string.
+    both the vectorstore instance and the connection string. The instance is cached for
+    the lifetime of the container, so warm requests reuse its connection pool.
 
     Args:
         collection_name (str): The name of the vector collection.
@@ -44,8 +50,13 @@ def get_vectorstore(
             f"postgresql+psycopg://{user}:{password}@{host}:{port}/{dbname}"
         )
         
+        cache_key = (collection_name, connection_string)
+        if cache_key in vectorstores:
+            return vectorstores[cache_key], connection_string
         
         logger.info("Initializing the VectorStore")
+        from langchain_postgres import PGVector
+
         vectorstore = PGVector(
             embeddings=embeddings,
             collection_name=collection_name,
@@ -53,6 +64,7 @@ def get_vectorstore(
             use_jsonb=True
         )
         
+        vectorstores[cache_key] = vectorstore
         logger.info("VectorStore initialized")
         return vectorstore, connection_string
 
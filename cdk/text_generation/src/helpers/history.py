@@ -0,0 +1,294 @@
+import re
+import logging
+from concurrent.futures import Executor, Future, wait
+from contextvars import ContextVar
+from typing import List, Optional, Sequence, Tuple
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, AIMessage, HumanMessage, SystemMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+from helpers.rerank import estimate_tokens
+from helpers.tracing import span
+
+# Setup logging at the INFO level for this module
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Quoted source paragraphs the chat prompt asks the model to open every answer with
+DOCUMENTS_PREAMBLE_PATTERN = re.compile(r"-{3,}\s*Documents used to respond:.*?-{3,}", re.DOTALL)
+
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            "You maintain a running summary of a conversation between a user and an "
+            "assistant. Update the summary with the new messages below. Keep every "
+            "fact, question and decision that later turns may refer to, drop "
+            "pleasantries and quoted source documents, and answer with the updated "
+            "summary only, in at most 200 words."
+        ),
+        (
+            "human",
+            "Current summary:\n{summary}\n\nNew messages:\n{conversation}\n\nUpdated summary:"
+        ),
+    ]
+)
+
+# Recent stored messages read ahead of the chain for the current request, with
+# their session ID and the number of stored messages before them
+prefetched_messages: ContextVar[Optional[Tuple[str, List[BaseMessage], int]]] = ContextVar(
+    "prefetched_messages", default=None
+)
+
+
+# Summary folds started by this request, waited for before the handler returns
+pending_folds: List[Future] = []
+
+
+def set_prefetched_messages(session_id: str, recent: Optional[Tuple[List[BaseMessage], int]]) -> None:
+    """
+    Hand a session's recent messages, already read by the request, to the history
+    the chain builds for that session, so the chain does not read them again.
+
+    Args:
+        session_id (str): The session the messages belong to.
+        recent (tuple, optional): The messages, oldest first, and the number of
+            stored messages before them, as returned by `get_recent_messages`.
+            None clears any messages left from an earlier request.
+    """
+    prefetched_messages.set((session_id, *recent) if recent is not None else None)
+
+
+def strip_documents_preamble(message: BaseMessage) -> BaseMessage:
+    """
+    Remove the quoted "Documents used to respond" block from an AI message.
+
+    The documents are retrieved again on every turn, so quoting them back to the
+    model only makes the prompt longer.
+    """
+    if not isinstance(message, AIMessage):
+        return message
+    content = DOCUMENTS_PREAMBLE_PATTERN.sub("", message.content).strip()
+    return AIMessage(content=content)
+
+
+class BoundedChatMessageHistory(BaseChatMessageHistory):
+    """
+    Chat history that presents the model with a fixed-size view of a session.
+
+    The full history is still stored by the wrapped per-message history
+    (DynamoDB), of which only the last `read_limit` messages are read. The view
+    holds the last `window_turns` turns that fit within `max_tokens`, with the
+    "Documents used to respond" preambles removed. If a `summary_llm` is given,
+    turns that fall out of the window are folded into a rolling summary. The
+    summary is kept in a separate history item, updated incrementally with only
+    the newly dropped turns, and put in front of the window. The summary model
+    is never called while answering: `start_summary_fold` folds the turns that
+    left the window during the previous request alongside the current one, and
+    until the fold is stored those turns are shown verbatim. The per-turn prompt
+    size and the read cost therefore stay flat however long the session runs.
+    """
+
+    def __init__(
+        self,
+        history: BaseChatMessageHistory,
+        session_id: str,
+        summary_llm=None,
+        window_turns: int = 4,
+        max_tokens: int = 1500,
+        read_limit: int = 40
+    ):
+        """
+        Args:
+            history (DynamoDBMessageHistory): The stored per-message history.
+            session_id (str): A unique identifier for the conversation session.
+            summary_llm (optional): The language model used to update the rolling
+                summary. Without one, turns outside the window are simply dropped.
+            window_turns (int, optional): Most recent turns kept verbatim (default is 4).
+            max_tokens (int, optional): Token budget for the verbatim turns (default is 1500).
+            read_limit (int, optional): Most recent stored messages read per request
+                (default is 40). Must cover the window; messages older than this
+                are only seen by the model through the summary.
+        """
+        self.history = history
+        self.session_id = session_id
+        self.summary_llm = summary_llm
+        self.window_turns = window_turns
+        self.max_tokens = max_tokens
+        self.read_limit = read_limit
+        self.loaded_messages: Optional[List[BaseMessage]] = None
+        # Number of stored messages before the first loaded one
+        self.loaded_offset = 0
+        self.loaded_summary: Optional[Tuple[str, int]] = None
+
+    def load_summary(self) -> Tuple[str, int]:
+        """
+        Return the rolling summary and the number of stored messages it covers.
+        """
+        if self.loaded_summary is None:
+            with span("history_read"):
+                self.loaded_summary = self.history.get_summary()
+        return self.loaded_summary
+
+    def save_summary(self, summary: str, summarized_messages: int) -> None:
+        """
+        Store the rolling summary and the number of stored messages it covers.
+        """
+        self.history.put_summary(summary, summarized_messages)
+        self.loaded_summary = (summary, summarized_messages)
+
+    def get_stored_messages(self) -> List[BaseMessage]:
+        """
+        Return the session's last `read_limit` stored messages, reading them at
+        most once per request, or not at all if the request has already read them
+        (see `set_prefetched_messages`). `loaded_offset` is set to the number of
+        stored messages before them.
+        """
+        if self.loaded_messages is None:
+            prefetched = prefetched_messages.get()
+            if prefetched is not None and prefetched[0] == self.session_id:
+                self.loaded_messages = list(prefetched[1])
+                self.loaded_offset = prefetched[2]
+                return self.loaded_messages
+            with span("history_read"):
+                messages, self.loaded_offset = self.history.get_recent_messages(self.read_limit)
+            self.loaded_messages = list(messages)
+        return self.loaded_messages
+
+    def get_window_start(self, messages: Sequence[BaseMessage]) -> int:
+        """
+        Return the index, within the loaded messages, of the first one shown verbatim.
+
+        Turns are added from the most recent backwards until `window_turns` turns
+        or `max_tokens` tokens are reached; the most recent turn is always kept.
+        The window always starts on a user message.
+        """
+        start = len(messages)
+        turns = 0
+        tokens = 0
+        for index in range(len(messages) - 1, -1, -1):
+            message = messages[index]
+            tokens += estimate_tokens(strip_documents_preamble(message).content)
+            if isinstance(message, HumanMessage):
+                turns += 1
+                if turns > self.window_turns or (tokens > self.max_tokens and turns > 1):
+                    break
+                start = index
+        return start
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        stored = self.get_stored_messages()
+        window_start = self.get_window_start(stored)
+        window = [strip_documents_preamble(message) for message in stored[window_start:]]
+
+        if self.summary_llm is None or self.loaded_offset + window_start == 0:
+            return window
+
+        summary, summarized_messages = self.load_summary()
+        # Turns that left the window but are not folded yet are shown verbatim,
+        # up to one more window's worth
+        unfolded_start = max(
+            summarized_messages - self.loaded_offset, self.get_window_start(stored[:window_start])
+        )
+        if unfolded_start < window_start:
+            window = [strip_documents_preamble(message) for message in stored[unfolded_start:window_start]] + window
+        if not summary:
+            return window
+        return [SystemMessage(content=f"Summary of the earlier conversation: {summary}")] + window
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        stored = self.get_stored_messages()
+        with span("history_write"):
+            self.history.add_messages(messages)
+        stored.extend(messages)
+
+    def add_message(self, message: BaseMessage) -> None:
+        self.add_messages([message])
+
+    def update_summary(self, stored: Sequence[BaseMessage]) -> None:
+        """
+        Fold the turns that have left the window into the rolling summary.
+
+        Only turns not yet covered by the summary are sent to the model, so each
+        update costs the same regardless of the session length. Positions are
+        counted over the whole stored session, of which `stored` holds the tail.
+        """
+        window_start = self.loaded_offset + self.get_window_start(stored)
+        if window_start == 0:
+            return
+        summary, summarized_messages = self.load_summary()
+        if window_start <= summarized_messages:
+            return
+
+        fold_start = summarized_messages
+        if fold_start < self.loaded_offset:
+            # The summary fell behind by more than the read limit; those turns are skipped
+            logger.warning(
+                "Messages %d-%d of session %s were not read and are left out of the summary.",
+                fold_start, self.loaded_offset - 1, self.session_id
+            )
+            fold_start = self.loaded_offset
+        conversation = "\n".join(
+            f"{'User' if isinstance(message, HumanMessage) else 'Assistant'}: "
+            f"{strip_documents_preamble(message).content.strip()}"
+            for message in stored[fold_start - self.loaded_offset:window_start - self.loaded_offset]
+        )
+        logger.info(
+            "Folding messages %d-%d of session %s into the rolling summary.",
+            fold_start, window_start - 1, self.session_id
+        )
+        summary_chain = SUMMARY_PROMPT | self.summary_llm | StrOutputParser()
+        new_summary = summary_chain.invoke(
+            {"summary": summary or "(none)", "conversation": conversation}
+        )
+        self.save_summary(new_summary.strip(), window_start)
+
+    def clear(self) -> None:
+        self.history.clear()
+        self.loaded_messages = []
+        self.loaded_offset = 0
+        self.loaded_summary = ("", 0)
+
+
+
+def start_summary_fold(history: BoundedChatMessageHistory, executor: Executor) -> None:
+    """
+    Fold the turns that have left the session's window into its rolling summary
+    on `executor`, alongside the rest of the request.
+
+    The fold covers the messages stored before this request, so the summary is
+    one turn behind while it runs; the history shows those turns verbatim until
+    then. Call `wait_for_summary_folds` before the invocation ends.
+
+    Args:
+        history (BoundedChatMessageHistory): The session's history.
+        executor (Executor): The executor the fold runs on.
+    """
+    if history.summary_llm is not None:
+        pending_folds.append(executor.submit(fold_summary, history))
+
+
+def fold_summary(history: BoundedChatMessageHistory) -> None:
+    """
+    Update a session's rolling summary, logging instead of raising on failure.
+    """
+    try:
+        with span("history_summary"):
+            history.update_summary(history.get_stored_messages())
+    except Exception as e:
+        logger.error(f"Error updating rolling summary for session {history.session_id}: {e}")
+
+
+def wait_for_summary_folds() -> None:
+    """
+    Wait for the summary folds started by this request. They run alongside
+    retrieval and generation, so usually they have finished by now.
+    """
+    if not pending_folds:
+        return
+    futures = list(pending_folds)
+    pending_folds.clear()
+    wait(futures)
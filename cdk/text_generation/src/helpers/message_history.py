@@ -0,0 +1,513 @@
+import json
+import zlib
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+
+from helpers.aws_clients import get_client
+from helpers.retrieval_cache import TTLCache
+
+# Setup logging at the INFO level for this module
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Sort key of a message item: the message's 1-based position in its session
+SEQUENCE_KEY = "Seq"
+# Suffix of the item that holds a session's rolling summary, stored under sequence 0
+SUMMARY_KEY_SUFFIX = "#summary"
+# Attempts at appending a message when another writer takes the same sequence number
+MAX_APPEND_ATTEMPTS = 3
+# Largest page DynamoDB accepts in one BatchWriteItem request
+BATCH_WRITE_SIZE = 25
+# Prefix of a compressed message payload, which is stored as a binary attribute
+# holding the marker and the zlib stream; uncompressed payloads are strings
+COMPRESSION_MARKER = b"ZLIB1:"
+# Whether the legacy single-item table exists; None until first checked
+legacy_table_available: Optional[bool] = None
+
+
+def create_message_table(table_name: str) -> None:
+    """
+    Create the per-message history table if it does not already exist.
+
+    Messages are keyed by 'SessionId' and the numeric 'Seq' sort key, so a
+    session is read newest first with a limited query and appended to without
+    rewriting earlier messages. The table uses on-demand billing.
+
+    Args:
+        table_name (str): The name of the DynamoDB table to create.
+    """
+    dynamodb_client = get_client("dynamodb")
+    try:
+        dynamodb_client.describe_table(TableName=table_name)
+        logger.info("DynamoDB table '%s' already exists. No action taken.", table_name)
+        return
+    except dynamodb_client.exceptions.ResourceNotFoundException:
+        pass
+
+    logger.info("DynamoDB table '%s' does not exist. Creating now.", table_name)
+    dynamodb_client.create_table(
+        TableName=table_name,
+        KeySchema=[
+            {"AttributeName": "SessionId", "KeyType": "HASH"},
+            {"AttributeName": SEQUENCE_KEY, "KeyType": "RANGE"},
+        ],
+        AttributeDefinitions=[
+            {"AttributeName": "SessionId", "AttributeType": "S"},
+            {"AttributeName": SEQUENCE_KEY, "AttributeType": "N"},
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    dynamodb_client.get_waiter("table_exists").wait(TableName=table_name)
+    logger.info("DynamoDB table '%s' created successfully.", table_name)
+
+
+def encode_payload(payload: str, compress_min_bytes: Optional[int]) -> Tuple[Dict, int, int]:
+    """
+    Return the DynamoDB attribute value for a message payload.
+
+    Payloads of at least `compress_min_bytes` bytes are zlib-compressed behind
+    COMPRESSION_MARKER when that makes them smaller, which answers repeating
+    their quoted source documents usually do. Other payloads are stored as
+    plain strings, as are all payloads when `compress_min_bytes` is None.
+
+    Returns:
+        tuple: The attribute value, and the payload's raw and stored size in bytes.
+    """
+    raw = payload.encode("utf-8")
+    if compress_min_bytes is not None and len(raw) >= compress_min_bytes:
+        compressed = COMPRESSION_MARKER + zlib.compress(raw)
+        if len(compressed) < len(raw):
+            return {"B": compressed}, len(raw), len(compressed)
+    return {"S": payload}, len(raw), len(raw)
+
+
+def decode_payload(value: Dict) -> str:
+    """
+    Return the message payload held by a DynamoDB attribute value, compressed or not.
+    """
+    if "S" in value:
+        return value["S"]
+    data = value["B"]
+    if not data.startswith(COMPRESSION_MARKER):
+        raise ValueError("Unknown history payload encoding")
+    return zlib.decompress(data[len(COMPRESSION_MARKER):]).decode("utf-8")
+
+
+def serialize_message(message: BaseMessage) -> str:
+    """
+    Return the stored form of a message: the JSON of LangChain's message dict.
+    """
+    return json.dumps(message_to_dict(message))
+
+
+def deserialize_message(item: Dict) -> BaseMessage:
+    """
+    Return the message held by a per-message history item.
+    """
+    return messages_from_dict([json.loads(decode_payload(item["Message"]))])[0]
+
+
+class DynamoDBMessageHistory(BaseChatMessageHistory):
+    """
+    Chat history stored as one DynamoDB item per message.
+
+    Each message is its own item (SessionId, Seq, CreatedAt, Message), so a turn
+    writes only its new messages with conditional puts, and the last N messages
+    are read with a single limited query. Write cost and item size no longer grow
+    with the session, unlike DynamoDBChatMessageHistory, which rewrites one item
+    holding the whole session on every turn and fails at the 400 KB item limit.
+
+    Sessions that only exist in the legacy single-item table are read from it,
+    and copied into the per-message table the first time they are written to.
+    Large messages are written compressed (see `encode_payload`); compressed and
+    plain items are both read transparently.
+
+    With a `cache`, the container keeps the recent messages of each session it
+    has served. A later read of the same session only checks, by reading the key
+    of the session's last item, that no other container has appended since, and
+    then serves the cached messages; appends are written to DynamoDB and then to
+    the cache.
+    """
+
+    def __init__(
+        self,
+        table_name: str,
+        session_id: str,
+        legacy_table_name: Optional[str] = None,
+        compress_min_bytes: Optional[int] = None,
+        cache: Optional[TTLCache] = None
+    ):
+        """
+        Args:
+            table_name (str): The per-message history table.
+            session_id (str): A unique identifier for the conversation session.
+            legacy_table_name (str, optional): The single-item history table read
+                for sessions that have no per-message items yet.
+            compress_min_bytes (int, optional): Size from which written messages
+                are compressed; None writes every message uncompressed.
+            cache (TTLCache, optional): The container's cache of recent session
+                histories, shared by every history instance.
+        """
+        self.table_name = table_name
+        self.session_id = session_id
+        self.legacy_table_name = legacy_table_name
+        self.compress_min_bytes = compress_min_bytes
+        self.cache = cache
+        # Highest stored sequence number, once known; 0 for an empty session
+        self.last_sequence: Optional[int] = None
+        # Messages read from the legacy table and not yet copied
+        self.legacy_messages: Optional[List[BaseMessage]] = None
+
+    def query_page(
+        self,
+        limit: Optional[int] = None,
+        newest_first: bool = False,
+        start_key: Optional[Dict] = None,
+        keys_only: bool = False
+    ) -> Tuple[List[Dict], Optional[Dict]]:
+        """
+        Query one page of the session's message items, or only their keys.
+
+        Returns:
+            tuple: The items and the key to continue from (None on the last page).
+        """
+        request = {
+            "TableName": self.table_name,
+            "KeyConditionExpression": "SessionId = :session_id",
+            "ExpressionAttributeValues": {":session_id": {"S": self.session_id}},
+            "ScanIndexForward": not newest_first,
+        }
+        if limit is not None:
+            request["Limit"] = limit
+        if start_key is not None:
+            request["ExclusiveStartKey"] = start_key
+        if keys_only:
+            request["ProjectionExpression"] = f"SessionId, {SEQUENCE_KEY}"
+        response = get_client("dynamodb").query(**request)
+        return response.get("Items", []), response.get("LastEvaluatedKey")
+
+    def iter_pages(self, page_size: int = 100) -> Iterator[List[BaseMessage]]:
+        """
+        Yield the session's messages, oldest first, one query page at a time.
+        """
+        start_key = None
+        while True:
+            items, start_key = self.query_page(limit=page_size, start_key=start_key)
+            if items:
+                self.last_sequence = max(self.last_sequence or 0, int(items[-1][SEQUENCE_KEY]["N"]))
+                yield [deserialize_message(item) for item in items]
+            if start_key is None:
+                return
+
+    def read_legacy_messages(self) -> List[BaseMessage]:
+        """
+        Read the session from the legacy single-item table, if there is one.
+        """
+        global legacy_table_available
+        if not self.legacy_table_name or legacy_table_available is False:
+            return []
+        dynamodb_client = get_client("dynamodb")
+        try:
+            item = dynamodb_client.get_item(
+                TableName=self.legacy_table_name,
+                Key={"SessionId": {"S": self.session_id}},
+            ).get("Item")
+        except dynamodb_client.exceptions.ResourceNotFoundException:
+            logger.info("Legacy history table '%s' not found; not reading it again.", self.legacy_table_name)
+            legacy_table_available = False
+            return []
+        legacy_table_available = True
+        if not item or "History" not in item:
+            return []
+        from boto3.dynamodb.types import TypeDeserializer
+
+        history = TypeDeserializer().deserialize(item["History"])
+        return messages_from_dict(history)
+
+    def use_legacy(self) -> List[BaseMessage]:
+        """
+        Fall back to the legacy table for a session with no per-message items.
+        """
+        self.legacy_messages = self.read_legacy_messages()
+        self.last_sequence = len(self.legacy_messages)
+        if self.legacy_messages:
+            logger.info(
+                "Read %d messages of session %s from the legacy history table.",
+                len(self.legacy_messages), self.session_id
+            )
+        return self.legacy_messages
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        messages = [message for page in self.iter_pages() for message in page]
+        if not messages:
+            return list(self.use_legacy())
+        return messages
+
+    def get_cache_key(self) -> Tuple[str, str]:
+        """
+        Return the key of the session in the cache.
+        """
+        return (self.table_name, self.session_id)
+
+    def get_cached_messages(self, limit: int) -> Optional[Tuple[List[BaseMessage], int]]:
+        """
+        Return the session's last `limit` messages from the cache if they are
+        still current, checked by reading only the key of the last stored item.
+
+        Returns:
+            tuple: As `get_recent_messages`, or None if not cached or stale.
+        """
+        entry = self.cache.get(self.get_cache_key())
+        if entry is None:
+            return None
+        last_sequence, messages, capacity = entry
+        if capacity < limit and len(messages) < last_sequence:
+            return None
+
+        items, _ = self.query_page(limit=1, newest_first=True, keys_only=True)
+        stored_sequence = int(items[0][SEQUENCE_KEY]["N"]) if items else 0
+        if stored_sequence != last_sequence:
+            logger.info(
+                "Cached history of session %s is stale (sequence %d, stored %d).",
+                self.session_id, last_sequence, stored_sequence
+            )
+            return None
+
+        self.last_sequence = last_sequence
+        recent = list(messages[-limit:]) if limit else []
+        return recent, last_sequence - len(recent)
+
+    def get_recent_messages(self, limit: int) -> Tuple[List[BaseMessage], int]:
+        """
+        Read the session's last `limit` messages with a single limited query, or
+        from the cache after a key-only check that they are current.
+
+        Returns:
+            tuple: The messages, oldest first, and the number of stored messages
+            that come before them.
+        """
+        if self.cache is not None:
+            cached = self.get_cached_messages(limit)
+            if cached is not None:
+                logger.info(
+                    "Served history of session %s from the container cache (hit rate %.2f).",
+                    self.session_id, self.cache.hit_rate()
+                )
+                return cached
+
+        items, _ = self.query_page(limit=limit, newest_first=True)
+        if not items:
+            legacy_messages = self.use_legacy()
+            recent = legacy_messages[-limit:] if limit else []
+            if self.cache is not None and not legacy_messages:
+                self.cache.put(self.get_cache_key(), (0, (), limit))
+            return list(recent), len(legacy_messages) - len(recent)
+        items.reverse()
+        self.last_sequence = int(items[-1][SEQUENCE_KEY]["N"])
+        messages = [deserialize_message(item) for item in items]
+        if self.cache is not None:
+            self.cache.put(self.get_cache_key(), (self.last_sequence, tuple(messages), limit))
+        return messages, int(items[0][SEQUENCE_KEY]["N"]) - 1
+
+    def has_messages(self) -> bool:
+        """
+        Check whether the session has any stored messages, reading at most one key.
+        """
+        items, _ = self.query_page(limit=1, newest_first=True, keys_only=True)
+        return bool(items) or bool(self.use_legacy())
+
+    def load_last_sequence(self) -> int:
+        """
+        Return the session's highest sequence number, reading only its last key.
+        """
+        items, _ = self.query_page(limit=1, newest_first=True, keys_only=True)
+        if items:
+            self.last_sequence = int(items[0][SEQUENCE_KEY]["N"])
+        else:
+            self.use_legacy()
+        return self.last_sequence
+
+    def build_item(self, sequence: int, message: BaseMessage, created_at: str) -> Tuple[Dict, int, int]:
+        """
+        Return the item storing a message, and the message's raw and stored size.
+        """
+        value, raw_bytes, stored_bytes = encode_payload(serialize_message(message), self.compress_min_bytes)
+        item = {
+            "SessionId": {"S": self.session_id},
+            SEQUENCE_KEY: {"N": str(sequence)},
+            "CreatedAt": {"S": created_at},
+            "Message": value,
+        }
+        return item, raw_bytes, stored_bytes
+
+    def put_message(self, sequence: int, message: BaseMessage) -> Optional[Tuple[int, int]]:
+        """
+        Store a message under a sequence number unless that number is taken.
+
+        Returns:
+            tuple: The message's raw and stored size in bytes, or None if another
+            writer already stored a message there.
+        """
+        item, raw_bytes, stored_bytes = self.build_item(sequence, message, datetime.now(timezone.utc).isoformat())
+        dynamodb_client = get_client("dynamodb")
+        try:
+            dynamodb_client.put_item(
+                TableName=self.table_name,
+                Item=item,
+                ConditionExpression="attribute_not_exists(SessionId)",
+            )
+            return raw_bytes, stored_bytes
+        except dynamodb_client.exceptions.ConditionalCheckFailedException:
+            return None
+
+    def log_compression(self, messages: int, raw_bytes: int, stored_bytes: int) -> None:
+        """
+        Log how much compression saved on the messages just written.
+        """
+        logger.info(
+            "Wrote %d history messages of session %s: %d bytes stored for %d bytes of messages "
+            "(compression ratio %.2f).",
+            messages, self.session_id, stored_bytes, raw_bytes, raw_bytes / max(1, stored_bytes)
+        )
+
+    def copy_legacy_messages(self) -> None:
+        """
+        Copy a legacy session into the per-message table before its first append,
+        so that its messages keep their positions ahead of the new ones.
+        """
+        legacy_messages = self.legacy_messages or []
+        self.legacy_messages = None
+        if not legacy_messages:
+            return
+        logger.info("Copying %d legacy messages of session %s.", len(legacy_messages), self.session_id)
+        created_at = datetime.now(timezone.utc).isoformat()
+        requests = []
+        raw_total = stored_total = 0
+        for sequence, message in enumerate(legacy_messages, start=1):
+            item, raw_bytes, stored_bytes = self.build_item(sequence, message, created_at)
+            requests.append({"PutRequest": {"Item": item}})
+            raw_total += raw_bytes
+            stored_total += stored_bytes
+        self.batch_write(requests)
+        self.log_compression(len(requests), raw_total, stored_total)
+
+    def batch_write(self, requests: List[Dict]) -> None:
+        """
+        Send write requests in batches, resending any DynamoDB leaves unprocessed.
+        """
+        dynamodb_client = get_client("dynamodb")
+        for start in range(0, len(requests), BATCH_WRITE_SIZE):
+            pending = {self.table_name: requests[start:start + BATCH_WRITE_SIZE]}
+            while pending:
+                pending = dynamodb_client.batch_write_item(RequestItems=pending).get("UnprocessedItems")
+
+    def update_cache(self, previous_sequence: int, messages: Sequence[BaseMessage]) -> None:
+        """
+        Write appended messages through to the cache, if it held the session up
+        to `previous_sequence`; otherwise drop the session from the cache.
+        """
+        key = self.get_cache_key()
+        entry = self.cache.get(key)
+        if entry is None:
+            return
+        last_sequence, cached_messages, capacity = entry
+        if last_sequence != previous_sequence:
+            self.cache.discard(key)
+            return
+        updated = (tuple(cached_messages) + tuple(messages))[-capacity:] if capacity else ()
+        self.cache.put(key, (self.last_sequence, updated, capacity))
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        if self.last_sequence is None and self.cache is not None:
+            # The conditional puts catch a cached sequence that is out of date
+            entry = self.cache.get(self.get_cache_key())
+            if entry is not None:
+                self.last_sequence = entry[0]
+        if self.last_sequence is None:
+            self.load_last_sequence()
+        if self.legacy_messages:
+            self.copy_legacy_messages()
+        start_sequence = self.last_sequence
+        contiguous = True
+
+        raw_total = stored_total = 0
+        for message in messages:
+            for attempt in range(MAX_APPEND_ATTEMPTS):
+                sequence = self.last_sequence + 1
+                sizes = self.put_message(sequence, message)
+                if sizes is not None:
+                    self.last_sequence = sequence
+                    raw_total += sizes[0]
+                    stored_total += sizes[1]
+                    break
+                # A concurrent request for the same session appended first
+                contiguous = False
+                logger.warning(
+                    "Sequence %d of session %s is taken, reading the last sequence again.",
+                    sequence, self.session_id
+                )
+                self.load_last_sequence()
+            else:
+                raise RuntimeError(
+                    f"Could not append to session {self.session_id} after {MAX_APPEND_ATTEMPTS} attempts"
+                )
+        self.log_compression(len(messages), raw_total, stored_total)
+        if self.cache is not None:
+            if contiguous:
+                self.update_cache(start_sequence, messages)
+            else:
+                self.cache.discard(self.get_cache_key())
+
+    def add_message(self, message: BaseMessage) -> None:
+        self.add_messages([message])
+
+    def get_summary(self) -> Tuple[str, int]:
+        """
+        Return the session's rolling summary and the number of messages it covers.
+        """
+        item = get_client("dynamodb").get_item(
+            TableName=self.table_name,
+            Key={"SessionId": {"S": f"{self.session_id}{SUMMARY_KEY_SUFFIX}"}, SEQUENCE_KEY: {"N": "0"}},
+        ).get("Item")
+        if not item:
+            return "", 0
+        return item.get("Summary", {}).get("S", ""), int(item.get("SummarizedMessages", {}).get("N", "0"))
+
+    def put_summary(self, summary: str, summarized_messages: int) -> None:
+        """
+        Store the session's rolling summary and the number of messages it covers.
+        """
+        get_client("dynamodb").put_item(
+            TableName=self.table_name,
+            Item={
+                "SessionId": {"S": f"{self.session_id}{SUMMARY_KEY_SUFFIX}"},
+                SEQUENCE_KEY: {"N": "0"},
+                "Summary": {"S": summary},
+                "SummarizedMessages": {"N": str(summarized_messages)},
+            },
+        )
+
+    def clear(self) -> None:
+        requests = []
+        start_key = None
+        while True:
+            items, start_key = self.query_page(start_key=start_key)
+            requests.extend(
+                {"DeleteRequest": {"Key": {"SessionId": item["SessionId"], SEQUENCE_KEY: item[SEQUENCE_KEY]}}}
+                for item in items
+            )
+            if start_key is None:
+                break
+        requests.append({"DeleteRequest": {"Key": {
+            "SessionId": {"S": f"{self.session_id}{SUMMARY_KEY_SUFFIX}"}, SEQUENCE_KEY: {"N": "0"}
+        }}})
+        self.batch_write(requests)
+        self.last_sequence = 0
+        self.legacy_messages = None
+        if self.cache is not None:
+            self.cache.discard(self.get_cache_key())
@@ -0,0 +1,147 @@
+import re
+import math
+import logging
+from collections import Counter
+from typing import Dict, List, Set, Tuple
+
+from langchain_core.documents import Document
+
+# Setup logging at the INFO level for this module
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Rough characters-per-token ratio used to budget and report prompt sizes without a
+# tokenizer; context compression and the history window import it from here
+CHARS_PER_TOKEN = 4
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for",
+    "from", "how", "i", "in", "is", "it", "me", "of", "on", "or", "that", "the",
+    "this", "to", "user", "was", "what", "when", "where", "which", "who", "why",
+    "will", "with", "you", "your",
+}
+# BM25 term-frequency saturation and length normalization
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Reciprocal rank fusion constant
+RRF_K = 60
+# Chunks at least this similar to an already selected chunk are treated as duplicates
+DUPLICATE_SIMILARITY = 0.9
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase a text and split it into content words.
+    """
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of LLM tokens in a piece of text.
+    """
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def bm25_scores(query_tokens: List[str], doc_tokens: List[List[str]]) -> List[float]:
+    """
+    Score candidate chunks against a query with BM25, using document frequencies
+    from the candidate set itself.
+    """
+    doc_count = len(doc_tokens)
+    average_length = sum(len(tokens) for tokens in doc_tokens) / doc_count or 1
+    document_frequency = Counter(term for tokens in doc_tokens for term in set(tokens))
+
+    scores = []
+    for tokens in doc_tokens:
+        term_frequency = Counter(tokens)
+        score = 0.0
+        for term in set(query_tokens):
+            frequency = term_frequency.get(term, 0)
+            if not frequency:
+                continue
+            idf = math.log(1 + (doc_count - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+            score += idf * frequency * (BM25_K1 + 1) / (
+                frequency + BM25_K1 * (1 - BM25_B + BM25_B * len(tokens) / average_length)
+            )
+        scores.append(score)
+    return scores
+
+
+def jaccard(first: Set[str], second: Set[str]) -> float:
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def rerank_documents(
+    query: str,
+    docs: List[Document],
+    top_n: int,
+    diversity: float = 0.3,
+    baseline_k: int = 4
+) -> Tuple[List[Document], Dict[str, int]]:
+    """
+    Re-rank over-fetched candidate chunks and keep the best few.
+
+    Candidates arrive in vector-similarity order. Their relevance combines that
+    order with a BM25 lexical score by reciprocal rank fusion. Chunks are then
+    picked by maximal marginal relevance, with word-set Jaccard similarity as
+    the redundancy measure, and near-duplicates of a picked chunk are skipped.
+
+    Args:
+        query (str): The standalone question.
+        docs (List[Document]): Candidates, most similar first.
+        top_n (int): Chunks to keep.
+        diversity (float, optional): Weight of redundancy against relevance in
+            MMR, from 0 (relevance only) to 1 (default is 0.3).
+        baseline_k (int, optional): Chunks the retriever returned before re-ranking
+            was added, used to report the tokens saved (default is 4).
+
+    Returns:
+        Tuple[List[Document], Dict[str, int]]: The selected chunks in ranked order,
+        and token counts: "candidate_tokens" for all candidates, "baseline_tokens"
+        for the top baseline_k candidates by vector similarity alone, and
+        "selected_tokens".
+    """
+    doc_tokens = [tokenize(doc.page_content) for doc in docs]
+    doc_token_sets = [set(tokens) for tokens in doc_tokens]
+    lexical = bm25_scores(tokenize(query), doc_tokens) if docs else []
+    lexical_order = sorted(range(len(docs)), key=lambda i: lexical[i], reverse=True)
+    lexical_rank = {index: rank for rank, index in enumerate(lexical_order)}
+
+    relevance = [
+        1 / (RRF_K + vector_rank + 1) + 1 / (RRF_K + lexical_rank[vector_rank] + 1)
+        for vector_rank in range(len(docs))
+    ]
+    # Spread over [0, 1]; fused reciprocal ranks are too close together to weigh
+    # against Jaccard redundancy as they are
+    low, high = min(relevance, default=0.0), max(relevance, default=0.0)
+    relevance = [(score - low) / (high - low) if high > low else 1.0 for score in relevance]
+
+    selected: List[int] = []
+    remaining = list(range(len(docs)))
+    while remaining and len(selected) < top_n:
+        best_index, best_score = None, -math.inf
+        for index in remaining:
+            redundancy = max(
+                (jaccard(doc_token_sets[index], doc_token_sets[chosen]) for chosen in selected),
+                default=0.0,
+            )
+            if redundancy >= DUPLICATE_SIMILARITY:
+                continue
+            score = (1 - diversity) * relevance[index] - diversity * redundancy
+            if score > best_score:
+                best_index, best_score = index, score
+        if best_index is None:
+            break
+        selected.append(best_index)
+        remaining.remove(best_index)
+
+    tokens = [estimate_tokens(doc.page_content) for doc in docs]
+    stats = {
+        "candidate_tokens": sum(tokens),
+        "baseline_tokens": sum(tokens[:baseline_k]),
+        "selected_tokens": sum(tokens[index] for index in selected),
+    }
+    return [docs[index] for index in selected], stats
@@ -0,0 +1,208 @@
+import json
+import time
+import struct
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from helpers.rerank import rerank_documents
+from helpers.tracing import span
+
+# Setup logging at the INFO level for this module
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    Least-recently-used cache whose entries also expire after a fixed time.
+
+    Hits and misses are counted so that hit rates can be reported.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 300):
+        """
+        Args:
+            max_entries (int, optional): Entries kept before the least recently
+                used one is evicted (default is 256).
+            ttl_seconds (float, optional): Seconds an entry is served for
+                (default is 300).
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key) -> Optional[Any]:
+        """
+        Return the value for a key, or None if it is missing or expired.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl_seconds:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value) -> None:
+        """
+        Store a value, evicting the least recently used entry if the cache is full.
+        """
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def discard(self, key) -> None:
+        """
+        Drop an entry if it is present.
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        Drop every entry. Hit and miss counts are kept.
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def hit_rate(self) -> float:
+        """
+        Return the fraction of lookups that were hits.
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+def get_embedding_hash(embedding: List[float]) -> str:
+    """
+    Return a compact, stable fingerprint of an embedding vector.
+    """
+    return hashlib.sha1(struct.pack(f"{len(embedding)}f", *embedding)).hexdigest()
+
+
+class CachedVectorStoreRetriever(BaseRetriever):
+    """
+    Vector store retriever that caches query embeddings and search results.
+
+    The first level maps query text to its embedding, so a repeated standalone
+    question skips the embedding call. The second level maps
+    (embedding hash, k, filter) to the retrieved chunks, so it also skips the
+    vector search. Both levels are emptied whenever `generation_provider`
+    reports a new ingestion generation.
+
+    If `top_n` is set, `k` candidates are fetched (and cached) and re-ranked
+    locally with `rerank_documents`, so only the best `top_n` distinct chunks
+    reach the prompt.
+    """
+    vectorstore: Any
+    embeddings: Any
+    search_kwargs: Dict[str, Any] = {}
+    embedding_cache: Any
+    result_cache: Any
+    generation_provider: Optional[Callable[[], Optional[int]]] = None
+    generation: Optional[int] = None
+    top_n: Optional[int] = None
+    diversity: float = 0.3
+
+    def check_generation(self) -> None:
+        """
+        Empty both cache levels if the ingestion generation has changed.
+        """
+        if self.generation_provider is None:
+            return
+        generation = self.generation_provider()
+        if generation is None or generation == self.generation:
+            return
+        if self.generation is not None:
+            logger.info("Ingestion generation changed from %s to %s, clearing retrieval caches.", self.generation, generation)
+            self.embedding_cache.clear()
+            self.result_cache.clear()
+        self.generation = generation
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        Return hit counts and hit rates for both cache levels.
+        """
+        return {
+            "embedding_hits": self.embedding_cache.hits,
+            "embedding_misses": self.embedding_cache.misses,
+            "embedding_hit_rate": self.embedding_cache.hit_rate(),
+            "result_hits": self.result_cache.hits,
+            "result_misses": self.result_cache.misses,
+            "result_hit_rate": self.result_cache.hit_rate(),
+        }
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        self.check_generation()
+
+        embedding = self.embedding_cache.get(query)
+        if embedding is None:
+            with span("embedding"):
+                embedding = self.embeddings.embed_query(query)
+            self.embedding_cache.put(query, embedding)
+
+        k = self.search_kwargs.get("k", 4)
+        search_filter = self.search_kwargs.get("filter")
+        result_key = (
+            get_embedding_hash(embedding),
+            k,
+            json.dumps(search_filter, sort_keys=True, default=str),
+        )
+
+        results = self.result_cache.get(result_key)
+        if results is None:
+            with span("vector_search"):
+                docs = self.vectorstore.similarity_search_by_vector(
+                    embedding, k=k, filter=search_filter
+                )
+            results = [(getattr(doc, "id", None), doc.page_content, doc.metadata) for doc in docs]
+            self.result_cache.put(result_key, results)
+
+        stats = self.get_stats()
+        logger.info(
+            "Retrieval cache hit rates: embeddings %.2f (%d/%d), results %.2f (%d/%d).",
+            stats["embedding_hit_rate"],
+            stats["embedding_hits"],
+            stats["embedding_hits"] + stats["embedding_misses"],
+            stats["result_hit_rate"],
+            stats["result_hits"],
+            stats["result_hits"] + stats["result_misses"],
+        )
+
+        # Fresh copies, so that downstream changes never leak into the cache
+        docs = [
+            Document(id=doc_id, page_content=page_content, metadata=dict(metadata))
+            for doc_id, page_content, metadata in results
+        ]
+        if self.top_n is None:
+            return docs
+
+        with span("rerank"):
+            selected, token_stats = rerank_documents(query, docs, self.top_n, self.diversity)
+        logger.info(
+            "Re-ranked %d candidates to %d chunks: ~%d context tokens, ~%d saved versus the "
+            "unranked top-k and ~%d versus all candidates.",
+            len(docs),
+            len(selected),
+            token_stats["selected_tokens"],
+            token_stats["baseline_tokens"] - token_stats["selected_tokens"],
+            token_stats["candidate_tokens"] - token_stats["selected_tokens"],
+        )
+        return selected
@@ -0,0 +1,184 @@
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Setup logging at the INFO level for this module
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Metadata key that marks a model run as a traced stage (see StageCallbackHandler)
+TRACE_STAGE_METADATA_KEY = "trace_stage"
+
+
+class Trace:
+    """
+    Per-request record of how long each stage took.
+
+    A stage that runs several times in one request (retries, several SSM
+    parameters) accumulates its total duration and a call count. Spans may be
+    closed from worker threads, so updates are locked.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.durations: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            self.durations[stage] = self.durations.get(stage, 0.0) + seconds
+            self.counts[stage] = self.counts.get(stage, 0) + 1
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def get_durations_ms(self) -> Dict[str, float]:
+        with self.lock:
+            return {stage: round(seconds * 1000, 1) for stage, seconds in self.durations.items()}
+
+
+# Trace of the request being handled; worker threads started through LangChain's
+# ContextThreadPoolExecutor see the same trace
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+def start_trace() -> Trace:
+    """
+    Start tracing a new request and make it the current trace.
+    """
+    trace = Trace()
+    current_trace.set(trace)
+    return trace
+
+
+def add_stage(stage: str, seconds: float) -> None:
+    """
+    Add a measured duration to the current trace, if a request is being traced.
+    """
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """
+    Time the enclosed block as `stage` of the current trace.
+
+    Outside a traced request the block simply runs.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage(stage, time.perf_counter() - start)
+
+
+class StageCallbackHandler(BaseCallbackHandler):
+    """
+    LangChain callback handler that times model runs inside a chain.
+
+    Only runs whose metadata carries TRACE_STAGE_METADATA_KEY are timed, under
+    that stage name; time to the first streamed token is recorded as
+    "<stage>_first_token".
+    """
+
+    def __init__(self, trace: Trace):
+        self.trace = trace
+        self.runs: Dict[UUID, Any] = {}
+
+    def on_chat_model_start(
+        self,
+        serialized: Dict[str, Any],
+        messages: List[List[Any]],
+        *,
+        run_id: UUID,
+        metadata: Optional[Dict[str, Any]] = None,
+        **kwargs: Any
+    ) -> None:
+        stage = (metadata or {}).get(TRACE_STAGE_METADATA_KEY)
+        if stage:
+            self.runs[run_id] = {"stage": stage, "started_at": time.perf_counter(), "first_token": False}
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self.runs.get(run_id)
+        if run and not run["first_token"] and token:
+            run["first_token"] = True
+            self.trace.add(f"{run['stage']}_first_token", time.perf_counter() - run["started_at"])
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self.runs.pop(run_id, None)
+        if run:
+            self.trace.add(run["stage"], time.perf_counter() - run["started_at"])
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self.on_llm_end(None, run_id=run_id)
+
+
+def get_trace_callbacks() -> List[BaseCallbackHandler]:
+    """
+    Return the callback handlers to pass to a chain so that its model runs are
+    added to the current trace, or an empty list outside a traced request.
+    """
+    trace = current_trace.get()
+    return [StageCallbackHandler(trace)] if trace is not None else []
+
+
+def emit_trace(trace: Trace, namespace: str, cold_start: bool, properties: Optional[Dict[str, Any]] = None) -> dict:
+    """
+    Print the trace as a CloudWatch Embedded Metric Format record.
+
+    Every stage becomes a "<stage>_ms" metric, with "total_ms" for the whole
+    request, and the record is dimensioned by the cold-start flag so cold and
+    warm latencies can be graphed separately. Stage call counts and any
+    `properties` are included as log fields only.
+
+    Args:
+        trace (Trace): The finished request trace.
+        namespace (str): CloudWatch metric namespace.
+        cold_start (bool): Whether this was the container's first request.
+        properties (dict, optional): Extra searchable fields, such as the session ID.
+
+    Returns:
+        dict: The record that was printed.
+    """
+    durations = trace.get_durations_ms()
+    durations["total"] = round(trace.elapsed() * 1000, 1)
+    record = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": namespace,
+                    "Dimensions": [["ColdStart"]],
+                    "Metrics": [
+                        {"Name": f"{stage}_ms", "Unit": "Milliseconds"} for stage in durations
+                    ],
+                }
+            ],
+        },
+        "ColdStart": "true" if cold_start else "false",
+        "stage_counts": dict(trace.counts),
+        **(properties or {}),
+        **{f"{stage}_ms": milliseconds for stage, milliseconds in durations.items()},
+    }
+    # EMF records must be written to stdout as a bare JSON line
+    print(json.dumps(record, default=str))
+    return record
+
+
+def get_server_timing(trace: Trace) -> str:
+    """
+    Format the trace's stage durations as a Server-Timing header value.
+    """
+    durations = trace.get_durations_ms()
+    durations["total"] = round(trace.elapsed() * 1000, 1)
+    return ", ".join(f"{stage};dur={milliseconds}" for stage, milliseconds in durations.items())
@@ -1,23 +1,133 @@
-from typing import Dict
+import re
+import logging
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, Optional
 
 from langchain_core.vectorstores import VectorStoreRetriever
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.chains import create_history_aware_retriever
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableBranch, RunnableLambda
+from langchain_core.runnables.config import ContextThreadPoolExecutor
 
 from helpers.helper import get_vectorstore
+from helpers.retrieval_cache import CachedVectorStoreRetriever, TTLCache
+from helpers.tracing import span
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Words that usually point back to an earlier turn of the conversation
+REFERENCE_PATTERN = re.compile(
+    r"\b(it|its|they|them|their|theirs|this|these|those|he|she|him|her|his|hers|"
+    r"above|previous|previously|earlier|former|latter|same|again|else|"
+    r"elaborate|expand|continue|tell me more|say more|go on)\b",
+    re.IGNORECASE
+)
+# Openings of elliptical follow-ups such as "and for educators?" or "what about X?"
+FOLLOW_UP_PATTERN = re.compile(r"^(and|but|so|or|then|what about|how about|why|why not|how so)\b", re.IGNORECASE)
+# Prefix added to questions by get_user_query
+USER_PREFIX_PATTERN = re.compile(r"^\s*user\s+", re.IGNORECASE)
+# Shortest question, in words, that is trusted to stand on its own
+MIN_SELF_CONTAINED_WORDS = 4
+
+# Threads running question rewrites, so that a rewrite can be abandoned when it
+# runs past its latency budget. The caller's context is copied into the thread,
+# so the rewrite stays under the chain's callbacks and the request's trace.
+rewrite_executor = ContextThreadPoolExecutor(max_workers=4)
+
+def get_question_text(query: str) -> str:
+    """
+    Strip the formatting added by get_user_query and return the bare question.
+    """
+    return USER_PREFIX_PATTERN.sub("", query).strip()
+
+def is_self_contained(question: str) -> bool:
+    """
+    Decide whether a follow-up question can be understood without the chat history.
+
+    A question is treated as self-contained if it has at least 
+    MIN_SELF_CONTAINED_WORDS words, does not open like an elliptical follow-up 
+    and contains no pronouns or words referring to earlier turns. The check is 
+    deliberately conservative: anything doubtful is rewritten.
+
+    Args:
+        question (str): The user's question.
+
+    Returns:
+        bool: True if the question can be sent to the retriever as is.
+    """
+    question = get_question_text(question)
+    if len(question.split()) < MIN_SELF_CONTAINED_WORDS:
+        return False
+    if FOLLOW_UP_PATTERN.search(question):
+        return False
+    return not REFERENCE_PATTERN.search(question)
+
+def rewrite_question(inputs: dict, rewrite_chain, timeout_seconds: Optional[float]) -> str:
+    """
+    Rewrite a follow-up question into a standalone question within a latency budget.
+
+    If the rewrite fails or takes longer than `timeout_seconds`, the raw question 
+    is returned instead, so retrieval still runs on the user's own words.
+
+    Args:
+        inputs (dict): The chain inputs, with "input" and "chat_history".
+        rewrite_chain: The prompt | LLM | parser chain producing the standalone question.
+        timeout_seconds (float, optional): Latency budget for the rewrite; None waits indefinitely.
+
+    Returns:
+        str: The standalone question, or the raw question on fallback.
+    """
+    with span("query_rewrite"):
+        future = rewrite_executor.submit(rewrite_chain.invoke, inputs)
+        try:
+            standalone_question = future.result(timeout=timeout_seconds)
+            logger.info("Follow-up question rewritten by the contextualization model.")
+            return standalone_question
+        except FutureTimeoutError:
+            logger.warning(f"Question rewrite exceeded its {timeout_seconds}s budget, using the raw question.")
+        except Exception as e:
+            logger.error(f"Error rewriting question, using the raw question: {e}")
+    return inputs["input"]
 
 def get_vectorstore_retriever(
     llm,
     vectorstore_config_dict: Dict[str, str],
-    embeddings#: BedrockEmbeddings
+    embeddings,#: BedrockEmbeddings
+    generation_provider: Optional[Callable[[], Optional[int]]] = None,
+    cache_ttl_seconds: float = 300,
+    cache_max_entries: int = 256,
+    rewrite_llm=None,
+    rewrite_timeout_seconds: Optional[float] = None,
+    fetch_k: int = 4,
+    top_n: Optional[int] = None,
+    rerank_diversity: float = 0.3
 ) -> VectorStoreRetriever:
     """
     Retrieve the vectorstore and return the history-aware retriever object.
 
+    The underlying retriever caches query embeddings and search results (see 
+    `CachedVectorStoreRetriever`); both caches are cleared when 
+    `generation_provider` reports a new ingestion generation.
+
+    Follow-up questions are rewritten into standalone questions by `rewrite_llm` 
+    (the chat model if not given), except when `is_self_contained` shows that the 
+    question does not depend on the chat history. A rewrite that takes longer than 
+    `rewrite_timeout_seconds` falls back to the raw question.
+
     Args:
         llm: The language model instance used to generate the response.
         vectorstore_config_dict (Dict[str, str]): The configuration dictionary for the vectorstore, including parameters like collection name, database name, user, password, host, and port.
         embeddings (BedrockEmbeddings): The embeddings instance used to process the documents.
+        generation_provider (Callable[[], Optional[int]], optional): Returns the current ingestion generation.
+        cache_ttl_seconds (float, optional): Seconds a cached embedding or search result is served for.
+        cache_max_entries (int, optional): Entries kept in each cache.
+        rewrite_llm (optional): The language model used to rewrite follow-up questions.
+        rewrite_timeout_seconds (float, optional): Latency budget for a rewrite.
+        fetch_k (int, optional): Candidate chunks fetched from the vector store.
+        top_n (int, optional): Chunks kept after local re-ranking; None disables re-ranking.
+        rerank_diversity (float, optional): MMR weight of redundancy against relevance.
 
     Returns:
         VectorStoreRetriever: A history-aware retriever instance.
@@ -32,7 +142,16 @@ def get_vectorstore_retriever(
         port=int(vectorstore_config_dict['port'])
     )
 
-    retriever = vectorstore.as_retriever()
+    retriever = CachedVectorStoreRetriever(
+        vectorstore=vectorstore,
+        embeddings=embeddings,
+        embedding_cache=TTLCache(max_entries=cache_max_entries, ttl_seconds=cache_ttl_seconds),
+        result_cache=TTLCache(max_entries=cache_max_entries, ttl_seconds=cache_ttl_seconds),
+        generation_provider=generation_provider,
+        search_kwargs={"k": fetch_k},
+        top_n=top_n,
+        diversity=rerank_diversity
+    )
     # Contextualize question and create history-aware retriever
     contextualize_q_system_prompt = (
         "Given a chat history and the latest user question "
@@ -50,8 +169,18 @@ def get_vectorstore_retriever(
         ]
     )
 
-    history_aware_retriever = create_history_aware_retriever(
-        llm, retriever, contextualize_q_prompt
-    )
+    rewrite_chain = contextualize_q_prompt | (rewrite_llm or llm) | StrOutputParser()
+
+    # Same shape as create_history_aware_retriever, with a cheap path for first 
+    # turns and self-contained follow-ups
+    history_aware_retriever = RunnableBranch(
+        (
+            lambda x: not x.get("chat_history", False) or is_self_contained(x["input"]),
+            (lambda x: x["input"]) | retriever,
+        ),
+        RunnableLambda(
+            lambda x: rewrite_question(x, rewrite_chain, rewrite_timeout_seconds)
+        ) | retriever,
+    ).with_config(run_name="chat_retriever_chain")
 
     return history_aware_retriever
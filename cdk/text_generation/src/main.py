@@ -1,16 +1,25 @@
 import os
 import json
-import boto3
+import queue
 import logging
+import threading
 import psycopg2
+from psycopg2.extras import execute_values
 import hashlib
 import time
 import uuid, datetime
-from langchain_aws import BedrockEmbeddings
 
 
+from helpers.aws_clients import get_client
 from helpers.vectorstore import get_vectorstore_retriever
-from helpers.chat import get_bedrock_llm, create_dynamodb_history_table, get_response, get_user_query, get_initial_user_query
+from helpers.chat import get_bedrock_llm, get_response, get_user_query, get_initial_user_query, build_conversational_rag_chain, has_chat_history, get_chat_history, append_chat_history
+from helpers.history import set_prefetched_messages, start_summary_fold, wait_for_summary_folds
+from helpers.message_history import create_message_table
+from helpers.answer_cache import AnswerCache
+from helpers.retrieval_cache import TTLCache
+from helpers.tracing import start_trace, span, emit_trace, get_server_timing
+from helpers.vectorstore import is_self_contained
+from langchain_core.runnables.config import ContextThreadPoolExecutor
 
 # Set up basic logging
 logging.basicConfig(level=logging.INFO)
@@ -23,25 +32,118 @@ RDS_PROXY_ENDPOINT = os.environ["RDS_PROXY_ENDPOINT"]
 BEDROCK_LLM_PARAM = os.environ["BEDROCK_LLM_PARAM"]
 EMBEDDING_MODEL_PARAM = os.environ["EMBEDDING_MODEL_PARAM"]
 TABLE_NAME_PARAM = os.environ["TABLE_NAME_PARAM"]
-# AWS Clients
-sqs = boto3.client('sqs')
-secrets_manager_client = boto3.client("secretsmanager")
-ssm_client = boto3.client("ssm", region_name=REGION)
-bedrock_runtime = boto3.client("bedrock-runtime", region_name=REGION)
+# Optional SSM parameter holding a smaller model used only to rewrite follow-up questions
+REWRITE_LLM_PARAM = os.environ.get("REWRITE_LLM_PARAM")
+# Seconds a follow-up rewrite may take before the raw question is used instead
+REWRITE_TIMEOUT_SECONDS = float(os.environ.get("REWRITE_TIMEOUT_SECONDS", "3"))
+# Seconds a corpus-state probe result is reused before the database is asked again
+CORPUS_STATE_TTL_SECONDS = float(os.environ.get("CORPUS_STATE_TTL_SECONDS", "30"))
+# Seconds a cached role prompt is served before its version is checked again
+PROMPT_CACHE_TTL_SECONDS = float(os.environ.get("PROMPT_CACHE_TTL_SECONDS", "60"))
+# Per-message chat history table; the single-item table named by TABLE_NAME_PARAM
+# is only read for sessions that started before it existed
+MESSAGE_TABLE_NAME = os.environ.get("MESSAGE_TABLE_NAME", "DynamoDB-Conversation-Messages")
+# "true" to read sessions with no per-message items from the single-item table
+HISTORY_LEGACY_FALLBACK = os.environ.get("HISTORY_LEGACY_FALLBACK", "true").lower() == "true"
+# Most recent stored messages read per turn; must cover the history window
+HISTORY_READ_LIMIT = int(os.environ.get("HISTORY_READ_LIMIT", "40"))
+# "true" to zlib-compress stored messages of at least HISTORY_COMPRESS_MIN_BYTES bytes
+HISTORY_COMPRESSION_ENABLED = os.environ.get("HISTORY_COMPRESSION_ENABLED", "true").lower() == "true"
+HISTORY_COMPRESS_MIN_BYTES = int(os.environ.get("HISTORY_COMPRESS_MIN_BYTES", "512"))
+# "true" to keep recent session histories in the container, checked against the
+# session's last stored sequence number before use and written through on append
+HISTORY_CACHE_ENABLED = os.environ.get("HISTORY_CACHE_ENABLED", "true").lower() == "true"
+# Sessions kept in the history cache, and seconds an unused session is kept for
+HISTORY_CACHE_MAX_SESSIONS = int(os.environ.get("HISTORY_CACHE_MAX_SESSIONS", "200"))
+HISTORY_CACHE_TTL_SECONDS = float(os.environ.get("HISTORY_CACHE_TTL_SECONDS", "900"))
+# "describe" verifies the history table once per container (creating it if missing),
+# "none" trusts the table provisioned at deploy time
+HISTORY_TABLE_CHECK = os.environ.get("HISTORY_TABLE_CHECK", "describe")
+# First-turn answer cache: "true" to serve repeated opening questions from memory
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+# Minimum cosine similarity between questions for a cached answer to be reused
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", "0.95"))
+# Cached answers kept per role and prompt version
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "50"))
+# Seconds a cached query embedding or retrieval result is served for
+RETRIEVAL_CACHE_TTL_SECONDS = float(os.environ.get("RETRIEVAL_CACHE_TTL_SECONDS", "300"))
+# Entries kept in each retrieval cache level
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.environ.get("RETRIEVAL_CACHE_MAX_ENTRIES", "256"))
+# Most recent turns sent to the model verbatim, and their token budget
+HISTORY_WINDOW_TURNS = int(os.environ.get("HISTORY_WINDOW_TURNS", "4"))
+HISTORY_MAX_TOKENS = int(os.environ.get("HISTORY_MAX_TOKENS", "1500"))
+# "true" to fold turns that leave the window into a stored rolling summary
+HISTORY_SUMMARY_ENABLED = os.environ.get("HISTORY_SUMMARY_ENABLED", "true").lower() == "true"
+# Optional SQS queue that batches engagement records for the engagement log consumer
+ENGAGEMENT_LOG_QUEUE_URL = os.environ.get("ENGAGEMENT_LOG_QUEUE_URL")
+# Attempts at generating an answer, and the base of the jittered backoff between them
+LLM_MAX_ATTEMPTS = int(os.environ.get("LLM_MAX_ATTEMPTS", "3"))
+LLM_RETRY_BACKOFF_SECONDS = float(os.environ.get("LLM_RETRY_BACKOFF_SECONDS", "0.5"))
+# Seconds of the invocation reserved for returning a response; no attempt starts inside it
+RESPONSE_DEADLINE_MARGIN_SECONDS = float(os.environ.get("RESPONSE_DEADLINE_MARGIN_SECONDS", "5"))
+# "true" to hedge slow answers with a second Bedrock request; the delay applies
+# until the p95 latency of this container's requests is known
+LLM_HEDGING_ENABLED = os.environ.get("LLM_HEDGING_ENABLED", "false").lower() == "true"
+LLM_HEDGE_AFTER_SECONDS = float(os.environ.get("LLM_HEDGE_AFTER_SECONDS", "10"))
+# Candidate chunks fetched per question, and chunks kept after local re-ranking
+RETRIEVAL_FETCH_K = int(os.environ.get("RETRIEVAL_FETCH_K", "12"))
+RETRIEVAL_TOP_N = int(os.environ.get("RETRIEVAL_TOP_N", "3"))
+# MMR weight of redundancy against relevance when re-ranking
+RERANK_DIVERSITY = float(os.environ.get("RERANK_DIVERSITY", "0.3"))
+# Token budget for the deduplicated, trimmed context stuffed into the prompt
+CONTEXT_MAX_TOKENS = int(os.environ.get("CONTEXT_MAX_TOKENS", "1500"))
+# AppSync endpoint used to push partial answers when a request asks for streaming
+APPSYNC_API_URL = os.environ.get("APPSYNC_API_URL")
+API_KEY = os.environ.get("API_KEY")
+# CloudWatch namespace of the per-request stage latency metrics
+TRACE_METRICS_NAMESPACE = os.environ.get("TRACE_METRICS_NAMESPACE", "DSA/TextGeneration")
+# "true" to also return the stage latencies in a Server-Timing response header (debugging only)
+TRACE_RESPONSE_HEADERS = os.environ.get("TRACE_RESPONSE_HEADERS", "false").lower() == "true"
+# AWS clients are created on first use by get_client and shared across helpers;
+# langchain_aws and httpx are likewise only imported by the paths that need them
+# Threads for the independent I/O of a request; they see the request's trace
+io_executor = ContextThreadPoolExecutor(max_workers=4)
 # Cached resources
 connection = None
 db_secret = None
 BEDROCK_LLM_ID = None
 EMBEDDING_MODEL_ID = None
+REWRITE_LLM_ID = None
 TABLE_NAME = None
 # Cached embeddings instance
 embeddings = None
+# Whether the history table has been verified by this container
+history_table_verified = False
+# Cached LLM, retriever and RAG chain, keyed by (model ID, rewrite model ID, role prompt version)
+rag_runtimes = {}
+# Cached corpus-state probe result and the time it was taken
+corpus_state = None
+corpus_state_checked_at = 0.0
+# Cached role prompts: role -> {"prompt", "version", "checked_at"}
+prompt_cache = {}
+# Answers to first-turn questions, keyed by role, prompt version and corpus generation
+answer_cache = AnswerCache(
+    similarity_threshold=ANSWER_CACHE_SIMILARITY,
+    max_entries=ANSWER_CACHE_MAX_ENTRIES
+)
+# Recent messages of the sessions this container has served, keyed by (table, session ID)
+history_cache = TTLCache(
+    max_entries=HISTORY_CACHE_MAX_SESSIONS,
+    ttl_seconds=HISTORY_CACHE_TTL_SECONDS
+) if HISTORY_CACHE_ENABLED else None
+# Engagement records logged during the current request, written once it has been answered
+engagement_buffer = []
+# HTTP client kept open across requests for AppSync notifications
+appsync_client = None
+# Whether the next request is the first one handled by this container
+cold_start = True
 
 def get_secret(secret_name, expect_json=True):
     global db_secret
     if db_secret is None:
         try:
-            response = secrets_manager_client.get_secret_value(SecretId=secret_name)["SecretString"]
+            with span("secrets"):
+                response = get_client("secretsmanager").get_secret_value(SecretId=secret_name)["SecretString"]
             db_secret = json.loads(response) if expect_json else response
         except json.JSONDecodeError as e:
             logger.error(f"Failed to decode JSON for secret: {e}")
@@ -57,7 +159,8 @@ def get_parameter(param_name, cached_var):
     """
     if cached_var is None:
         try:
-            response = ssm_client.get_parameter(Name=param_name, WithDecryption=True)
+            with span("ssm"):
+                response = get_client("ssm", region_name=REGION).get_parameter(Name=param_name, WithDecryption=True)
             cached_var = response["Parameter"]["Value"]
         except Exception as e:
             logger.error(f"Error fetching parameter {param_name}: {e}")
@@ -66,18 +169,54 @@ def get_parameter(param_name, cached_var):
 
 
 def initialize_constants():
-    global BEDROCK_LLM_ID, EMBEDDING_MODEL_ID, TABLE_NAME, embeddings
-    BEDROCK_LLM_ID = get_parameter(BEDROCK_LLM_PARAM, BEDROCK_LLM_ID)
-    EMBEDDING_MODEL_ID = get_parameter(EMBEDDING_MODEL_PARAM, EMBEDDING_MODEL_ID)
-    TABLE_NAME = get_parameter(TABLE_NAME_PARAM, TABLE_NAME)
+    global BEDROCK_LLM_ID, EMBEDDING_MODEL_ID, REWRITE_LLM_ID, TABLE_NAME, history_table_verified
+    # On a cold start the parameters are fetched concurrently rather than one by one
+    if None in (BEDROCK_LLM_ID, EMBEDDING_MODEL_ID, TABLE_NAME):
+        bedrock_llm_id = io_executor.submit(get_parameter, BEDROCK_LLM_PARAM, BEDROCK_LLM_ID)
+        rewrite_llm_id = io_executor.submit(get_parameter, REWRITE_LLM_PARAM, REWRITE_LLM_ID) if REWRITE_LLM_PARAM else None
+        embedding_model_id = io_executor.submit(get_parameter, EMBEDDING_MODEL_PARAM, EMBEDDING_MODEL_ID)
+        table_name = io_executor.submit(get_parameter, TABLE_NAME_PARAM, TABLE_NAME)
+        BEDROCK_LLM_ID = bedrock_llm_id.result()
+        if rewrite_llm_id:
+            REWRITE_LLM_ID = rewrite_llm_id.result()
+        EMBEDDING_MODEL_ID = embedding_model_id.result()
+        TABLE_NAME = table_name.result()
+
+    # The table is provisioned at deploy time; at most one cheap check per container
+    if not history_table_verified:
+        if HISTORY_TABLE_CHECK == "describe":
+            create_message_table(MESSAGE_TABLE_NAME)
+        history_table_verified = True
+
+
+def get_legacy_table_name():
+    """
+    Return the single-item history table to fall back to, or None if disabled.
+    """
+    return TABLE_NAME if HISTORY_LEGACY_FALLBACK else None
+
+
+def get_history_compress_min_bytes():
+    """
+    Return the size from which history messages are written compressed, or None if disabled.
+    """
+    return HISTORY_COMPRESS_MIN_BYTES if HISTORY_COMPRESSION_ENABLED else None
+
+
+def get_embeddings():
+    """
+    Return the container's Bedrock embeddings, creating them on first use.
+    """
+    global embeddings
     if embeddings is None:
+        from langchain_aws import BedrockEmbeddings
+
         embeddings = BedrockEmbeddings(
             model_id=EMBEDDING_MODEL_ID,
-            client=bedrock_runtime,
+            client=get_client("bedrock-runtime", region_name=REGION),
             region_name=REGION,
         )
-    
-    create_dynamodb_history_table(TABLE_NAME)
+    return embeddings
 
 
 def connect_to_db():
@@ -103,6 +242,170 @@ def connect_to_db():
             raise
     return connection
 
+def get_prompt_version(user_prompt):
+    """
+    Return a short fingerprint of a role prompt, used to tell prompt revisions apart.
+    """
+    return hashlib.sha256(user_prompt.encode("utf-8")).hexdigest()[:16]
+
+def get_rag_runtime(user_prompt, vectorstore_config_dict):
+    """
+    Return the LLM, history-aware retriever and conversational RAG chain for the 
+    current models and role prompt, building them only on the first request of the 
+    container that needs them.
+    """
+    runtime_key = (BEDROCK_LLM_ID, REWRITE_LLM_ID, get_prompt_version(user_prompt))
+    if runtime_key not in rag_runtimes:
+        logger.info("Creating Bedrock LLM instance.")
+        llm = get_bedrock_llm(BEDROCK_LLM_ID)
+
+        rewrite_llm = None
+        if REWRITE_LLM_ID and REWRITE_LLM_ID != BEDROCK_LLM_ID:
+            logger.info("Creating Bedrock LLM instance for question rewriting.")
+            # A standalone question is short, so the rewrite never needs a long completion
+            rewrite_llm = get_bedrock_llm(REWRITE_LLM_ID, max_tokens=256)
+
+        logger.info("Creating history-aware retriever.")
+        history_aware_retriever = get_vectorstore_retriever(
+            llm=llm,
+            vectorstore_config_dict=vectorstore_config_dict,
+            embeddings=get_embeddings(),
+            generation_provider=get_corpus_generation,
+            cache_ttl_seconds=RETRIEVAL_CACHE_TTL_SECONDS,
+            cache_max_entries=RETRIEVAL_CACHE_MAX_ENTRIES,
+            rewrite_llm=rewrite_llm,
+            rewrite_timeout_seconds=REWRITE_TIMEOUT_SECONDS,
+            fetch_k=RETRIEVAL_FETCH_K,
+            top_n=RETRIEVAL_TOP_N,
+            rerank_diversity=RERANK_DIVERSITY
+        )
+
+        rag_runtimes[runtime_key] = {
+            "llm": llm,
+            "history_aware_retriever": history_aware_retriever,
+            "conversational_rag_chain": build_conversational_rag_chain(
+                llm=llm,
+                history_aware_retriever=history_aware_retriever,
+                table_name=MESSAGE_TABLE_NAME,
+                # The rolling summary is a short rewrite task, like question contextualization
+                summary_llm=(rewrite_llm or llm) if HISTORY_SUMMARY_ENABLED else None,
+                history_window_turns=HISTORY_WINDOW_TURNS,
+                history_max_tokens=HISTORY_MAX_TOKENS,
+                history_read_limit=HISTORY_READ_LIMIT,
+                legacy_table_name=get_legacy_table_name(),
+                history_compress_min_bytes=get_history_compress_min_bytes(),
+                history_cache=history_cache,
+                hedge_after_seconds=LLM_HEDGE_AFTER_SECONDS if LLM_HEDGING_ENABLED else None,
+                context_max_tokens=CONTEXT_MAX_TOKENS
+            )
+        }
+    else:
+        logger.info("Reusing cached LLM, retriever and RAG chain.")
+    return rag_runtimes[runtime_key]
+
+def invoke_event_notification(session_id, message):
+    """
+    Publish a notification event to AppSync via HTTPX (directly to the AppSync API).
+
+    Used to push partial answers to subscribers of the session while the answer 
+    is streamed. The HTTP client is kept open for the life of the container so 
+    that successive chunks reuse the same connection.
+    """
+    global appsync_client
+    if appsync_client is None:
+        import httpx
+
+        appsync_client = httpx.Client(timeout=5.0)
+
+    query = """
+    mutation sendNotification($message: String!, $sessionId: String!) {
+        sendNotification(message: $message, sessionId: $sessionId) {
+            message
+            sessionId
+        }
+    }
+    """
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": API_KEY
+    }
+    payload = {
+        "query": query,
+        "variables": {
+            "message": message,
+            "sessionId": session_id
+        }
+    }
+
+    response = appsync_client.post(APPSYNC_API_URL, headers=headers, json=payload)
+    response_data = response.json()
+    if response.status_code != 200 or "errors" in response_data:
+        raise Exception(f"Failed to send notification: {response_data}")
+    return response_data["data"]["sendNotification"]
+
+class StreamPublisher:
+    """
+    Push partial answer text for a session to AppSync from a background thread.
+
+    Calling the publisher only queues the text; one worker thread posts the 
+    queued pieces in order, so reading tokens from Bedrock never waits for an 
+    AppSync round trip. Each notification carries a JSON message of the form 
+    {"type": "chunk", "content": "..."}. Failures are logged and further chunks 
+    are dropped, so a broken subscription never fails the request; the complete 
+    answer is always returned in the HTTP response and in the completion message.
+    """
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.chunks = queue.Queue()
+        self.failed = False
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def __call__(self, text):
+        if not self.failed:
+            self.chunks.put(text)
+
+    def run(self):
+        while True:
+            text = self.chunks.get()
+            if text is None:
+                return
+            if self.failed:
+                continue
+            try:
+                invoke_event_notification(self.session_id, json.dumps({"type": "chunk", "content": text}))
+            except Exception as e:
+                logger.error(f"Error publishing answer chunk to AppSync, disabling streaming: {e}")
+                self.failed = True
+
+    def close(self):
+        """
+        Wait until every queued chunk has been posted and stop the worker.
+        """
+        self.chunks.put(None)
+        self.worker.join()
+
+def publish_stream_complete(session_id, response, publisher=None):
+    """
+    Tell subscribers of a session that the streamed answer is complete.
+
+    The queued chunks are posted first. The completion message then carries the 
+    final answer text and the parsed follow-up options, so clients replace what 
+    they have received: a streamed attempt that failed partway and was retried 
+    without streaming leaves them with truncated text otherwise.
+    """
+    if publisher is not None:
+        publisher.close()
+    try:
+        invoke_event_notification(session_id, json.dumps({
+            "type": "complete",
+            "content": response.get("llm_output", ""),
+            "options": response.get("options", [])
+        }))
+    except Exception as e:
+        logger.error(f"Error publishing stream completion to AppSync: {e}")
+
 def log_user_engagement(
     session_id, 
     document_id=None, 
@@ -111,48 +414,57 @@ def log_user_engagement(
     user_role=None, 
     user_info=None
 ):
-    connection = connect_to_db()
-    if connection is None:
-        logger.error("No database connection available.")
-        return {
-            "statusCode": 500,
-            "body": json.dumps("Database connection failed.")
-        }
+    """
+    Record a user engagement event.
 
+    The event is buffered in memory and written by flush_user_engagement once 
+    the request has been answered, so logging never adds a database round trip 
+    before the LLM call.
+    """
+    engagement_buffer.append({
+        "log_id": str(uuid.uuid4()),
+        "session_id": session_id,
+        "document_id": document_id,
+        "engagement_type": engagement_type,
+        "engagement_details": engagement_details,
+        "user_role": user_role,
+        "user_info": user_info,
+        "timestamp": datetime.datetime.now().isoformat()
+    })
+
+def insert_user_engagement(records):
+    """
+    Insert buffered engagement records into user_engagement_log in a single statement.
+    """
+    connection = connect_to_db()
+    cur = None
     try:
         cur = connection.cursor()
-
-        # Define the SQL query
-        query = """
-        INSERT INTO user_engagement_log (
-            log_id, session_id, document_id, engagement_type, 
-            engagement_details, user_role, user_info, timestamp
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        """
-
-        # Generate a unique log ID and current timestamp
-        log_id = str(uuid.uuid4())
-        timestamp = datetime.datetime.now()
-
-        # Execute the query
-        cur.execute(
-            query, 
-            (
-                log_id, 
-                session_id, 
-                document_id, 
-                engagement_type, 
-                engagement_details, 
-                user_role, 
-                user_info, 
-                timestamp
-            )
+        execute_values(
+            cur,
+            """
+            INSERT INTO user_engagement_log (
+                log_id, session_id, document_id, engagement_type, 
+                engagement_details, user_role, user_info, timestamp
+            ) VALUES %s
+            ON CONFLICT (log_id) DO NOTHING
+            """,
+            [
+                (
+                    record["log_id"],
+                    record["session_id"],
+                    record["document_id"],
+                    record["engagement_type"],
+                    record["engagement_details"],
+                    record["user_role"],
+                    record["user_info"],
+                    record["timestamp"]
+                )
+                for record in records
+            ]
         )
-
-        # Commit the transaction
         connection.commit()
-        logger.info("User engagement logged successfully.")
-
+        logger.info(f"Logged {len(records)} user engagement records.")
     except Exception as e:
         connection.rollback()
         logger.error(f"Error logging user engagement: {e}")
@@ -160,6 +472,33 @@ def log_user_engagement(
         if cur:
             cur.close()
 
+def flush_user_engagement():
+    """
+    Write the engagement records buffered during this request.
+
+    With ENGAGEMENT_LOG_QUEUE_URL set, the records are sent as one SQS message 
+    and bulk-inserted by the engagement log consumer together with those of 
+    other requests; otherwise, or if the queue cannot be reached, they are 
+    inserted directly with a single multi-row INSERT.
+    """
+    if not engagement_buffer:
+        return
+    records = list(engagement_buffer)
+    engagement_buffer.clear()
+
+    if ENGAGEMENT_LOG_QUEUE_URL:
+        try:
+            get_client("sqs").send_message(
+                QueueUrl=ENGAGEMENT_LOG_QUEUE_URL,
+                MessageBody=json.dumps(records)
+            )
+            logger.info(f"Queued {len(records)} user engagement records.")
+            return
+        except Exception as e:
+            logger.error(f"Error queueing user engagement, writing directly: {e}")
+
+    insert_user_engagement(records)
+
 def get_combined_guidelines(criteria_list):
     """
     Fetch and organize headers and bodies of all guidelines matching the given criteria names.
@@ -213,6 +552,32 @@ def get_combined_guidelines(criteria_list):
 
 
 def get_prompt_for_role(user_role):
+    """
+    Return the latest system prompt for a role.
+
+    Prompts are cached per container. Within PROMPT_CACHE_TTL_SECONDS the cached 
+    prompt is served without touching the database; after that, only the prompt 
+    version (the newest time_created for the role) is checked, and the prompt 
+    itself is fetched again only if an admin has saved a newer one. The shared 
+    database connection is left open for the rest of the request.
+    """
+    # Map valid roles to column names
+    role_column_mapping = {
+        "public": "public",
+        "educator": "educator",
+        "admin": "admin"
+    }
+
+    # Validate user_role and get corresponding column name
+    if user_role not in role_column_mapping:
+        logger.error(f"Invalid user_role: {user_role}")
+        return None
+    column_name = role_column_mapping[user_role]
+
+    cached = prompt_cache.get(user_role)
+    if cached and time.monotonic() - cached["checked_at"] < PROMPT_CACHE_TTL_SECONDS:
+        return cached["prompt"]
+
     connection = connect_to_db()
     if connection is None:
         logger.error("No database connection available.")
@@ -221,26 +586,27 @@ def get_prompt_for_role(user_role):
             "body": json.dumps("Database connection failed.")
         }
         
+    cur = None
     try:
         cur = connection.cursor()
-        logger.info("Connected to RDS instance!")
 
-        # Map valid roles to column names
-        role_column_mapping = {
-            "public": "public",
-            "educator": "educator",
-            "admin": "admin"
-        }
-
-        # Validate user_role and get corresponding column name
-        if user_role not in role_column_mapping:
-            logger.error(f"Invalid user_role: {user_role}")
-            return None
-        column_name = role_column_mapping[user_role]
+        if cached:
+            # Cheap version check before refetching the prompt text
+            cur.execute(f"""
+                SELECT MAX(time_created)
+                FROM prompts
+                WHERE {column_name} IS NOT NULL;
+            """)
+            version = cur.fetchone()[0]
+            if version == cached["version"]:
+                connection.commit()
+                cached["checked_at"] = time.monotonic()
+                logger.info(f"{user_role.capitalize()} prompt unchanged, using cached prompt.")
+                return cached["prompt"]
 
         # Construct query using safe column name
         query = f"""
-            SELECT {column_name}
+            SELECT {column_name}, time_created
             FROM prompts
             WHERE {column_name} IS NOT NULL
             ORDER BY time_created DESC NULLS LAST
@@ -249,10 +615,16 @@ def get_prompt_for_role(user_role):
         logger.debug(f"Executing query: {query}")
         cur.execute(query)
         result = cur.fetchone()
+        connection.commit()
         logger.debug(f"Query result for role {user_role}: {result}")
 
         if result and result[0]:
             prompt = str(result[0])
+            prompt_cache[user_role] = {
+                "prompt": prompt,
+                "version": result[1],
+                "checked_at": time.monotonic()
+            }
             logger.info(f"{user_role.capitalize()} prompt fetched successfully.")
             return prompt
         else:
@@ -266,58 +638,219 @@ def get_prompt_for_role(user_role):
     finally:
         if cur:
             cur.close()
-        if connection:
-            connection.close()
-        logger.info("Connection closed.")
 
-def check_embeddings():
+def get_corpus_state():
+    """
+    Probe whether the document corpus has any embeddings, and return a generation 
+    stamp that changes whenever ingestion inserts, updates or deletes embeddings.
+
+    The probe uses a catalog lookup, an EXISTS over a single row and the table's 
+    write counters from pg_stat_user_tables, so it never scans the table. Results 
+    are cached per container for CORPUS_STATE_TTL_SECONDS.
+
+    Returns:
+        dict: {"ready": bool, "generation": int}, or None if the probe failed.
+    """
+    global corpus_state, corpus_state_checked_at
+    if corpus_state is not None and time.monotonic() - corpus_state_checked_at < CORPUS_STATE_TTL_SECONDS:
+        return corpus_state
+
     connection = connect_to_db()
-    if connection is None:
-        logger.error("No database connection available.")
-        return {
-            "statusCode": 500,
-            "body": json.dumps("Database connection failed.")
-        }
+    cur = None
     try:
         cur = connection.cursor()
-
-        # Check if table exists
-        cur.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_name = 'langchain_pg_embedding'
-            );
-        """)
+        cur.execute("SELECT to_regclass('langchain_pg_embedding') IS NOT NULL;")
         table_exists = cur.fetchone()[0]
 
         if not table_exists:
-            logger.warning("Table 'langchain_pg_embedding' does not exist.")
-            return False
-
-        # Check if table has rows
-        cur.execute("SELECT COUNT(*) FROM langchain_pg_embedding;")
-        row_count = cur.fetchone()[0]
-
-        if row_count == 0:
-            logger.warning("Table 'langchain_pg_embedding' exists but has no rows.")
-            return False
-
-        logger.info(f"Table 'langchain_pg_embedding' exists and has {row_count} rows.")
-        return True
+            state = {"ready": False, "generation": 0}
+        else:
+            cur.execute("""
+                SELECT
+                    EXISTS (SELECT 1 FROM langchain_pg_embedding LIMIT 1),
+                    COALESCE((
+                        SELECT n_tup_ins + n_tup_upd + n_tup_del
+                        FROM pg_stat_user_tables
+                        WHERE relname = 'langchain_pg_embedding'
+                    ), 0);
+            """)
+            has_rows, generation = cur.fetchone()
+            state = {"ready": has_rows, "generation": generation}
+        connection.commit()
 
     except Exception as e:
-        logger.error(f"Error checking embeddings table: {e}")
+        logger.error(f"Error probing embeddings table: {e}")
         connection.rollback()
-        return False
+        return None
     finally:
         if cur:
             cur.close()
-        logger.info("Connection closed.")
 
+    # An empty corpus is not cached, so the first upload is picked up immediately
+    if state["ready"]:
+        corpus_state = state
+        corpus_state_checked_at = time.monotonic()
+    return state
+
+def get_corpus_generation():
+    """
+    Return the current corpus generation stamp, or None if it cannot be probed.
+    """
+    state = get_corpus_state()
+    return state["generation"] if state else None
+
+def check_embeddings():
+    state = get_corpus_state()
+    if state is None:
+        return False
+
+    if not state["ready"]:
+        logger.warning("Table 'langchain_pg_embedding' does not exist or has no rows.")
+        return False
+
+    logger.info(f"Table 'langchain_pg_embedding' has rows (generation {state['generation']}).")
+    return True
+
+
+def get_answer_cache_scope(session_id, user_role, user_prompt, stored_messages=None):
+    """
+    Return the (role, prompt version, corpus generation) scope under which the 
+    answer to this turn may be cached, or None if the turn is not cacheable.
+
+    Only first turns are cached: a session with existing history would have its 
+    question rewritten against that history, so its answer is not reusable. The 
+    session's `stored_messages`, if already read, answer this without another 
+    DynamoDB request.
+    """
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    if stored_messages is not None:
+        if stored_messages:
+            return None
+    else:
+        try:
+            if has_chat_history(MESSAGE_TABLE_NAME, session_id, get_legacy_table_name()):
+                return None
+        except Exception as e:
+            logger.error(f"Error checking chat history, skipping answer cache: {e}")
+            return None
+
+    state = get_corpus_state()
+    if not state:
+        return None
+    return (user_role, get_prompt_version(user_prompt), state["generation"])
+
+
+def get_prompt_and_corpus_state(user_role, check_corpus):
+    """
+    Fetch the role prompt and, if `check_corpus` is set, check that the corpus 
+    has embeddings. Both queries use the shared database connection, so they 
+    run one after the other.
+
+    Returns:
+        tuple: The prompt (None if unavailable) and whether the corpus is ready 
+        (None if not checked).
+    """
+    with span("prompt_query"):
+        user_prompt = get_prompt_for_role(user_role)
+    if not user_prompt or not check_corpus:
+        return user_prompt, None
+    with span("corpus_check"):
+        return user_prompt, check_embeddings()
+
+
+def load_chat_history(session_id):
+    """
+    Read a session's recent messages ahead of the chain, with the number of 
+    stored messages before them, or return None if the read fails, in which 
+    case the chain reads them itself.
+    """
+    try:
+        with span("history_read"):
+            return get_chat_history(
+                MESSAGE_TABLE_NAME, session_id, HISTORY_READ_LIMIT, get_legacy_table_name(), history_cache
+            )
+    except Exception as e:
+        logger.error(f"Error reading chat history ahead of the chain: {e}")
+        return None
+
+
+def warm_retrieval(history_aware_retriever, user_query):
+    """
+    Run the retrieval for a question whose search query does not depend on a 
+    rewrite, filling the retriever's caches before the chain asks for it.
+    """
+    try:
+        history_aware_retriever.invoke({"input": user_query, "chat_history": []})
+    except Exception as e:
+        logger.error(f"Error retrieving ahead of the chain: {e}")
+
+
+def settle_warm_retrieval(retrieval_future, wait=False):
+    """
+    Make sure a warm retrieval has finished before the handler returns.
+
+    The retrieval shares the database connection with the next request, so it 
+    must not keep running once the invocation is over. Unless `wait` is set, a 
+    retrieval that has not started yet (e.g. after an answer cache hit) is 
+    cancelled instead of being waited for.
+    """
+    if retrieval_future is None:
+        return
+    if not wait and retrieval_future.cancel():
+        return
+    retrieval_future.result()
+
+
+def get_deadline(context):
+    """
+    Return the time.monotonic() value after which no new LLM attempt should start, 
+    leaving RESPONSE_DEADLINE_MARGIN_SECONDS to return a response before the 
+    invocation times out.
+    """
+    if context is None:
+        return None
+    remaining_seconds = context.get_remaining_time_in_millis() / 1000
+    return time.monotonic() + remaining_seconds - RESPONSE_DEADLINE_MARGIN_SECONDS
 
 
 def handler(event, context):
-    initialize_constants()
+    """
+    Handle a chat request and emit its stage latencies as one EMF record.
+    """
+    global cold_start
+    trace = start_trace()
+    was_cold_start, cold_start = cold_start, False
+    response = None
+    try:
+        response = handle_request(event, context)
+    finally:
+        # Started alongside the answer, so normally already finished
+        wait_for_summary_folds()
+        with span("engagement_log"):
+            flush_user_engagement()
+        query_params = event.get("queryStringParameters") or {}
+        emit_trace(
+            trace,
+            namespace=TRACE_METRICS_NAMESPACE,
+            cold_start=was_cold_start,
+            properties={
+                "session_id": query_params.get("session_id", ""),
+                "request_id": getattr(context, "aws_request_id", None),
+                "status_code": response.get("statusCode") if response else None,
+            }
+        )
+
+    if TRACE_RESPONSE_HEADERS:
+        response.setdefault("headers", {}).update({
+            "Server-Timing": get_server_timing(trace),
+            "Timing-Allow-Origin": "*",
+            "Access-Control-Expose-Headers": "Server-Timing",
+        })
+    return response
+
+
+def handle_request(event, context):
     logger.info("Text Generation Lambda function is called!")
     initialize_constants()
 
@@ -346,6 +879,7 @@ def handler(event, context):
     user_role = body.get("user_role", "")
     comparison = body.get("comparison", "")
     criteria = body.get("criteria", "")
+    stream = bool(body.get("stream", False)) and bool(APPSYNC_API_URL)
     
     
     
@@ -367,7 +901,7 @@ def handler(event, context):
             # Replace the existing MD5 hashing with SHA-256
             unique_dedup_string = f"{json.dumps(message_body)}-{time.time_ns()}-{uuid.uuid4()}"
             message_deduplication_id = hashlib.sha256(unique_dedup_string.encode('utf-8')).hexdigest()
-            sqs.send_message(
+            get_client("sqs").send_message(
                 QueueUrl=os.environ["COMP_TEXT_GEN_QUEUE_URL"],
                 MessageBody=json.dumps(message_body),
                 MessageGroupId=session_id,  # Add MessageGroupId for FIFO queue
@@ -396,8 +930,12 @@ def handler(event, context):
                 'body': json.dumps('Error sending message to SQS')
             }
     
+    # Independent I/O runs concurrently: the database queries (role prompt, then 
+    # corpus check) and, for a question, the read of the session's history
     logger.info("Fetching prompts from the database.")
-    user_prompt = get_prompt_for_role(user_role)
+    database_future = io_executor.submit(get_prompt_and_corpus_state, user_role, bool(question))
+    history_future = io_executor.submit(load_chat_history, session_id) if question else None
+    user_prompt, corpus_ready = database_future.result()
 
     if not user_prompt:
         logger.error(f"Error fetching system prompt for user_role: {user_role}")
@@ -448,23 +986,6 @@ def handler(event, context):
         )
         logger.info(f"User role {user_role} logged in engagement log.")
     
-    try:
-        logger.info("Creating Bedrock LLM instance.")
-        llm = get_bedrock_llm(BEDROCK_LLM_ID)
-        
-    except Exception as e:
-        logger.error(f"Error getting LLM from Bedrock: {e}")
-        return {
-            'statusCode': 500,
-            "headers": {
-                "Content-Type": "application/json",
-                "Access-Control-Allow-Headers": "*",
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "*",
-            },
-            'body': json.dumps('Error getting LLM from Bedrock')
-        }
-    
     try:
         logger.info("Retrieving vectorstore config.")
         db_secret = get_secret(DB_SECRET_NAME)
@@ -488,7 +1009,7 @@ def handler(event, context):
             },
             'body': json.dumps('Error retrieving vectorstore config')
         }
-    if not check_embeddings():
+    if not corpus_ready:
         return {
             'statusCode': 500,
             "headers": {
@@ -501,15 +1022,14 @@ def handler(event, context):
                 "Error: The Administrator has not uploaded Digital Strategy documents, please contact the Administrator."
             )
         }
-    try:
-        logger.info("Creating history-aware retriever.")
-        
-        history_aware_retriever = get_vectorstore_retriever(
-            llm=llm,
-            vectorstore_config_dict=vectorstore_config_dict,
-            embeddings=embeddings
-        )
 
+    recent_history = history_future.result()
+    set_prefetched_messages(session_id, recent_history)
+    stored_messages = recent_history[0] if recent_history is not None else None
+
+    try:
+        with span("runtime_build"):
+            rag_runtime = get_rag_runtime(user_prompt, vectorstore_config_dict)
 
     except Exception as e:
         logger.error(f"Error creating history-aware retriever: {e}")
@@ -523,21 +1043,101 @@ def handler(event, context):
             },
             'body': json.dumps('Error creating history-aware retriever')
         }
-    
+
+    if stored_messages:
+        # Fold the turns that left the window last turn into the rolling summary 
+        # while this one is answered, instead of after the answer is written
+        start_summary_fold(
+            rag_runtime["conversational_rag_chain"].get_session_history(session_id), io_executor
+        )
+
+    answer_cache_scope = get_answer_cache_scope(session_id, user_role, user_prompt, stored_messages)
+    # Without a rewrite the search query is known already, so the retrieval runs 
+    # while the answer cache is checked, and the chain then finds it cached. 
+    # Every path below settles it before returning.
+    retrieval_future = None
+    if stored_messages == [] or is_self_contained(user_query):
+        retrieval_future = io_executor.submit(warm_retrieval, rag_runtime["history_aware_retriever"], user_query)
+
+    cached_response, question_embedding = None, None
+    if answer_cache_scope:
+        try:
+            with span("answer_cache"):
+                cached_response, question_embedding = answer_cache.lookup(
+                    *answer_cache_scope,
+                    question=question,
+                    embed_query=get_embeddings().embed_query
+                )
+        except Exception as e:
+            logger.error(f"Error looking up answer cache: {e}")
+
+    if cached_response:
+        try:
+            try:
+                with span("history_write"):
+                    append_chat_history(
+                        MESSAGE_TABLE_NAME, session_id, user_query, cached_response["answer"],
+                        get_legacy_table_name(), get_history_compress_min_bytes(), history_cache
+                    )
+            except Exception as e:
+                logger.error(f"Error appending cached answer to history: {e}")
+            if stream:
+                publish_stream_complete(session_id, cached_response)
+        finally:
+            settle_warm_retrieval(retrieval_future)
+        return {
+            "statusCode": 200,
+            "headers": {
+                "Content-Type": "application/json",
+                "Access-Control-Allow-Headers": "*",
+                "Access-Control-Allow-Origin": "*",
+                "Access-Control-Allow-Methods": "*",
+            },
+            "body": json.dumps({
+                "type": "ai",
+                "content": cached_response["llm_output"],
+                "options": cached_response["options"],
+                "user_role": user_role
+            })
+        }
+
+    settle_warm_retrieval(retrieval_future, wait=True)
+
+    publisher = StreamPublisher(session_id) if stream else None
     try:
         logger.info("Generating response from the LLM.")
         
         response = get_response(
             query=user_query,
-            llm=llm,
-            history_aware_retriever=history_aware_retriever,
-            table_name=TABLE_NAME,
+            llm=rag_runtime["llm"],
+            history_aware_retriever=rag_runtime["history_aware_retriever"],
+            table_name=MESSAGE_TABLE_NAME,
             session_id=session_id,
-            user_prompt=user_prompt
+            user_prompt=user_prompt,
+            conversational_rag_chain=rag_runtime["conversational_rag_chain"],
+            on_chunk=publisher,
+            max_attempts=LLM_MAX_ATTEMPTS,
+            backoff_seconds=LLM_RETRY_BACKOFF_SECONDS,
+            deadline=get_deadline(context)
         )
         print("Response:", response)
+        if stream:
+            publish_stream_complete(session_id, response, publisher)
+        if answer_cache_scope and response.get("llm_output"):
+            try:
+                answer_cache.store(
+                    *answer_cache_scope,
+                    question=question,
+                    response=response,
+                    embed_query=get_embeddings().embed_query,
+                    embedding=question_embedding
+                )
+            except Exception as e:
+                logger.error(f"Error storing answer in cache: {e}")
     except Exception as e:
         logger.error(f"Error getting response: {e}")
+        if publisher is not None:
+            publisher.close()
         return {
             'statusCode': 500,
             "headers": {
@@ -0,0 +1,29 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from helpers.context import trim_to_relevant_sentences
+
+
+def test_multi_paragraph_chunk_keeps_its_breaks():
+    text = (
+        "Course outcomes are listed below. Students reflect on their practice.\n\n"
+        "Assessment uses a portfolio. The portfolio is reviewed twice a term.\n\n"
+        "Unrelated closing remarks. More filler text here."
+    )
+    trimmed = trim_to_relevant_sentences(text, {"outcomes", "portfolio", "assessment"}, max_sentences=3)
+    assert trimmed == (
+        "Course outcomes are listed below.\n\n"
+        "Assessment uses a portfolio. The portfolio is reviewed twice a term."
+    )
+
+
+def test_list_items_stay_on_their_own_lines():
+    text = "Requirements:\n- Attend the seminar.\n- Submit the essay.\n- Enjoy the break.\n- Present the project."
+    trimmed = trim_to_relevant_sentences(text, {"seminar", "essay", "project"}, max_sentences=3)
+    assert trimmed == "Requirements:\n- Attend the seminar.\n- Submit the essay.\n- Present the project."
+
+
+def test_short_chunk_is_returned_unchanged():
+    text = "  One sentence.\n\nTwo sentences.  "
+    assert trim_to_relevant_sentences(text, {"sentence"}, max_sentences=6) == "One sentence.\n\nTwo sentences."
@@ -0,0 +1,42 @@
+import ast
+import os
+
+CDK_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CHAT_HELPERS = os.path.join(CDK_DIR, "text_generation", "src", "helpers")
+COMPARISON_CONTEXT = os.path.join(CDK_DIR, "comparison_text_generation", "src", "helpers", "context.py")
+
+# Shared with helpers/rerank.py in the chat image; defined in the comparison copy itself
+RERANK_NAMES = ("CHARS_PER_TOKEN", "STOPWORDS", "estimate_tokens")
+
+
+def read_definitions(path):
+    """
+    Map each top-level function and assigned name of a module to a comparable form.
+    """
+    with open(path) as source:
+        tree = ast.parse(source.read())
+    definitions = {}
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef):
+            definitions[node.name] = ast.dump(node)
+        elif isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            try:
+                definitions[node.targets[0].id] = ast.literal_eval(node.value)
+            except ValueError:
+                definitions[node.targets[0].id] = ast.dump(node.value)
+    return definitions
+
+
+def test_comparison_context_matches_chat_context():
+    chat = read_definitions(os.path.join(CHAT_HELPERS, "context.py"))
+    comparison = read_definitions(COMPARISON_CONTEXT)
+    assert set(comparison) - set(RERANK_NAMES) == set(chat)
+    for name, definition in chat.items():
+        assert comparison[name] == definition, f"{name} differs between the two context.py copies"
+
+
+def test_comparison_context_matches_rerank_constants():
+    rerank = read_definitions(os.path.join(CHAT_HELPERS, "rerank.py"))
+    comparison = read_definitions(COMPARISON_CONTEXT)
+    for name in RERANK_NAMES:
+        assert comparison[name] == rerank[name], f"{name} differs from helpers/rerank.py"